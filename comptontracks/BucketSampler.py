@@ -0,0 +1,74 @@
+###################################################################################################
+#
+# BucketSampler.py
+#
+# Copyright (C) by Andreas Zoglauer & Pranav Nagarajan
+# All rights reserved.
+#
+# Please see the file LICENSE in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+import numpy as np
+
+
+class BucketSampler:
+    """
+    Groups events into buckets of similar hit and edge counts and draws batches from within a bucket,
+    so that padding every event to the largest one of its batch stays cheap.
+
+    Every epoch is a fresh random order of the events: the events of each bucket are shuffled,
+    cut into batches, and the batches of all buckets are shuffled again. Events left over at the end
+    of the buckets are sorted by size and batched together. Like the unbucketed batches, all batches
+    are full, thus up to batch_size - 1 leftover events, chosen at random, are skipped in each epoch.
+    """
+
+    def __init__(self, hits, edges, batch_size, hit_boundaries=(), edge_boundaries=(), shuffle=True, seed=None):
+        """
+        hits, edges: number of hits and edges of each event
+        hit_boundaries, edge_boundaries: bucket boundaries (bucket i holds boundary[i-1] <= count < boundary[i])
+        shuffle: draw a new random order every epoch, otherwise keep the events in bucket order
+        """
+        self.hits = np.asarray(hits)
+        self.edges = np.asarray(edges)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+
+        hit_bucket = np.digitize(self.hits, np.asarray(hit_boundaries))
+        edge_bucket = np.digitize(self.edges, np.asarray(edge_boundaries))
+        bucket = hit_bucket * (len(edge_boundaries) + 1) + edge_bucket
+        self.buckets = [np.flatnonzero(bucket == b) for b in np.unique(bucket)]
+
+    def __len__(self):
+        return len(self.hits) // self.batch_size
+
+    def epoch(self):
+        """
+        Returns the list of event index arrays, one per batch, for the next epoch
+        """
+        batches = []
+        leftovers = []
+        for bucket in self.buckets:
+            if self.shuffle:
+                bucket = self.rng.permutation(bucket)
+            full = len(bucket) - len(bucket) % self.batch_size
+            batches.extend(self.split(bucket[:full]))
+            leftovers.append(bucket[full:])
+
+        # The skipped events are drawn before sorting, otherwise they would always be the largest ones
+        leftovers = np.concatenate(leftovers)
+        if self.shuffle:
+            leftovers = self.rng.permutation(leftovers)
+        leftovers = leftovers[:len(leftovers) - len(leftovers) % self.batch_size]
+        leftovers = leftovers[np.lexsort((self.edges[leftovers], self.hits[leftovers]))]
+        batches.extend(self.split(leftovers))
+
+        if self.shuffle:
+            batches = [batches[i] for i in self.rng.permutation(len(batches))]
+
+        return batches
+
+    def split(self, indices):
+        # Cuts indices (a multiple of the batch size long) into batches
+        return [indices[i:i + self.batch_size] for i in range(0, len(indices), self.batch_size)]
@@ -5,6 +5,8 @@ message-passing graph neural networks for hit or segment classification.
 Citation: CTD 2018: https://arxiv.org/abs/1810.06111.
 """
 
+import copy
+
 import torch
 import torch.nn as nn
 
@@ -91,3 +93,147 @@ class GNNSegmentClassifier(nn.Module):
             H = torch.cat([H, X], dim=-1)
         # Apply final edge network
         return self.edge_network(H, Ri, Ro)
+
+
+# Scatter-based variants of the networks above. A batch is one graph of all its events,
+# concatenated without padding: X has the shape (hits, features) and instead of the
+# incidence matrices the edge_index (2, edges) holds the sending and receiving hit of
+# each edge. Thus memory and FLOPs scale with the true number of hits and edges.
+
+class EdgeNetworkSparse(nn.Module):
+    """
+    Edge network on an edge list: gathers the features of the sending
+    and receiving node of each edge instead of Ro^T X and Ri^T X.
+    """
+    def __init__(self, input_dim, hidden_dim=8, hidden_activation=nn.Tanh):
+        super(EdgeNetworkSparse, self).__init__()
+        self.network = nn.Sequential(
+            nn.Linear(input_dim*2, hidden_dim),
+            hidden_activation(),
+            nn.Linear(hidden_dim, 1),
+            nn.Sigmoid())
+    def forward(self, X, edge_index):
+        # Select the features of the associated nodes
+        bo = X[edge_index[0]]
+        bi = X[edge_index[1]]
+        B = torch.cat([bo, bi], dim=1)
+        # Apply the network to each edge
+        return self.network(B).squeeze(-1)
+
+class NodeNetworkSparse(nn.Module):
+    """
+    Node network on an edge list: sums the weighted messages of the
+    incoming and outgoing edges of each node with index_add_ instead
+    of (Ri * e) @ (Ro^T X) and (Ro * e) @ (Ri^T X).
+    """
+    def __init__(self, input_dim, output_dim, hidden_activation=nn.Tanh):
+        super(NodeNetworkSparse, self).__init__()
+        self.network = nn.Sequential(
+            nn.Linear(input_dim*3, output_dim),
+            hidden_activation(),
+            nn.Linear(output_dim, output_dim),
+            hidden_activation())
+    def forward(self, X, e, edge_index):
+        senders, receivers = edge_index[0], edge_index[1]
+        bo = X[senders]
+        bi = X[receivers]
+        mi = torch.zeros_like(X).index_add_(0, receivers, e[:,None] * bo)
+        mo = torch.zeros_like(X).index_add_(0, senders, e[:,None] * bi)
+        M = torch.cat([mi, mo, X], dim=1)
+        return self.network(M)
+
+class GNNSegmentClassifierSparse(nn.Module):
+    """
+    Segment classification graph neural network model on a concatenated
+    batch graph, with the same layers (and parameters) as GNNSegmentClassifier.
+    """
+    def __init__(self, input_dim=2, hidden_dim=8, n_iters=3, hidden_activation=nn.Tanh):
+        super(GNNSegmentClassifierSparse, self).__init__()
+        self.n_iters = n_iters
+        # Setup the input network
+        self.input_network = nn.Sequential(
+            nn.Linear(input_dim, hidden_dim),
+            hidden_activation())
+        # Setup the edge network
+        self.edge_network = EdgeNetworkSparse(input_dim+hidden_dim, hidden_dim,
+                                              hidden_activation)
+        # Setup the node layers
+        self.node_network = NodeNetworkSparse(input_dim+hidden_dim, hidden_dim,
+                                              hidden_activation)
+
+    def forward(self, inputs):
+        """Apply forward pass of the model"""
+        X, edge_index = inputs
+        # Apply input network to get hidden representation
+        H = self.input_network(X)
+        # Shortcut connect the inputs onto the hidden representation
+        H = torch.cat([H, X], dim=-1)
+        # Loop over iterations of edge and node networks
+        for i in range(self.n_iters):
+            # Apply edge network
+            e = self.edge_network(H, edge_index)
+            # Apply node network
+            H = self.node_network(H, e, edge_index)
+            # Shortcut connect the inputs onto the hidden representation
+            H = torch.cat([H, X], dim=-1)
+        # Apply final edge network
+        return self.edge_network(H, edge_index)
+
+
+def concatenate_graphs(graphs):
+    """
+    Collates a batch of (X, edge_index) graphs into one graph for the sparse models:
+    the hits are concatenated and each graph's edges are shifted by its hit offset.
+    Returns X, edge_index and the number of edges of each graph.
+    """
+    offsets = torch.cumsum(torch.tensor([0] + [len(X) for X, edge_index in graphs[:-1]]), dim=0)
+    X = torch.cat([torch.as_tensor(X) for X, edge_index in graphs])
+    edge_index = torch.cat([torch.as_tensor(edge_index, dtype=torch.long) + offset
+                            for (X_, edge_index), offset in zip(graphs, offsets)], dim=1)
+    edges = [edge_index_.shape[1] for X_, edge_index_ in graphs]
+    return X, edge_index, edges
+
+
+def pad_graphs(graphs):
+    """
+    Collates a batch of (X, edge_index) graphs for the dense models: the features and the
+    incidence matrices Ri and Ro are padded to the largest graph of this batch only.
+    Returns X, Ri, Ro and the number of edges of each graph.
+    """
+    max_hits = max(len(X) for X, edge_index in graphs)
+    edges = [edge_index.shape[1] for X, edge_index in graphs]
+    X = torch.zeros((len(graphs), max_hits, graphs[0][0].shape[1]))
+    Ri = torch.zeros((len(graphs), max_hits, max(edges)))
+    Ro = torch.zeros((len(graphs), max_hits, max(edges)))
+    for b, (X_, edge_index) in enumerate(graphs):
+        edge_index = torch.as_tensor(edge_index, dtype=torch.long)
+        X[b, :len(X_)] = torch.as_tensor(X_)
+        Ro[b, edge_index[0], torch.arange(edges[b])] = 1
+        Ri[b, edge_index[1], torch.arange(edges[b])] = 1
+    return X, Ri, Ro, edges
+
+
+class BFloat16Inference(nn.Module):
+    """
+    Wraps a model whose weights were converted to bfloat16:
+    casts the inputs to bfloat16 and the edge scores back to float32.
+    """
+    def __init__(self, model):
+        super(BFloat16Inference, self).__init__()
+        self.model = model
+    def forward(self, inputs):
+        return self.model([a.to(torch.bfloat16) if a.is_floating_point() else a for a in inputs]).float()
+
+def reduced_precision(model, precision='int8'):
+    """
+    Returns a copy of a trained model for faster inference on CPUs.
+    int8: dynamic quantization of the linear layers of the input, edge and node
+          networks (int8 weights, activations quantized on the fly)
+    bfloat16: all weights and computations in bfloat16
+    """
+    model = copy.deepcopy(model).cpu().eval()
+    if precision == 'int8':
+        return torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    if precision == 'bfloat16':
+        return BFloat16Inference(model.to(torch.bfloat16))
+    raise ValueError('Unsupported precision ' + precision)
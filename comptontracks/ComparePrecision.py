@@ -0,0 +1,171 @@
+###################################################################################################
+#
+# ComparePrecision.py
+#
+# Copyright (C) by Andreas Zoglauer & Pranav Nagarajan
+# All rights reserved.
+#
+# Please see the file LICENSE in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+
+
+###################################################################################################
+import os
+import argparse
+import json
+import time as t
+
+import numpy as np
+
+print("\nCompton Track Identification - Inference Precision Comparison")
+print("=============================================================\n")
+
+'''
+Compares the reduced precision (bfloat16) inference of a segment classifier trained by ComptonTrackIdentificationGNN.py
+with its float32 inference on the same events and batches: edge accuracy, precision and recall of both,
+how much the scores and decisions change, and the throughput in events/s of the predictions.
+'''
+
+
+
+###################################################################################################
+# Step 1: Input parameters
+###################################################################################################
+
+
+parser = argparse.ArgumentParser(description='Compare reduced precision with float32 inference of a trained GNN.')
+parser.add_argument('-f', '--filename', default='ComptonTrackIdentification_LowEnergy.p1.sim', help='File name of the events')
+parser.add_argument('-g', '--geometry', default='$(MEGALIB)/resource/examples/geomega/GRIPS/GRIPS.geo.setup', help='Geometry with which the sim file was created')
+parser.add_argument('-w', '--model', default='Results', help='Output directory of the training run with SegmentClassifier.h5 and SegmentClassifier.json')
+parser.add_argument('-p', '--precision', default='bfloat16', help='Reduced precision to compare with float32')
+parser.add_argument('-m', '--maxevents', default='10000', help='Number of events to compare on')
+parser.add_argument('-b', '--batchsize', default='1024', help='Batch size of the predictions')
+parser.add_argument('-j', '--workers', default='1', help='Number of processes parsing the sim file in parallel')
+parser.add_argument('-v', '--threshold', default='0.5', help='Score above which an edge is predicted true')
+parser.add_argument('-t', '--testing', default='False', help='Toy testing mode: compare on toy model events instead of a sim file')
+
+args = parser.parse_args()
+
+ModelDirectory = args.model
+Precision = args.precision
+MaxEvents = int(args.maxevents)
+BatchSize = max(1, int(args.batchsize))
+Workers = max(1, int(args.workers))
+Threshold = float(args.threshold)
+UseToyModel = args.testing == "True"
+
+with open(ModelDirectory + os.path.sep + "SegmentClassifier.json") as f:
+  ModelParameters = json.load(f)
+
+GraphMode = ModelParameters["graph_mode"]
+Acceptance = ModelParameters["acceptance"]
+Radius = ModelParameters["radius"]
+
+
+import tensorflow as tf
+tf.compat.v1.disable_eager_execution()
+
+from GraphRepresentation import GraphRepresentation
+from EdgeFilter import EdgeFilter
+from EventStore import EventStore
+from GNNTraining import GNNTraining
+from SegmentClassifier import SegmentClassifier
+from StreamingEvaluator import StreamingEvaluator
+
+if "edgefilter" in ModelParameters:
+  GraphRepresentation.edgeFilter = EdgeFilter(**ModelParameters["edgefilter"])
+
+
+
+###################################################################################################
+# Step 2: Read the events and build the batches
+###################################################################################################
+
+
+if UseToyModel == True:
+  import ToyModel
+  DataSets = ToyModel.generate(MaxEvents, Seed=1, Model="V2")
+else:
+  # Everything ROOT related can only be loaded here otherwise it interferes with the argparse
+  from EventData import EventData
+  from SimFileParser import SimFileParser
+
+  def ParseEvent(Event):
+    Data = EventData()
+    Data.setAcceptance(Acceptance)
+    if Data.parse(Event) == True:
+      return Data
+    return None
+
+  DataSets, _, _ = SimFileParser(args.filename, args.geometry, Workers).parse(ParseEvent, MaxEvents, DataSets=EventStore())
+  DataSets.shrink()
+
+Graphs = [GraphRepresentation.newGraphRepresentation(event, radius=Radius) for event in DataSets]
+BatchGraphs = [Graphs[b:b + BatchSize] for b in range(0, len(Graphs), BatchSize)]
+Batches = [GNNTraining.concatenate_batch(graphs) if GraphMode == "sparse" else GNNTraining.pad_batch(graphs) for graphs in BatchGraphs]
+
+print("Info: {} events in {} batches".format(len(Graphs), len(Batches)))
+
+
+
+###################################################################################################
+# Step 3: Predict with both precisions
+###################################################################################################
+
+
+def Predict(Model):
+  """
+  Returns the per-edge scores of all graphs, the evaluator with the edge metrics, and the prediction time
+  """
+  # Warm up, e.g. to exclude the graph optimization from the timing
+  Model.predict_on_batch(Batches[0][0])
+
+  Evaluator = StreamingEvaluator(threshold = Threshold)
+  Scores = []
+  Elapsed = 0
+  for graphs, (inputs, labels) in zip(BatchGraphs, Batches):
+    start = t.time()
+    Prediction = Model.predict_on_batch(inputs)
+    Elapsed += t.time() - start
+
+    if GraphMode == "sparse":
+      Predictions = np.split(Prediction[0], np.cumsum([len(graph.graphData[4]) for graph in graphs[:-1]]))
+    else:
+      Predictions = [p[:len(graph.graphData[4])] for graph, p in zip(graphs, Prediction)]
+    for graph, prediction in zip(graphs, Predictions):
+      Evaluator.add(graph, prediction)
+      Scores.append(prediction)
+
+  return np.concatenate(Scores), Evaluator, Elapsed
+
+
+Results = {}
+for ModelPrecision in ["float32", Precision]:
+  Model = SegmentClassifier(graph_mode = GraphMode, precision = ModelPrecision)
+  Model.load_weights(ModelDirectory + os.path.sep + "SegmentClassifier.h5")
+  Results[ModelPrecision] = Predict(Model)
+
+
+
+###################################################################################################
+# Step 4: Report
+###################################################################################################
+
+
+Reference, ReferenceEvaluator, ReferenceTime = Results["float32"]
+Reduced, ReducedEvaluator, ReducedTime = Results[Precision]
+ReferenceMetrics = ReferenceEvaluator.metrics()
+ReducedMetrics = ReducedEvaluator.metrics()
+
+print("\n{:<30} {:>12} {:>12} {:>12}".format("", "float32", Precision, "Change"))
+for Name in ["Accuracy", "Precision", "Recall", "Recall Compton"]:
+  if Name in ReferenceMetrics:
+    print("{:<30} {:>12.5f} {:>12.5f} {:>+12.5f}".format(Name, ReferenceMetrics[Name], ReducedMetrics[Name], ReducedMetrics[Name] - ReferenceMetrics[Name]))
+print("{:<30} {:>12.1f} {:>12.1f} {:>11.2f}x".format("Events/s (predict_on_batch)", len(Graphs) / ReferenceTime, len(Graphs) / ReducedTime, ReferenceTime / ReducedTime))
+
+Difference = np.abs(Reduced.astype(np.float64) - Reference)
+print("\nScore difference: mean {:.2e}, max {:.2e}".format(Difference.mean(), Difference.max()))
+print("Edge decisions changed (threshold {}): {} of {} ({:.4%})".format(Threshold, np.count_nonzero((Reduced > Threshold) != (Reference > Threshold)), len(Reference),
+                                                                        np.mean((Reduced > Threshold) != (Reference > Threshold))))
@@ -29,6 +29,8 @@ import math
 import csv
 import os
 import argparse
+import queue
+import threading
 from datetime import datetime
 from functools import reduce
 
@@ -88,6 +90,8 @@ parser.add_argument('-f', '--filename', default='ComptonTrackIdentification.p1.s
 parser.add_argument('-m', '--maxevents', default='10000', help='Maximum number of events to use')
 parser.add_argument('-s', '--testingtrainingsplit', default='0.1', help='Testing-training split')
 parser.add_argument('-b', '--batchsize', default='128', help='Batch size')
+parser.add_argument('-j', '--workers', default='1', help='Number of processes parsing the sim file in parallel')
+parser.add_argument('-p', '--prefetch', default='False', help='Prepare the next batch in a background thread while the current one trains')
 
 args = parser.parse_args()
 
@@ -103,6 +107,10 @@ if int(args.batchsize) >= 16:
 if float(args.testingtrainingsplit) >= 0.05:
    TestingTrainingSplit = float(args.testingtrainingsplit)
 
+Workers = max(1, int(args.workers))
+
+Prefetch = args.prefetch == "True"
+
 
 
 if os.path.exists(OutputDirectory):
@@ -135,6 +143,7 @@ signal.signal(signal.SIGINT, signal_handler)
 
 # Everything ROOT related can only be loaded here otherwise it interferes with the argparse
 from EventData import EventData
+from SimFileParser import SimFileParser
 
 # Load MEGAlib into ROOT so that it is usable
 import ROOT as M
@@ -169,25 +178,39 @@ if Reader.Open(M.MString(FileName)) == False:
 
 print("\n\nStarted reading data sets")
 NumberOfDataSets = 0
-while True:
-  Event = Reader.GetNextEvent()
-  if not Event:
-    break
-
-  if Event.GetNIAs() > 0:
+if Workers > 1:
+  def ParseEvent(Event):
     Data = EventData()
     if Data.parse(Event) == True:
       Data.center()
 
       if Data.hasHitsOutside(XMin, XMax, YMin, YMax, ZMin, ZMax) == False and Data.isOriginInside(XMin, XMax, YMin, YMax, ZMin, ZMax) == True:
-        DataSets.append(Data)
-        NumberOfDataSets += 1
+        return Data
+    return None
 
-        if NumberOfDataSets > 0 and NumberOfDataSets % 1000 == 0:
-          print("Data sets processed: {}".format(NumberOfDataSets))
+  DataSets, _, _ = SimFileParser(FileName, GeometryName, Workers).parse(ParseEvent, MaxEvents)
+  NumberOfDataSets = len(DataSets)
+
+else:
+  while True:
+    Event = Reader.GetNextEvent()
+    if not Event:
+      break
 
-  if NumberOfDataSets >= MaxEvents:
-    break
+    if Event.GetNIAs() > 0:
+      Data = EventData()
+      if Data.parse(Event) == True:
+        Data.center()
+
+        if Data.hasHitsOutside(XMin, XMax, YMin, YMax, ZMin, ZMax) == False and Data.isOriginInside(XMin, XMax, YMin, YMax, ZMin, ZMax) == True:
+          DataSets.append(Data)
+          NumberOfDataSets += 1
+
+          if NumberOfDataSets > 0 and NumberOfDataSets % 1000 == 0:
+            print("Data sets processed: {}".format(NumberOfDataSets))
+
+    if NumberOfDataSets >= MaxEvents:
+      break
 
 
 print("Info: Parsed {} events".format(NumberOfDataSets))
@@ -227,6 +250,124 @@ print(np.unique(np.array([event.unique for event in TestingDataSets])))
 print("Info: Number of training data sets: {}   Number of testing data sets: {} (vs. input: {} and split ratio: {})".format(NumberOfTrainingEvents, NumberOfTestingEvents, len(DataSets), TestingTrainingSplit))
 
 
+# The events only light up a few voxels, thus they are kept as sparse voxel lists
+# and only scattered into the (reused) dense input tensor of the batch which is trained or tested
+
+class VoxelDataSet:
+  '''
+  The hits of a list of events as flat voxel indices and energies, and the layer of each event's origin
+  '''
+
+  def __init__(self, Events, OutsideToLastLayer):
+    Voxels = []
+    Energies = []
+    self.Layers = np.zeros(len(Events), dtype=np.int64)
+    for e, Event in enumerate(Events):
+      # Same binning as int() of each hit, i.e. truncation towards zero
+      XBin = ((np.asarray(Event.X) - XMin) / ((XMax - XMin) / XBins)).astype(np.int64)
+      YBin = ((np.asarray(Event.Y) - YMin) / ((YMax - YMin) / YBins)).astype(np.int64)
+      ZBin = ((np.asarray(Event.Z) - ZMin) / ((ZMax - ZMin) / ZBins)).astype(np.int64)
+      Inside = (XBin >= 0) & (YBin >= 0) & (ZBin >= 0) & (XBin < XBins) & (YBin < YBins) & (ZBin < ZBins)
+      if OutsideToLastLayer == False and np.count_nonzero(Inside) == 0:
+        print("Nothing added for event {}".format(Event.ID))
+        Event.print()
+      Voxels.append(((XBin * YBins + YBin) * ZBins + ZBin)[Inside])
+      Energies.append(np.asarray(Event.E, dtype=np.float32)[Inside])
+
+      # Set the layer in which the event happened
+      if OutsideToLastLayer == True:
+        if Event.OriginPositionZ > ZMin and Event.OriginPositionZ < ZMax:
+          self.Layers[e] = int ((Event.OriginPositionZ - ZMin) / ((ZMax- ZMin)/ ZBins) )
+        else:
+          self.Layers[e] = OutputDataSpaceSize-1
+      else:
+        self.Layers[e] = int ((Event.OriginPositionZ - ZMin) / ((ZMax- ZMin)/ ZBins) )
+        if self.Layers[e] < 0 or self.Layers[e] >= OutputDataSpaceSize:
+          print("Error: The calculated layer bin ({}) is out of bounds [0, {}]".format(self.Layers[e], OutputDataSpaceSize-1))
+          self.Layers[e] = -1
+
+    self.Offsets = np.concatenate([[0], np.cumsum([len(v) for v in Voxels])])
+    self.Voxels = np.concatenate(Voxels)
+    self.Energies = np.concatenate(Energies)
+
+
+class VoxelBatch:
+  '''
+  Reused float32 input and output tensors of one batch
+  '''
+
+  def __init__(self):
+    self.InputTensor = np.zeros(shape=(BatchSize, XBins, YBins, ZBins, 1), dtype=np.float32)
+    self.OutputTensor = np.zeros(shape=(BatchSize, OutputDataSpaceSize), dtype=np.float32)
+    # Flat indices of the voxels set by the previous batch
+    self.Filled = np.zeros(0, dtype=np.int64)
+
+  def fill(self, Data, Batch):
+    '''
+    Resets the voxels of the previous batch and scatters the hits of the batch's events at once
+    '''
+    Input = self.InputTensor.reshape(-1)
+    Input[self.Filled] = 0
+
+    Start, Stop = Data.Offsets[Batch*BatchSize], Data.Offsets[(Batch+1)*BatchSize]
+    Events = np.repeat(np.arange(BatchSize), np.diff(Data.Offsets[Batch*BatchSize:(Batch+1)*BatchSize + 1]))
+    self.Filled = Events * (XBins * YBins * ZBins) + Data.Voxels[Start:Stop]
+    # As before, the last hit in a voxel determines its energy
+    Input[self.Filled] = Data.Energies[Start:Stop]
+
+    Layers = Data.Layers[Batch*BatchSize:(Batch+1)*BatchSize]
+    self.OutputTensor[:] = 0
+    self.OutputTensor[np.arange(BatchSize)[Layers >= 0], Layers[Layers >= 0]] = 1
+    return self
+
+
+def VoxelBatches(Data, NumberOfBatches):
+  '''
+  Yields the filled batches one after the other. With Prefetch, a background thread fills the next batch
+  while the current one is used, thus a batch is only valid until the next one is requested.
+  Errors of the background thread are raised here, and it is stopped when the generator is closed
+  '''
+  if Prefetch == False:
+    Buffer = VoxelBatch()
+    for Batch in range(0, NumberOfBatches):
+      yield Buffer.fill(Data, Batch)
+    return
+
+  Free = queue.Queue()
+  Filled = queue.Queue()
+  for b in range(2):
+    Free.put(VoxelBatch())
+
+  def Produce():
+    try:
+      for Batch in range(0, NumberOfBatches):
+        Buffer = Free.get()
+        # None: the consumer stopped
+        if Buffer is None:
+          return
+        Filled.put(Buffer.fill(Data, Batch))
+    except BaseException as Error:
+      Filled.put(Error)
+
+  Producer = threading.Thread(target=Produce)
+  Producer.start()
+  try:
+    for Batch in range(0, NumberOfBatches):
+      Buffer = Filled.get()
+      if isinstance(Buffer, BaseException):
+        raise Buffer
+      yield Buffer
+      Free.put(Buffer)
+  finally:
+    # Wakes up the producer if it is still waiting for a free buffer, e.g. after a break of the training loop
+    Free.put(None)
+    Producer.join()
+
+
+TrainingVoxels = VoxelDataSet(TrainingDataSets, True)
+TestingVoxels = VoxelDataSet(TestingDataSets, False)
+
+
 
 
 ###################################################################################################
@@ -364,40 +505,11 @@ def CheckPerformance():
 
   # Step run all the testing batches, and detrmine the percentage of correct identifications
   # Step 1: Loop over all Testing batches
-  for Batch in range(0, NTestingBatches):
-
-    # Step 1.1: Convert the data set into the input and output tensor
-    InputTensor = np.zeros(shape=(BatchSize, XBins, YBins, ZBins, 1))
-    OutputTensor = np.zeros(shape=(BatchSize, OutputDataSpaceSize))
+  for Batch, Buffer in enumerate(VoxelBatches(TestingVoxels, NTestingBatches)):
 
-
-    # Loop over all testing  data sets and add them to the tensor
-    for e in range(0, BatchSize):
-      Event = TestingDataSets[e + Batch*BatchSize]
-      # Set the layer in which the event happened
-
-      LayerBin = int ((Event.OriginPositionZ - ZMin) / ((ZMax- ZMin)/ ZBins) )
-      #print("layer bin: {} {}".format(Event.OriginPositionZ, LayerBin))
-
-      if LayerBin < 0 or LayerBin >= OutputDataSpaceSize:
-        print("Error: The calculated layer bin ({}) is out of bounds [0, {}]".format(LayerBin, OutputDataSpaceSize-1))
-      else:
-        OutputTensor[e][LayerBin] = 1
-
-      # Set all the hit locations and energies
-      SomethingAdded = False
-      for h in range(0, len(Event.X)):
-        XBin = int( (Event.X[h] - XMin) / ((XMax - XMin) / XBins) )
-        YBin = int( (Event.Y[h] - YMin) / ((YMax - YMin) / YBins) )
-        ZBin = int( (Event.Z[h] - ZMin) / ((ZMax - ZMin) / ZBins) )
-        #print("hit z bin: {} {}".format(Event.Z[h], ZBin))
-        if XBin >= 0 and YBin >= 0 and ZBin >= 0 and XBin < XBins and YBin < YBins and ZBin < ZBins:
-          InputTensor[e][XBin][YBin][ZBin][0] = Event.E[h]
-          SomethingAdded = True
-
-      if SomethingAdded == False:
-        print("Nothing added for event {}".format(Event.ID))
-        Event.print()
+    # Step 1.1: The input and output tensor of the batch (layer bins and hits outside were reported when converting the data set)
+    InputTensor = Buffer.InputTensor
+    OutputTensor = Buffer.OutputTensor
 
 
     # Step 2: Run it
@@ -478,31 +590,13 @@ while Iteration < MaxIterations:
   print("\n\nStarting iteration {}".format(Iteration))
 
   # Step 1: Loop over all training batches
-  for Batch in range(0, NTrainingBatches):
+  # Step 1.1: Convert the data set into the input and output tensor, in the background with Prefetch
+  # (then the converting time is the time spent waiting for a batch)
+  TimerConverting = time.time()
+  for Batch, Buffer in enumerate(VoxelBatches(TrainingVoxels, NTrainingBatches)):
 
-    # Step 1.1: Convert the data set into the input and output tensor
-    TimerConverting = time.time()
-
-    InputTensor = np.zeros(shape=(BatchSize, XBins, YBins, ZBins, 1))
-    OutputTensor = np.zeros(shape=(BatchSize, OutputDataSpaceSize))
-
-    # Loop over all training data sets and add them to the tensor
-    for g in range(0, BatchSize):
-      Event = TrainingDataSets[g + Batch*BatchSize]
-      # Set the layer in which the event happened
-      if Event.OriginPositionZ > ZMin and Event.OriginPositionZ < ZMax:
-        LayerBin = int ((Event.OriginPositionZ - ZMin) / ((ZMax- ZMin)/ ZBins) )
-        OutputTensor[g][LayerBin] = 1
-      else:
-        OutputTensor[g][OutputDataSpaceSize-1] = 1
-
-      # Set all the hit locations and energies
-      for h in range(0, len(Event.X)):
-        XBin = int( (Event.X[h] - XMin) / ((XMax - XMin) / XBins) )
-        YBin = int( (Event.Y[h] - YMin) / ((YMax - YMin) / YBins) )
-        ZBin = int( (Event.Z[h] - ZMin) / ((ZMax - ZMin) / ZBins) )
-        if XBin >= 0 and YBin >= 0 and ZBin >= 0 and XBin < XBins and YBin < YBins and ZBin < ZBins:
-          InputTensor[g][XBin][YBin][ZBin][0] = Event.E[h]
+    InputTensor = Buffer.InputTensor
+    OutputTensor = Buffer.OutputTensor
 
     TimeConverting += time.time() - TimerConverting
 
@@ -526,6 +620,8 @@ while Iteration < MaxIterations:
 
     if Interrupted == True: break
 
+    TimerConverting = time.time()
+
   # End for all batches
 
   # Step 2: Check current performance
@@ -22,8 +22,6 @@ import tensorflow as tf
 tf.compat.v1.disable_eager_execution()
 import numpy as np
 
-from sklearn.metrics import precision_recall_curve
-from tqdm import tqdm
 
 import matplotlib.pyplot as plt
 import networkx as nx
@@ -32,15 +30,18 @@ import random
 
 import signal
 import sys
-import time
 import math
 import csv
 import argparse
 from datetime import datetime
 from functools import reduce
-from GraphRepresentation import GraphRepresentation
-
-import time as t
+from GraphRepresentation import GraphRepresentation, radius_default
+from GraphCache import GraphCache
+from EdgeFilter import EdgeFilter
+from Profiler import Profiler
+from GraphLRU import GraphLRU
+from EventStore import EventStore
+from GNNTraining import GNNTraining
 
 print("\nCompton Track Identification")
 print("============================\n")
@@ -85,6 +86,16 @@ parser.add_argument('-t', '--testing', default='False', help='Toy testing mode')
 parser.add_argument('-x', '--extract', default='', help='Only create an extracted sim file --- to speed up later runs.')
 parser.add_argument('-d', '--save', default='True', help='Save results in a text file, in output dir.')
 parser.add_argument('-v', '--viz', default='0.5', help='Edge visualization threshold.')
+parser.add_argument('-u', '--buckethits', default='', help='Hit count bucket boundaries for size-bucketed batching, e.g. 5,10,20,40')
+parser.add_argument('-w', '--bucketedges', default='', help='Edge count bucket boundaries for size-bucketed batching, e.g. 50,200,800')
+parser.add_argument('-c', '--graphcache', default='GraphCache', help='Directory of the on-disk cache of graph representations, empty to disable')
+parser.add_argument('-y', '--maxgraphs', default='0', help='Maximum number of graph representations kept in memory (0: unlimited)')
+parser.add_argument('-z', '--maxgraphmemory', default='0', help='Maximum memory of the graph representations kept in memory in MB (0: unlimited)')
+parser.add_argument('-j', '--workers', default='1', help='Number of processes parsing the sim file in parallel')
+parser.add_argument('-o', '--edgeoutputs', default='False', help='Write the per-edge predictions of the test set into the output directory')
+parser.add_argument('-k', '--graphmode', default='dense', help='Graph input format: dense: padded incidence matrices Ri/Ro, sparse: concatenated edge lists with segment sums')
+parser.add_argument('-q', '--edgefilter', default='', help='Candidate edge pre-filter, e.g. max_gap=30,max_dz=5,energy_ratio=0.5,top_k=8 (see EdgeFilter.py)')
+parser.add_argument('-i', '--inputpipeline', default='generator', help='Input pipeline: generator: Python generator, tfdata: tf.data with parallel graph building and prefetching')
 
 args = parser.parse_args()
 
@@ -113,6 +124,32 @@ if args.tuning == "True":
 
 Acceptance = args.acceptance
 
+GraphCacheDirectory = args.graphcache
+
+Workers = max(1, int(args.workers))
+
+EdgeOutputs = args.edgeoutputs == "True"
+
+MaxGraphs = int(args.maxgraphs)
+MaxGraphMemory = int(args.maxgraphmemory)
+
+HitBuckets = [int(b) for b in args.buckethits.split(",") if b != ""]
+EdgeBuckets = [int(b) for b in args.bucketedges.split(",") if b != ""]
+
+GraphMode = "dense"
+if args.graphmode == "sparse":
+  GraphMode = "sparse"
+elif args.graphmode != "dense":
+  print("Unknown graph mode " + args.graphmode + ". Using dense incidence matrices.")
+
+GraphRepresentation.edgeFilter = EdgeFilter.fromString(args.edgefilter)
+
+InputPipeline = "generator"
+if args.inputpipeline == "tfdata":
+  InputPipeline = "tfdata"
+elif args.inputpipeline != "generator":
+  print("Unknown input pipeline " + args.inputpipeline + ". Using the Python generator.")
+
 if args.epochs != "":
     epochs = int(args.epochs)
 
@@ -141,6 +178,10 @@ if os.path.exists(OutputDirectory):
 
 os.makedirs(OutputDirectory)
 
+# Bound the in-memory map of graph representations, evicted prediction histories go to the output directory
+if MaxGraphs > 0 or MaxGraphMemory > 0:
+  GraphRepresentation.allGraphs = GraphLRU(MaxGraphs, MaxGraphMemory * 1000000, OutputDirectory + os.path.sep + "PredictionSpill")
+
 ###################################################################################################
 # Step 2: Global functions
 ###################################################################################################
@@ -163,6 +204,8 @@ signal.signal(signal.SIGINT, signal_handler)
 
 # Everything ROOT related can only be loaded here otherwise it interferes with the argparse
 from EventData import EventData
+import ToyModel
+from SimFileParser import SimFileParser
 
 # Load MEGAlib into ROOT so that it is usable
 import ROOT as M
@@ -175,23 +218,22 @@ M.PyConfig.IgnoreCommandLineOptions = True
 # Step 3: Create some training, test & verification data sets
 ###################################################################################################
 
+# Nested timers, counters and memory use of all steps, written to Profile.json and Profile.csv in the output directory
+Profile = Profiler()
+
 #
-start = t.time()
+Profile.start("Data Loading")
 
 # Read the simulation file data:
-DataSets = []
+DataSets = EventStore()
 NumberOfDataSets = 0
 NumberOfEvents = 0
 
 if UseToyModel == True:
-  for e in range(0, MaxEvents):
-    Data = EventData()
-    Data.createFromToyModel_V2(e)
-    DataSets.append(Data)
-
-    NumberOfDataSets += 1
-    if NumberOfDataSets > 0 and NumberOfDataSets % 1000 == 0:
-      print("Data sets processed: {}".format(NumberOfDataSets))
+  # All toy events are simulated at once, the same as EventData.createFromToyModel_V2 but vectorized
+  DataSets = ToyModel.generate(MaxEvents, Seed=0, Model="V2")
+  NumberOfDataSets = len(DataSets)
+  NumberOfEvents = NumberOfDataSets
 
 else:
   # Load geometry:
@@ -221,52 +263,79 @@ else:
 
 
   print("\n\nStarted reading data sets")
-  while True:
-    Event = Reader.GetNextEvent()
-    if not Event:
-      break
-    M.SetOwnership(Event, True) # Python needs ownership of the event in order to delete it
-    NumberOfEvents += 1
-
-    if Event.GetNIAs() > 0:
+  if Workers > 1:
+    def ParseEvent(Event):
       Data = EventData()
       Data.setAcceptance(Acceptance)
+      if Data.parse(Event) == True:
+        return Data
+      return None
+
+    DataSets, SimStrings, NumberOfEvents = SimFileParser(FileName, GeometryName, Workers).parse(ParseEvent, MaxEvents, ExtractEvents, lambda: Interrupted, DataSets)
+    NumberOfDataSets = len(DataSets)
+    if ExtractEvents == True:
+      for SimString in SimStrings:
+        Writer.AddText(M.MString(SimString))
+  else:
+    while True:
+      Event = Reader.GetNextEvent()
+      if not Event:
+        break
+      M.SetOwnership(Event, True) # Python needs ownership of the event in order to delete it
+      NumberOfEvents += 1
 
-      EventForWriter = Event.ToSimString()
+      if Event.GetNIAs() > 0:
+        Data = EventData()
+        Data.setAcceptance(Acceptance)
 
-      if Data.parse(Event) == True:
-        # Data.center()
+        EventForWriter = Event.ToSimString()
+
+        if Data.parse(Event) == True:
+          # Data.center()
 
-        # if Data.hasHitsOutside(XMin, XMax, YMin, YMax, ZMin, ZMax) == False and Data.isOriginInside(XMin, XMax, YMin, YMax, ZMin, ZMax) == True:
-          DataSets.append(Data)
-          NumberOfDataSets += 1
+          # if Data.hasHitsOutside(XMin, XMax, YMin, YMax, ZMin, ZMax) == False and Data.isOriginInside(XMin, XMax, YMin, YMax, ZMin, ZMax) == True:
+            DataSets.append(Data)
+            NumberOfDataSets += 1
 
-          if NumberOfDataSets > 0 and NumberOfDataSets % 1000 == 0:
-            print("Data sets processed: {} (out of {} read events)".format(NumberOfDataSets, NumberOfEvents))
+            if NumberOfDataSets > 0 and NumberOfDataSets % 1000 == 0:
+              print("Data sets processed: {} (out of {} read events)".format(NumberOfDataSets, NumberOfEvents))
 
-          if ExtractEvents == True:
-            Writer.AddText(EventForWriter)
+            if ExtractEvents == True:
+              Writer.AddText(EventForWriter)
 
-    if NumberOfDataSets >= MaxEvents:
-      break
+      if NumberOfDataSets >= MaxEvents:
+        break
 
-    if Interrupted == True:
-      Interrupted = False
-      NInterrupts -= 1
-      break
+      if Interrupted == True:
+        Interrupted = False
+        NInterrupts -= 1
+        break
 
   if ExtractEvents == True:
     Writer.CloseEventList();
     Writer.Close();
     quit()
 
+DataSets.shrink()
+
 print("Info: Parsed {} events".format(NumberOfDataSets))
-dataload_time = t.time() - start
+Profile.count("Events Read", NumberOfEvents)
+Profile.count("Events Accepted", NumberOfDataSets)
+Profile.count("Events Rejected", NumberOfEvents - NumberOfDataSets)
+Profile.count("Hits Accepted", int(DataSets.hits().sum()))
+Profile.stop("Data Loading")
+
+# Cache the graphs of sim file events on disk, so that later runs (e.g. the EvalGNN.py sweep) can reuse them
+if UseToyModel == False and GraphCacheDirectory != "":
+  GraphCacheParameters = {"acceptance": Acceptance, "radius": radius_default}
+  if GraphRepresentation.edgeFilter is not None:
+    GraphCacheParameters["edgefilter"] = GraphRepresentation.edgeFilter.parameters()
+  GraphRepresentation.cache = GraphCache(GraphCacheDirectory, FileName, GraphCacheParameters)
 
 
 
 #
-start = t.time()
+Profile.start("Train/Test Split")
 
 # Split the data sets in training and testing data sets
 
@@ -282,15 +351,9 @@ if NTestingBatches == 0:
   NTestingBatches = 1
 NTrainingBatches = NBatches - NTestingBatches
 
-# Now split the actual data:
-TrainingDataSets = []
-for i in range(0, NTrainingBatches * BatchSize):
-  TrainingDataSets.append(DataSets[i])
-
-
-TestingDataSets = []
-for i in range(0,NTestingBatches*BatchSize):
-   TestingDataSets.append(DataSets[NTrainingBatches * BatchSize + i])
+# Now split the actual data (the event store slices share the hit arrays, nothing is copied):
+TrainingDataSets = DataSets[0:NTrainingBatches * BatchSize]
+TestingDataSets = DataSets[NTrainingBatches * BatchSize:(NTrainingBatches + NTestingBatches) * BatchSize]
 
 
 NumberOfTrainingEvents = len(TrainingDataSets)
@@ -299,7 +362,7 @@ NumberOfTestingEvents = len(TestingDataSets)
 print(np.unique(np.array([event.unique for event in TestingDataSets])))
 
 print("Info: Number of training data sets: {}   Number of testing data sets: {} (vs. input: {} and split ratio: {})".format(NumberOfTrainingEvents, NumberOfTestingEvents, len(DataSets), TestingTrainingSplit))
-traintestsplit_time = t.time() - start
+Profile.stop("Train/Test Split")
 
 
 
@@ -310,73 +373,9 @@ traintestsplit_time = t.time() - start
 
 print("Info: Setting up the graph neural network...")
 
-# Definition of edge network (calculates edge weights)
-def EdgeNetwork(H, Ri, Ro, input_dim, hidden_dim):
-
-    def create_B(H):
-        # Note: In numpy transposes are memory-efficient constant time operations as they simply return
-        # a new view of the same data with adjusted strides. TensorFlow does not support strides,
-        # so transpose returns a new tensor with the items permuted.
-        bo = tf.transpose(a=Ro, perm = [0, 2, 1]) @ H
-        bi = tf.transpose(a=Ri, perm = [0, 2, 1]) @ H
-        B = tf.keras.layers.concatenate([bo, bi])
-        return B
-
-    B = tf.keras.layers.Lambda(create_B)(H)
-    layer_2 = tf.keras.layers.Dense(hidden_dim, activation = "tanh")(B)
-    layer_3 = tf.keras.layers.Dense(1, activation = "sigmoid")(layer_2)
-
-    return tf.squeeze(layer_3, axis = -1)
-
-
-# Definition of node network (computes states of nodes)
-def NodeNetwork(H, Ri, Ro, edge_weights, input_dim, output_dim):
-
-    def create_M(e):
-        bo = tf.transpose(a=Ro, perm = [0, 2, 1]) @ H
-        bi = tf.transpose(a=Ri, perm = [0, 2, 1]) @ H
-        Rwo = Ro * e[:, None]
-        Rwi = Ri * e[:, None]
-        mi = Rwi @ bo
-        mo = Rwo @ bi
-        M = tf.keras.layers.concatenate([mi, mo, H])
-        return M
-
-    M = tf.keras.layers.Lambda(lambda e: create_M(e))(edge_weights)
-    layer_4 = tf.keras.layers.Dense(output_dim, activation = "tanh")(M)
-    layer_5 = tf.keras.layers.Dense(output_dim, activation = "tanh")(layer_4)
-
-    return layer_5
-
-
-# Definition of overall network (iterates to find most probable edges)
-def SegmentClassifier(input_dim = 4, hidden_dim = 64, num_iters = 5):
-
-    # PLaceholders for association matrices and data matrix
-    X = tf.keras.Input(shape = (None, input_dim))
-    Ri = tf.keras.Input(shape = (None, None))
-    Ro = tf.keras.Input(shape = (None, None))
-
-    # Application of input network (creates latent representation of graph)
-    H = tf.keras.layers.Dense(hidden_dim, activation = "tanh")(X)
-    H = tf.keras.layers.concatenate([H, X])
-
-    # Application of graph neural network (generates probabilities for each edge)
-    for i in range(num_iters):
-        edge_weights = EdgeNetwork(H, Ri, Ro, input_dim + hidden_dim, hidden_dim)
-        H = NodeNetwork(H, Ri, Ro, edge_weights, input_dim + hidden_dim, hidden_dim)
-        H = tf.keras.layers.concatenate([H, X])
-
-    output_layer = EdgeNetwork(H, Ri, Ro, input_dim + hidden_dim, hidden_dim)
-
-    # Creation and compilation of model
-    model = tf.keras.models.Model(inputs = [X, Ri, Ro], outputs = output_layer)
-    model.compile(optimizer = 'adam', loss = 'binary_crossentropy',
-                  metrics = ['accuracy', tf.keras.metrics.Precision(thresholds = 0.4),
-                             tf.keras.metrics.Recall(thresholds = 0.4)])
-    print(model.summary())
-
-    return model
+Profile.start("Setup")
+Training = GNNTraining(TrainingDataSets, TestingDataSets, BatchSize, epochs, GraphMode, viz_threshold, HitBuckets, EdgeBuckets, InputPipeline)
+Profile.stop("Setup")
 
 
 ###################################################################################################
@@ -385,188 +384,18 @@ def SegmentClassifier(input_dim = 4, hidden_dim = 64, num_iters = 5):
 
 print("Info: Training the graph neural network...")
 
-model = SegmentClassifier()
-
-datagen_time = 0
-pad_time = 0
-
-def data_generator():
-    while True:
-        start = t.time()
-
-        random_batch = np.random.randint(0, NTrainingBatches - 1)
-
-        # Initialize vectorization of training data
-        max_train_hits, max_train_edges = 0, 0
-        train_X = []
-        train_Ri = []
-        train_Ro = []
-        train_y = []
-
-        for e in range(BatchSize):
-
-            # Prepare graph for a set of simulated events (training)
-            event = TrainingDataSets[random_batch * BatchSize + e]
-            graphRepresentation = GraphRepresentation.newGraphRepresentation(event, threshold=viz_threshold)
-            graphData = graphRepresentation.graphData
-            A, Ro, Ri, X, y = graphData
-            max_train_hits = max(max_train_hits, len(X))
-            max_train_edges = max(max_train_edges, len(y))
-            train_X.append(X)
-            train_Ri.append(Ri)
-            train_Ro.append(Ro)
-            train_y.append(y)
-
-        global datagen_time
-        datagen_time += (t.time() - start)
-        #
-        start = t.time()
-
-        # Padding to maximum dimension
-        for i in range(len(train_X)):
-            train_X[i] = np.pad(train_X[i], [(0, max_train_hits - len(train_X[i])), (0, 0)], mode = 'constant')
-            train_Ri[i] = np.pad(train_Ri[i], [(0, max_train_hits - len(train_Ri[i])), (0, max_train_edges - len(train_Ri[i][0]))], mode = 'constant')
-            train_Ro[i] = np.pad(train_Ro[i], [(0, max_train_hits - len(train_Ro[i])), (0, max_train_edges - len(train_Ro[i][0]))], mode = 'constant')
-            train_y[i] = np.pad(train_y[i], [(0, max_train_edges - len(train_y[i]))], mode = 'constant')
-
-        global pad_time
-        pad_time += (t.time() - start)
-
-        yield ([np.array(train_X), np.array(train_Ri), np.array(train_Ro)], np.array(train_y))
-
-test_datagen_time = 0
-test_pad_time = 0
-
-test_comp = []
-test_type = []
-pred_graph_ids = []
-
-def predict_generator():
-    global pred_graph_ids
-    pred_graph_ids = []
-    for batch_num in range(NTestingBatches):
-        start = t.time()
-
-        # Initialize vectorization of testing data
-        max_test_hits, max_test_edges = 0, 0
-        test_X = []
-        test_Ri = []
-        test_Ro = []
-        test_y = []
-
-        for e in range(BatchSize):
-
-            # Prepare graph for a set of simulated events (testing)
-            event = TestingDataSets[batch_num * BatchSize + e]
-            graphRepresentation = GraphRepresentation.newGraphRepresentation(event, threshold=viz_threshold)
-            pred_graph_ids.append(graphRepresentation.EventID)
-            graphData = graphRepresentation.graphData
-            A, Ro, Ri, X, y = graphData
-            max_test_hits = max(max_test_hits, len(X))
-            max_test_edges = max(max_test_edges, len(y))
-            test_X.append(X)
-            test_Ri.append(Ri)
-            test_Ro.append(Ro)
-            test_y.append(y)
-
-            global test_comp
-            test_comp.append(graphRepresentation.Compton)
-
-            global test_type
-            test_type.append(graphRepresentation.Tracks)
-
-        global test_datagen_time
-        test_datagen_time += (t.time() - start)
-
-        start = t.time()
-
-        # Padding to maximum dimension
-        for i in range(len(test_X)):
-            test_X[i] = np.pad(test_X[i], [(0, max_test_hits - len(test_X[i])), (0, 0)], mode = 'constant')
-            test_Ri[i] = np.pad(test_Ri[i], [(0, max_test_hits - len(test_Ri[i])), (0, max_test_edges - len(test_Ri[i][0]))], mode = 'constant')
-            test_Ro[i] = np.pad(test_Ro[i], [(0, max_test_hits - len(test_Ro[i])), (0, max_test_edges - len(test_Ro[i][0]))], mode = 'constant')
-            test_y[i] = np.pad(test_y[i], [(0, max_test_edges - len(test_y[i]))], mode = 'constant')
-
-        global test_pad_time
-        test_pad_time += (t.time() - start)
-
-        yield ([np.array(test_X), np.array(test_Ri), np.array(test_Ro)], np.array(test_y))
-
-
-
-def evaluate_generator():
-    while True:
-
-        random_batch = np.random.randint(0, NTestingBatches - 1)
-
-        # Initialize vectorization of testing data
-        max_test_hits, max_test_edges = 0, 0
-        test_X = []
-        test_Ri = []
-        test_Ro = []
-        test_y = []
-
-        for e in range(BatchSize):
-
-            # Prepare graph for a set of simulated events (testing)
-            event = TestingDataSets[random_batch * BatchSize + e]
-            graphRepresentation = GraphRepresentation.newGraphRepresentation(event, threshold=viz_threshold)
-            graphData = graphRepresentation.graphData
-            A, Ro, Ri, X, y = graphData
-            max_test_hits = max(max_test_hits, len(X))
-            max_test_edges = max(max_test_edges, len(y))
-            test_X.append(X)
-            test_Ri.append(Ri)
-            test_Ro.append(Ro)
-            test_y.append(y)
-
-        # Padding to maximum dimension
-        for i in range(len(test_X)):
-            test_X[i] = np.pad(test_X[i], [(0, max_test_hits - len(test_X[i])), (0, 0)], mode = 'constant')
-            test_Ri[i] = np.pad(test_Ri[i], [(0, max_test_hits - len(test_Ri[i])), (0, max_test_edges - len(test_Ri[i][0]))], mode = 'constant')
-            test_Ro[i] = np.pad(test_Ro[i], [(0, max_test_hits - len(test_Ro[i])), (0, max_test_edges - len(test_Ro[i][0]))], mode = 'constant')
-            test_y[i] = np.pad(test_y[i], [(0, max_test_edges - len(test_y[i]))], mode = 'constant')
-
-        yield ([np.array(test_X), np.array(test_Ri), np.array(test_Ro)], np.array(test_y))
-
-
-###
+Profile.start("Training")
+Training.train()
+# Graph building and padding happen in the input pipeline, interleaved with the training steps
+Profile.record("Graph Representations", Training.datagen_time)
+Profile.record("Padding", Training.pad_time)
+Profile.stop("Training")
 
-class PrecisionRecallCallback(tf.keras.callbacks.Callback):
-    best_train_recall = 0
-    best_train_precision = 0
-    best_train_accuracy = 0
-
-    def on_epoch_end(self, epoch, logs=None):
-        keys = list(logs.keys())
-        best_train_accuracy = max(self.best_train_accuracy, logs[keys[1]])
-        best_train_precision = max(self.best_train_precision, logs[keys[2]])
-        best_train_recall = max(self.best_train_recall, logs[keys[3]])
-
-        #actual = []
-        #predictions = []
-
-        #for input, output in tqdm(predict_generator()):
-        #    batch_pred = model.predict_on_batch(input)
-        #    actual.extend(output)
-        #    predictions.extend(batch_pred)
-
-        #assert len(pred_graph_ids) == len(predictions)
-
-        #for i in range(len(pred_graph_ids)):
-            #print(i,sep="\r")
-        #   GraphRepresentation.allGraphs[pred_graph_ids[i]].add_prediction(predictions[i])
-
-
-callback = PrecisionRecallCallback()
-# try different monitor values?
-stopping = tf.keras.callbacks.EarlyStopping(monitor='precision', min_delta=0, patience=3, verbose=0, mode='auto',
-                                            baseline=None, restore_best_weights=True)
-
-train_start = t.time()
-# Note: Not using stopping right now, to generate larger GIF.
-hist = model.fit(data_generator(), steps_per_epoch = NTrainingBatches, epochs = epochs, callbacks=[callback])
-train_time = t.time() - train_start
+# The trained model can be applied to new sim files with ComptonTrackInferenceGNN.py
+ModelParameters = {"acceptance": Acceptance, "radius": radius_default}
+if GraphRepresentation.edgeFilter is not None:
+  ModelParameters["edgefilter"] = GraphRepresentation.edgeFilter.parameters()
+Training.save(OutputDirectory, ModelParameters)
 
 ###################################################################################################
 # Step 6: Evaluating the graph neural network
@@ -574,26 +403,26 @@ train_time = t.time() - train_start
 
 print("Info: Evaluating the graph neural network...")
 
-# Generate predictions for a graph
-start = t.time()
-
-actual = []
-predictions = []
-
-for input, output in tqdm(predict_generator()):
-    batch_pred = model.predict_on_batch(input)
-    actual.extend(output)
-    predictions.extend(batch_pred)
-
-assert len(pred_graph_ids) == len(predictions)
-
-for i in range(len(pred_graph_ids)):
-    GraphRepresentation.allGraphs[pred_graph_ids[i]].add_prediction(predictions[i])
+Profile.start("Evaluation")
+Training.evaluate(OutputDirectory if EdgeOutputs else None)
+Profile.record("Prediction", Training.pred_time)
+Profile.record("Prediction/Graph Representations", Training.test_datagen_time)
+Profile.record("Prediction/Padding", Training.test_pad_time)
+Profile.record("Keras Evaluate", Training.eval_time)
+Profile.stop("Evaluation")
+
+Profile.count("Training Events", NumberOfTrainingEvents)
+Profile.count("Testing Events", NumberOfTestingEvents)
+Profile.count("Graphs Built", GraphRepresentation.graphsBuilt)
+Profile.count("Edges Built", GraphRepresentation.edgesBuilt)
+Profile.set("Edges per Graph", GraphRepresentation.edgesBuilt / max(GraphRepresentation.graphsBuilt, 1))
+if Training.total_real_entries > 0:
+  Profile.set("Padding Ratio (padded / real incidence matrix entries)", Training.total_padded_entries / Training.total_real_entries)
+Profile.set("Median Training Step [s] ({} input pipeline)".format(InputPipeline), Training.step_time())
+Profile.set("Graph Map", GraphRepresentation.allGraphs.stats())
 
 # GraphRepresentation.saveAllGraphs(OutputDirectory)
 
-pred_time = t.time() - start
-
 #test_graph = test_rep[0]
 #test_graph.add_prediction(predictions[0])
 #test_graph.visualize_last_prediction()
@@ -602,15 +431,11 @@ pred_time = t.time() - start
 #     test_rep[i].add_prediction(predictions[i])
 #     test_rep[i].visualize_last_prediction()
 
-start = t.time()
-
-evals = model.evaluate(evaluate_generator(), steps = NTestingBatches)
-
-print(evals)
+evaluator = Training.evaluator
 
 if Save:
     f = open(OutputDirectory + os.path.sep + "metrics.txt", "w+")
-    keys = list(hist.history.keys())
+    keys = list(Training.hist.history.keys())
     '''
     f.write("Num Events: {}\nAcceptance: {}\n\nTraining Metrics\nLoss: {}\nAccuracy: {}\nPrecision: {}\nRecall: {}\n\n".format(
             NumberOfDataSets,
@@ -623,29 +448,25 @@ if Save:
     f.write("Num Events: {}\nAcceptance: {}\n\nTraining Metrics\nAccuracy: {}\nPrecision: {}\nRecall: {}\n\n".format(
             NumberOfDataSets,
             Acceptance,
-            callback.best_train_accuracy,
-            callback.best_train_precision,
-            callback.best_train_recall))
-
-    f.write("Eval Metrics\n{}".format(evals))
+            Training.callback.best_train_accuracy,
+            Training.callback.best_train_precision,
+            Training.callback.best_train_recall))
+
+    f.write("Eval Metrics\n{}\n\n".format(Training.evals))
+    f.write("Input Pipeline: {}\nMedian Training Step Time: {} s\n\n".format(InputPipeline, Training.step_time()))
+    f.write("Edge Metrics (threshold {})\n{}\n".format(evaluator.threshold, evaluator.report()))
+    if GraphRepresentation.edgeFilter is not None:
+      f.write("\n{}\n".format(GraphRepresentation.edgeFilter.report()))
     f.close()
 
-eval_time = t.time() - start
+print(Profile.report())
+Profile.write(OutputDirectory)
 
-print("Time Elapsed for Data Loading: {} s".format(dataload_time))
-print("Time Elapsed for Train/Test Split: {} s".format(traintestsplit_time))
-print("Time Elapsed for Training Data Setup (Graph Representations): {} s".format(datagen_time))
-print("Time Elapsed for Training Data Setup (Padding): {} s".format(pad_time))
-print("Time Elapsed for Training: {} s".format(train_time))
-print("Time Elapsed for Test Data Setup (Graph Representations): {} s".format(test_datagen_time))
-print("Time Elapsed for Test Data Setup (Padding): {} s".format(test_pad_time))
-print("Time Elapsed for Evaluation: {} s".format(eval_time))
+print(evaluator.report())
+if GraphRepresentation.edgeFilter is not None:
+  print(GraphRepresentation.edgeFilter.report())
 
-precisions, recalls, thresholds = precision_recall_curve(np.hstack(actual), np.hstack(predictions))
+precisions, recalls, thresholds = evaluator.precision_recall_curve()
 data_dict = {'Precision' : precisions, 'Recall' : recalls, 'Thresholds' : thresholds}
 
-np.save('Predictions', np.array(predictions, dtype = object))
-np.save('Actual', np.array(actual, dtype = object))
-np.save('Precision_Recall_Curve', data_dict)
-np.save('Compton', np.array(test_comp, dtype = object))
-np.save('Types', np.array(test_type, dtype = object))
+np.save(OutputDirectory + os.path.sep + 'Precision_Recall_Curve', data_dict)
@@ -109,6 +109,7 @@ signal.signal(signal.SIGINT, signal_handler)
 
 # Everything ROOT related can only be loaded here otherwise it interferes with the argparse
 from EventData import EventData
+import ToyModel
 
 # Load MEGAlib into ROOT so that it is usable
 import ROOT as M
@@ -127,14 +128,9 @@ DataSets = []
 NumberOfDataSets = 0
 
 if UseToyModel == True:
-  for e in range(0, MaxEvents):
-    Data = EventData()
-    Data.createFromToyModel(e)
-    DataSets.append(Data)
-
-    NumberOfDataSets += 1
-    if NumberOfDataSets > 0 and NumberOfDataSets % 1000 == 0:
-      print("Data sets processed: {}".format(NumberOfDataSets))
+  # All toy events are simulated at once, the same as EventData.createFromToyModel but vectorized
+  DataSets = list(ToyModel.generate(MaxEvents, Seed=0, Model="V1"))
+  NumberOfDataSets = len(DataSets)
 
 else:
   # Load geometry:
@@ -34,9 +34,10 @@ import os
 import argparse
 from datetime import datetime
 from functools import reduce
-from CERN_GNN import GNNSegmentClassifier
+from CERN_GNN import GNNSegmentClassifier, GNNSegmentClassifierSparse, concatenate_graphs, pad_graphs, reduced_precision
 
 from GraphRepresentation import GraphRepresentation
+from GraphLRU import GraphLRU
 #from GraphVisualizer import GraphVisualizer
 
 print("\nCompton Track Identification")
@@ -68,6 +69,10 @@ parser.add_argument('-g', '--geometry', default='$(MEGALIB)/resource/examples/ge
 parser.add_argument('-m', '--maxevents', default='10000', help='Maximum number of events to use')
 parser.add_argument('-s', '--testingtrainingsplit', default='0.1', help='Testing-training split')
 parser.add_argument('-b', '--batchsize', default='128', help='Batch size')
+parser.add_argument('-p', '--precision', default='', help='Compare int8 or bfloat16 CPU inference with float32 on the testing set')
+parser.add_argument('-j', '--workers', default='2', help='Number of data loader processes building the graphs and batches (0: in the main process)')
+parser.add_argument('-l', '--maxgraphs', default='0', help='Maximum number of graph representations kept per data loader process (0: all, i.e. each graph is only built in the first epoch)')
+parser.add_argument('-k', '--graphmode', default='dense', help='Model input: dense (padded incidence matrices) or sparse (edge lists, scatter-based message passing)')
 
 args = parser.parse_args()
 
@@ -86,6 +91,17 @@ if int(args.batchsize) >= 16:
 if float(args.testingtrainingsplit) >= 0.05:
    TestingTrainingSplit = float(args.testingtrainingsplit)
 
+Precision = args.precision
+
+Workers = max(0, int(args.workers))
+
+GraphRepresentation.allGraphs = GraphLRU(max_graphs=max(0, int(args.maxgraphs)))
+
+GraphMode = args.graphmode
+if GraphMode not in ["dense", "sparse"]:
+  print("Error: The graph mode must be dense or sparse")
+  sys.exit(0)
+
 
 
 if os.path.exists(OutputDirectory):
@@ -118,6 +134,7 @@ signal.signal(signal.SIGINT, signal_handler)
 
 # Everything ROOT related can only be loaded here otherwise it interferes with the argparse
 from EventData import EventData
+import ToyModel
 
 # Load MEGAlib into ROOT so that it is usable
 import ROOT as M
@@ -136,14 +153,9 @@ DataSets = []
 NumberOfDataSets = 0
 
 if UseToyModel == True:
-  for e in range(0, MaxEvents):
-    Data = EventData()
-    Data.createFromToyModel(e)
-    DataSets.append(Data)
-
-    NumberOfDataSets += 1
-    if NumberOfDataSets > 0 and NumberOfDataSets % 1000 == 0:
-      print("Data sets processed: {}".format(NumberOfDataSets))
+  # All toy events are simulated at once, the same as EventData.createFromToyModel but vectorized
+  DataSets = list(ToyModel.generate(MaxEvents, Seed=0, Model="V1"))
+  NumberOfDataSets = len(DataSets)
 
 else:
   # Load geometry:
@@ -232,6 +244,48 @@ print("Info: Setting up the graph neural network...")
 # Optional parameters:
 
 
+class GraphDataset(torch.utils.data.Dataset):
+    """
+    The graphs of a list of events, built (or taken from GraphRepresentation.allGraphs) when a batch needs them,
+    as ([X, edge_index], y) without any padding
+    """
+    def __init__(self, events):
+        self.events = events
+
+    def __len__(self):
+        return len(self.events)
+
+    def __getitem__(self, i):
+        graphRepresentation = GraphRepresentation.newGraphRepresentation(self.events[i])
+        A, Ro, Ri, X, y = graphRepresentation.graphData
+        return [X, graphRepresentation.edgeIndex], y
+
+
+def collate_graphs(batch):
+    """
+    Collates the events of a batch: padded to the largest event of the batch (dense) or concatenated into
+    one graph (sparse). Returns (model inputs, y, number of edges of each event)
+    """
+    if GraphMode == "sparse":
+        X, edge_index, edges = concatenate_graphs([inputs for inputs, y in batch])
+        return [X, edge_index], torch.cat([torch.as_tensor(y) for inputs, y in batch]), edges
+
+    X, Ri, Ro, edges = pad_graphs([inputs for inputs, y in batch])
+    y = torch.zeros((len(batch), max(edges)))
+    for b, (inputs, y_) in enumerate(batch):
+        y[b, :len(y_)] = torch.as_tensor(y_)
+    return [X, Ri, Ro], y, edges
+
+
+def data_loader(events):
+    """
+    The graphs of the events are built lazily in the data loader processes, which are kept for all epochs
+    so that their graph representations are reused
+    """
+    return torch.utils.data.DataLoader(GraphDataset(events), batch_size = BatchSize, collate_fn = collate_graphs,
+                                       num_workers = Workers, persistent_workers = Workers > 0)
+
+
 ###################################################################################################
 # Step 5: Training the graph neural network
 ###################################################################################################
@@ -239,47 +293,21 @@ print("Info: Setting up the graph neural network...")
 
 print("Info: Training the graph neural network...")
 
-# Initialize vectorization of training data
-max_train_hits, max_train_edges = 0, 0
-training_data = []
-
-for Batch in range(NTrainingBatches):
-    for e in range(BatchSize):
-
-        # Prepare graph for a set of simulated events (training)
-        event = TrainingDataSets[Batch*BatchSize + e]
-        graphRepresentation = GraphRepresentation.newGraphRepresentation(event)
-        graphData = graphRepresentation.graphData
-        A, Ro, Ri, X, y = graphData
-        max_train_hits = max(max_train_hits, len(X))
-        max_train_edges = max(max_train_edges, len(y))
-        training_data.append([[X, Ri, Ro], y])
-
-# Padding to maximum dimension
-for i in range(len(training_data)):
-    training_data[i][0][0] = \
-        np.pad(training_data[i][0][0], [(0, max_train_hits - len(training_data[i][0][0])), (0, 0)], mode = 'constant')
-    training_data[i][0][1] = \
-        np.pad(training_data[i][0][1], [(0, max_train_hits - len(training_data[i][0][1])),
-                                                             (0, max_train_edges - len(training_data[i][0][1][0]))], mode = 'constant')
-    training_data[i][0][2] = \
-        np.pad(training_data[i][0][2], [(0, max_train_hits - len(training_data[i][0][2])),
-                                                             (0, max_train_edges - len(training_data[i][0][2][0]))], mode = 'constant')
-    training_data[i][1] = \
-        np.pad(training_data[i][1], [(0, max_train_edges - len(training_data[i][1]))], mode = 'constant')
-
-# Initialize data loader in PyTorch
-train_dataloader = torch.utils.data.DataLoader(training_data, batch_size = BatchSize)
+# Initialize data loader in PyTorch, the graphs are built and padded per batch
+train_dataloader = data_loader(TrainingDataSets)
 
 # Initialize model, loss function, and optimizer
-model = GNNSegmentClassifier(input_dim = 4, hidden_dim = 64, n_iters = 4)
+if GraphMode == "sparse":
+    model = GNNSegmentClassifierSparse(input_dim = 4, hidden_dim = 64, n_iters = 4)
+else:
+    model = GNNSegmentClassifier(input_dim = 4, hidden_dim = 64, n_iters = 4)
 loss_function = torch.nn.BCELoss()
 optimizer = torch.optim.Adam(model.parameters(), lr = 0.001)
 
 loss_history = []
 n_epochs = 100
 for i in range(n_epochs):
-    for (x, y) in train_dataloader:
+    for (x, y, edges) in train_dataloader:
         counter, sum_loss = 0, 0
 
         # Train the model using PyTorch
@@ -303,45 +331,26 @@ print(loss_history, "\n")
 ###################################################################################################
 print("Info: Evaluating the graph neural network...")
 
-# Initialize vectorization of testing data
-max_test_hits, max_test_edges = 0, 0
-testing_data = []
-
-for Batch in range(NTestingBatches):
-    for e in range(BatchSize):
-
-        # Prepare graph for a set of simulated events (testing)
-        event = TestingDataSets[Batch*BatchSize + e]
-        graphRepresentation = GraphRepresentation.newGraphRepresentation(event)
-        graphData = graphRepresentation.graphData
-        A, Ro, Ri, X, y = graphData
-        max_test_hits = max(max_test_hits, len(X))
-        max_test_edges = max(max_test_edges, len(y))
-        testing_data.append([[X, Ri, Ro], y])
-
-# Padding to maximum dimension
-for i in range(len(testing_data)):
-    testing_data[i][0][0] = np.pad(testing_data[i][0][0], [(0, max_test_hits - len(testing_data[i][0][0])), (0, 0)])
-    testing_data[i][0][1] = np.pad(testing_data[i][0][1], [(0, max_test_hits - len(testing_data[i][0][1])),
-                                                             (0, max_test_edges - len(testing_data[i][0][1][0]))])
-    testing_data[i][0][2] = np.pad(testing_data[i][0][2], [(0, max_test_hits - len(testing_data[i][0][2])),
-                                                             (0, max_test_edges - len(testing_data[i][0][2][0]))])
-    testing_data[i][1] = np.pad(testing_data[i][1], [(0, max_test_edges - len(testing_data[i][1]))], mode = 'constant')
-
 # Initialize data loader in PyTorch
-test_dataloader = torch.utils.data.DataLoader(testing_data, batch_size = BatchSize)
+test_dataloader = data_loader(TestingDataSets)
 
 # Evaluate the model using PyTorch
 test_history = []
-for (x, y) in test_dataloader:
+for (x, y, edges) in test_dataloader:
     with torch.no_grad():
 
         prediction = model(x)
         loss = loss_function(prediction, y)
         accuracy = sum((prediction > 0.5) == (y > 0.5)) / (BatchSize + 0.0)
 
+        # Per event predictions without padding: rows of the padded batch, or the edges of each event of the concatenated graph
+        if GraphMode == "sparse":
+            events = zip(torch.split(prediction, edges), torch.split(y, edges))
+        else:
+            events = [(pred[:n], out[:n]) for pred, out, n in zip(prediction, y, edges)]
+
         accuracy, precision, recall = 0, 0, 0
-        for (pred, out) in zip(prediction, y):
+        for (pred, out) in events:
             accuracy += sum((pred > 0.5) == (out > 0.5)) / (len(out) + 0.0)
             true_pos, false_pos = 0, 0
             for i in range(len(pred)):
@@ -366,5 +375,30 @@ for (x, y) in test_dataloader:
 print("\nLoss, Accuracy, Precision, and Recall (Testing Set):")
 print(test_history)
 
+# Compare reduced precision CPU inference with float32 on the testing set
+if Precision != "":
+    comparison = {}
+    for name, inference_model in [("float32", model.eval()), (Precision, reduced_precision(model, Precision))]:
+        true_pos, pred_pos, real_pos, elapsed = 0, 0, 0, 0
+        with torch.no_grad():
+            for (x, y, edges) in test_dataloader:
+                start = time.time()
+                prediction = inference_model(x)
+                elapsed += time.time() - start
+                # Only the first edges of each event of a padded batch are real, as in the test loop
+                if GraphMode == "sparse":
+                    valid = torch.ones_like(y, dtype = torch.bool)
+                else:
+                    valid = torch.arange(y.shape[1])[None, :] < torch.as_tensor(edges)[:, None]
+                true_pos += ((prediction > 0.5) & (y > 0.5) & valid).sum().item()
+                pred_pos += ((prediction > 0.5) & valid).sum().item()
+                real_pos += ((y > 0.5) & valid).sum().item()
+        comparison[name] = (true_pos / max(pred_pos, 1), true_pos / max(real_pos, 1), len(TestingDataSets) / elapsed)
+        print("{}: Precision {:.5f}, Recall {:.5f}, {:.1f} events/s".format(name, *comparison[name]))
+
+    print("Change with {}: Precision {:+.5f}, Recall {:+.5f}, {:.2f}x events/s".format(
+          Precision, comparison[Precision][0] - comparison["float32"][0], comparison[Precision][1] - comparison["float32"][1],
+          comparison[Precision][2] / comparison["float32"][2]))
+
 #input("Press [enter] to EXIT")
 sys.exit(0)
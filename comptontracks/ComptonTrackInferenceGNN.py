@@ -0,0 +1,310 @@
+###################################################################################################
+#
+# ComptonTrackInferenceGNN.py
+#
+# Copyright (C) by Andreas Zoglauer & Pranav Nagarajan
+# All rights reserved.
+#
+# Please see the file LICENSE in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+
+
+###################################################################################################
+import os
+import sys
+import signal
+import argparse
+import json
+import time as t
+
+import numpy as np
+
+print("\nCompton Track Identification - Inference")
+print("========================================\n")
+
+'''
+Classifies the edges of the events of a sim file with a segment classifier trained by ComptonTrackIdentificationGNN.py.
+The events are parsed and turned into graphs chunk by chunk in worker processes, while the main process
+predicts large batches. Writes the predicted edges of each event into a compact .npz file:
+
+  EventIDs     (events,)      event ID
+  EdgeOffsets  (events + 1,)  start of each event's edges
+  Senders      (edges,)       sending hit of each edge (index within the event), uint16
+  Receivers    (edges,)       receiving hit of each edge (index within the event), uint16
+  Scores       (edges,)       predicted score, float16
+
+Only edges with a score of at least the threshold are written, use -v 0 to write all candidate edges.
+'''
+
+
+
+###################################################################################################
+# Step 1: Input parameters
+###################################################################################################
+
+
+parser = argparse.ArgumentParser(description='Classify the edges of the events of a sim file with a trained GNN.')
+parser.add_argument('-f', '--filename', default='ComptonTrackIdentification_LowEnergy.p1.sim', help='File name of the events to classify')
+parser.add_argument('-g', '--geometry', default='$(MEGALIB)/resource/examples/geomega/GRIPS/GRIPS.geo.setup', help='Geometry with which the sim file was created')
+parser.add_argument('-w', '--model', default='Results', help='Output directory of the training run with SegmentClassifier.h5 and SegmentClassifier.json')
+parser.add_argument('-o', '--output', default='EdgePredictions.npz', help='Output file')
+parser.add_argument('-m', '--maxevents', default='0', help='Maximum number of events to classify (0: all, in toy testing mode: 10000)')
+parser.add_argument('-b', '--batchsize', default='1024', help='Batch size of the predictions')
+parser.add_argument('-n', '--chunksize', default='2000', help='Number of events parsed at once by a worker')
+parser.add_argument('-j', '--workers', default='1', help='Number of processes parsing the sim file and building the graphs')
+parser.add_argument('-v', '--threshold', default='0.5', help='Only write edges with at least this score')
+parser.add_argument('-p', '--precision', default='float32', help='Inference precision: float32 or bfloat16 (compare the accuracy with ComparePrecision.py)')
+parser.add_argument('-t', '--testing', default='False', help='Toy testing mode: classify toy model events instead of a sim file')
+
+args = parser.parse_args()
+
+FileName = args.filename
+GeometryName = args.geometry
+ModelDirectory = args.model
+OutputFileName = args.output
+MaxEvents = int(args.maxevents)
+BatchSize = max(1, int(args.batchsize))
+ChunkSize = max(1, int(args.chunksize))
+Workers = max(1, int(args.workers))
+Threshold = float(args.threshold)
+UseToyModel = args.testing == "True"
+Precision = args.precision
+
+# The toy model events never end
+if UseToyModel == True and MaxEvents <= 0:
+  MaxEvents = 10000
+
+with open(ModelDirectory + os.path.sep + "SegmentClassifier.json") as f:
+  ModelParameters = json.load(f)
+
+GraphMode = ModelParameters["graph_mode"]
+Acceptance = ModelParameters["acceptance"]
+Radius = ModelParameters["radius"]
+
+
+
+###################################################################################################
+# Step 2: Global functions
+###################################################################################################
+
+
+# Take care of Ctrl-C
+Interrupted = False
+NInterrupts = 0
+def signal_handler(signal, frame):
+  global Interrupted
+  Interrupted = True
+  global NInterrupts
+  NInterrupts += 1
+  if NInterrupts >= 2:
+    print("Aborting!")
+    sys.exit(0)
+  print("You pressed Ctrl+C - waiting for graceful abort, or press  Ctrl-C again, for quick exit.")
+signal.signal(signal.SIGINT, signal_handler)
+
+
+from GraphRepresentation import GraphRepresentation
+from GraphLRU import GraphLRU
+from EdgeFilter import EdgeFilter
+
+# The graphs are only needed until their inputs are extracted, thus do not keep them (in the worker processes)
+GraphRepresentation.allGraphs = GraphLRU(max_graphs=1)
+if "edgefilter" in ModelParameters:
+  GraphRepresentation.edgeFilter = EdgeFilter(**ModelParameters["edgefilter"])
+
+
+def BuildGraph(Data):
+  """
+  Returns the model inputs of one event: (EventID, hit features X, edge list (senders, receivers))
+  """
+  Graph = GraphRepresentation(Data, radius=Radius)
+  return (Graph.EventID, Graph.graphData[3], Graph.edgeIndex)
+
+
+def BuildGraphs(Events):
+  """
+  Builds the model inputs of a chunk of events, in the same format as SimFileParser.stream
+  """
+  return [(Index, BuildGraph(Data), None) for Index, Data in enumerate(Events)], len(Events)
+
+
+def MakeBatch(Graphs):
+  """
+  Assembles the model input of a batch of graphs: padded incidence matrices (dense) or one concatenated graph (sparse)
+  """
+  Hits = np.array([len(X) for EventID, X, EdgeIndex in Graphs])
+  Edges = np.array([EdgeIndex.shape[1] for EventID, X, EdgeIndex in Graphs])
+
+  if GraphMode == "sparse":
+    HitOffsets = np.concatenate([[0], np.cumsum(Hits)[:-1]])
+    X = np.concatenate([X for EventID, X, EdgeIndex in Graphs])
+    EdgeList = np.concatenate([EdgeIndex + Offset for (EventID, X, EdgeIndex), Offset in zip(Graphs, HitOffsets)], axis=1).astype(np.int32)
+    return [X[None], EdgeList[1][None], EdgeList[0][None]]
+
+  X = np.zeros((len(Graphs), Hits.max(), 4), dtype=np.float32)
+  Ri = np.zeros((len(Graphs), Hits.max(), Edges.max()), dtype=np.float32)
+  Ro = np.zeros((len(Graphs), Hits.max(), Edges.max()), dtype=np.float32)
+  for b, (EventID, Features, EdgeIndex) in enumerate(Graphs):
+    X[b, :len(Features)] = Features
+    Ro[b, EdgeIndex[0], np.arange(Edges[b])] = 1
+    Ri[b, EdgeIndex[1], np.arange(Edges[b])] = 1
+  return [X, Ri, Ro]
+
+
+def SplitBatch(Graphs, Prediction):
+  """
+  Splits the model output of a batch into the (unpadded) edge scores of each graph
+  """
+  Edges = [EdgeIndex.shape[1] for EventID, X, EdgeIndex in Graphs]
+  if GraphMode == "sparse":
+    return np.split(Prediction[0], np.cumsum(Edges)[:-1])
+  return [Prediction[b, :Edges[b]] for b in range(len(Graphs))]
+
+
+class PredictionWriter:
+  """
+  Appends the predicted edges of each event to raw files and combines them into one .npz file at the end
+  """
+
+  columns = {"Senders": np.uint16, "Receivers": np.uint16, "Scores": np.float16}
+
+  def __init__(self, FileName, Threshold):
+    self.FileName = FileName
+    self.Threshold = Threshold
+    self.files = {Name: open(FileName + "." + Name + ".raw", "wb") for Name in self.columns}
+    self.EdgeOffsets = [0]
+    self.EventIDs = []
+
+  def add(self, EventID, EdgeIndex, Scores):
+    Selected = Scores >= self.Threshold
+    assert EdgeIndex.shape[1] == 0 or EdgeIndex.max() < 65536, "Too many hits for uint16 hit indices"
+    for Name, Values in zip(self.columns, [EdgeIndex[0][Selected], EdgeIndex[1][Selected], Scores[Selected]]):
+      self.files[Name].write(Values.astype(self.columns[Name]).tobytes())
+    self.EdgeOffsets.append(self.EdgeOffsets[-1] + int(np.count_nonzero(Selected)))
+    self.EventIDs.append(EventID)
+
+  def close(self):
+    Columns = {}
+    for Name, f in self.files.items():
+      f.close()
+      Columns[Name] = np.fromfile(f.name, dtype=self.columns[Name])
+      os.remove(f.name)
+    np.savez(self.FileName, EventIDs=np.array(self.EventIDs, dtype=np.int64), EdgeOffsets=np.array(self.EdgeOffsets, dtype=np.int64), **Columns)
+
+
+
+###################################################################################################
+# Step 3: Stream the events through graph building and prediction
+###################################################################################################
+
+
+# The worker processes are forked here, before TensorFlow is loaded: forking a process with running TensorFlow threads can deadlock
+def ToyResults(Pool):
+  # Endless toy events, each chunk with its own seed, with the same bounded number of chunks in flight as SimFileParser
+  import collections
+  import ToyModel
+
+  Pending = collections.deque()
+  Chunk = 0
+  try:
+    while True:
+      Events = ToyModel.generate(ChunkSize, Seed=1000 + Chunk, Model="V2", FirstEventID=Chunk * ChunkSize)
+      Pending.append(Pool.apply_async(BuildGraphs, (Events,)))
+      if len(Pending) >= 2 * Workers:
+        yield Pending.popleft().get()
+      Chunk += 1
+  finally:
+    Pool.terminate()
+    Pool.join()
+
+
+if UseToyModel == True:
+  import multiprocessing
+  Results = ToyResults(multiprocessing.get_context("fork").Pool(Workers))
+else:
+  # Everything ROOT related can only be loaded here otherwise it interferes with the argparse
+  from EventData import EventData
+  from SimFileParser import SimFileParser
+
+  def ParseEvent(Event):
+    Data = EventData()
+    Data.setAcceptance(Acceptance)
+    if Data.parse(Event) == True:
+      return BuildGraph(Data)
+    return None
+
+  Parser = SimFileParser(FileName, GeometryName, Workers, ChunkSize)
+  Results = Parser.stream(ParseEvent, Pool=Parser.pool(ParseEvent))
+
+
+import tensorflow as tf
+tf.compat.v1.disable_eager_execution()
+
+from SegmentClassifier import SegmentClassifier
+
+Model = SegmentClassifier(graph_mode = GraphMode, precision = Precision)
+Model.load_weights(ModelDirectory + os.path.sep + "SegmentClassifier.h5")
+print("Info: Loaded the {} segment classifier from {} (acceptance {}, {} inference)".format(GraphMode, ModelDirectory, Acceptance, Precision))
+
+
+Writer = PredictionWriter(OutputFileName, Threshold)
+
+NumberOfEvents = 0
+NumberOfGraphs = 0
+PredictLatencies = []
+BatchLatencies = []
+Pending = []
+
+start = t.time()
+
+def Predict(Graphs):
+  BatchStart = t.time()
+  Batch = MakeBatch(Graphs)
+  PredictStart = t.time()
+  Prediction = Model.predict_on_batch(Batch)
+  PredictLatencies.append(t.time() - PredictStart)
+  for (EventID, X, EdgeIndex), Scores in zip(Graphs, SplitBatch(Graphs, np.asarray(Prediction))):
+    Writer.add(EventID, EdgeIndex, Scores)
+  BatchLatencies.append(t.time() - BatchStart)
+
+for Accepted, NumberOfChunkEvents in Results:
+  NumberOfEvents += NumberOfChunkEvents
+  Pending += [Graph for Index, Graph, SimString in Accepted]
+
+  if MaxEvents > 0 and NumberOfGraphs + len(Pending) >= MaxEvents:
+    Pending = Pending[:MaxEvents - NumberOfGraphs]
+
+  while len(Pending) >= BatchSize:
+    Predict(Pending[:BatchSize])
+    Pending = Pending[BatchSize:]
+    NumberOfGraphs += BatchSize
+
+  print("Events classified: {} (out of {} read events), {:.1f} events/s".format(NumberOfGraphs, NumberOfEvents, NumberOfGraphs / (t.time() - start)))
+
+  if (MaxEvents > 0 and NumberOfGraphs + len(Pending) >= MaxEvents) or Interrupted == True:
+    break
+
+if len(Pending) > 0:
+  Predict(Pending)
+  NumberOfGraphs += len(Pending)
+
+Results.close()
+
+Writer.close()
+inference_time = t.time() - start
+
+
+
+###################################################################################################
+# Step 4: Throughput and latency
+###################################################################################################
+
+
+print("\nInfo: Classified {} events (out of {} read events) in {:.1f} s, predicted edges written to {}".format(NumberOfGraphs, NumberOfEvents, inference_time, OutputFileName))
+print("Throughput: {:.1f} events/s (overall), {:.1f} events/s (model only)".format(NumberOfGraphs / inference_time, NumberOfGraphs / max(sum(PredictLatencies), 1e-9)))
+for Name, Latencies in [("predict_on_batch", PredictLatencies), ("batch (assembly + predict + write)", BatchLatencies)]:
+  if len(Latencies) > 0:
+    p50, p90, p99 = np.percentile(np.array(Latencies) * 1000, [50, 90, 99])
+    print("Latency per batch of {} events, {}: p50 {:.1f} ms, p90 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms".format(BatchSize, Name, p50, p90, p99, max(Latencies) * 1000))
@@ -0,0 +1,121 @@
+###################################################################################################
+#
+# EdgeFilter.py
+#
+# Copyright (C) by Andreas Zoglauer & Pranav Nagarajan
+# All rights reserved.
+#
+# Please see the file LICENSE in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+import threading
+
+import numpy as np
+
+
+class EdgeFilter:
+    """
+    Geometric and kinematic pre-filter of the candidate edges of a graph representation.
+
+    GraphRepresentation connects every hit to every 'eg' hit and all 'g' hits to each other on top of the
+    radius rule, thus most candidate edges of large events are trivially false. An edge sender -> receiver
+    is kept only if it passes all enabled criteria (0 disables a criterion):
+
+      max_gap:      distance between the two hits at most max_gap cm
+      max_dz:       difference in z (e.g. detector layers) at most max_dz cm
+      energy_ratio: energy deposit of the receiver at least energy_ratio times the one of the sender
+                    (electrons deposit more energy towards the end of their track)
+      top_k:        the sender is one of the top_k nearest remaining senders of the receiver
+
+    The filter counts the candidate and true edges before and after filtering, thus its report shows
+    which fraction of the true edges it keeps and how much smaller the graphs get.
+    """
+
+    def __init__(self, max_gap=0, max_dz=0, energy_ratio=0, top_k=0):
+        self.max_gap = max_gap
+        self.max_dz = max_dz
+        self.energy_ratio = energy_ratio
+        self.top_k = top_k
+
+        self.lock = threading.Lock()
+        self.events = 0
+        self.candidate_edges = 0
+        self.kept_edges = 0
+        self.true_edges = 0
+        self.kept_true_edges = 0
+        self.max_candidate_edges = 0
+        self.max_kept_edges = 0
+
+    @classmethod
+    def fromString(cls, description):
+        """
+        Creates a filter from a comma separated list of criteria, e.g. "max_gap=30,top_k=8"
+        Returns None for an empty description
+        """
+        if description == "":
+            return None
+        criteria = {}
+        for item in description.split(","):
+            name, value = item.split("=")
+            if name.strip() not in ["max_gap", "max_dz", "energy_ratio", "top_k"]:
+                raise ValueError("Unknown edge filter criterion " + name)
+            criteria[name.strip()] = float(value) if name.strip() != "top_k" else int(value)
+        return cls(**criteria)
+
+    def parameters(self):
+        """
+        The criteria, e.g. as part of the graph cache parameters
+        """
+        return {"max_gap": self.max_gap, "max_dz": self.max_dz, "energy_ratio": self.energy_ratio, "top_k": self.top_k}
+
+    def apply(self, A, hits, energies, origins):
+        """
+        Returns the adjacency matrix A (senders in rows, receivers in columns) with only the kept edges.
+        The origins (ID of the previous hit of each hit) are only used to count the true edges.
+        """
+        keep = A > 0
+
+        distance = np.sqrt(np.sum((hits[:, None, :] - hits[None, :, :]) ** 2, axis=2))
+        if self.max_gap > 0:
+            keep &= distance <= self.max_gap
+        if self.max_dz > 0:
+            keep &= np.abs(hits[:, None, 2] - hits[None, :, 2]) <= self.max_dz
+        if self.energy_ratio > 0:
+            keep &= energies[None, :] >= self.energy_ratio * energies[:, None]
+        if self.top_k > 0 and len(hits) > self.top_k:
+            nearest = np.argsort(np.where(keep, distance, np.inf), axis=0, kind='stable')[:self.top_k]
+            top = np.zeros_like(keep)
+            top[nearest, np.arange(len(hits))[None, :]] = True
+            keep &= top
+
+        # The true edges connect each hit with its previous hit
+        true = np.arange(1, len(hits) + 1)[:, None] == np.asarray(origins)[None, :]
+        candidates = int(np.count_nonzero(A))
+        kept = int(np.count_nonzero(keep))
+        with self.lock:
+            self.events += 1
+            self.candidate_edges += candidates
+            self.kept_edges += kept
+            self.true_edges += int(np.count_nonzero(true & (A > 0)))
+            self.kept_true_edges += int(np.count_nonzero(true & keep))
+            self.max_candidate_edges = max(self.max_candidate_edges, candidates)
+            self.max_kept_edges = max(self.max_kept_edges, kept)
+
+        return np.where(keep, A, 0)
+
+    def metrics(self):
+        events = max(self.events, 1)
+        return {"Filtered Events": self.events,
+                "True Edge Retention": self.kept_true_edges / max(self.true_edges, 1),
+                "Candidate Edges per Event": self.candidate_edges / events,
+                "Kept Edges per Event": self.kept_edges / events,
+                "Edge Reduction": 1 - self.kept_edges / max(self.candidate_edges, 1),
+                "Max Candidate Edges": self.max_candidate_edges,
+                "Max Kept Edges": self.max_kept_edges}
+
+    def report(self):
+        """
+        Summary of the filtered events, graphs taken from the graph cache are not counted
+        """
+        return "Edge Filter {}\n".format(self.parameters()) + "\n".join("{}: {}".format(name, value) for name, value in self.metrics().items())
@@ -2,11 +2,17 @@ import os
 import sys
 import signal
 import argparse
+import csv
+import time as t
+from datetime import datetime
 
 '''
-Runs a script to evaluate GNN at number of events starting from 
--l flag to -m flag parameters. The rate is increased exponentially, x2 events of previous iteration each iteration.
-All results are stored in the Results folder. -f flag to specify sim file (if sim.gz files are not in current dir).
+Evaluates the GNN at number of events starting from -l flag to -m flag parameters, separately for gamma (g) and
+electron (e) track acceptance. The rate is increased exponentially, x2 events of previous iteration each iteration.
+All runs happen in this one process: the sim file is parsed once (for the largest number of events), each run
+trains on a prefix of the accepted events, and graph representations are shared between the runs.
+All results are stored in the Results folder, with a table of all runs in EvalGNN.csv.
+-f flag to specify sim file (if sim.gz files are not in current dir).
 '''
 
 # FLAGS:
@@ -34,6 +40,13 @@ parser.add_argument('-l', '--min', default='5000', help='Starting num of events.
 parser.add_argument('-m', '--max', default='10000000', help='Ending num of events.')
 parser.add_argument('-r', '--rate', default='2', help='Multiplication rate.')
 parser.add_argument('-f', '--file', default='ComptonTrackIdentification_LowEnergy.p1.sim.gz', help='Simulation filepath.')
+parser.add_argument('-g', '--geometry', default='$(MEGALIB)/resource/examples/geomega/GRIPS/GRIPS.geo.setup', help='Geometry with which the sim file was created')
+parser.add_argument('-a', '--acceptances', default='g,e', help='Comma separated list of acceptances to evaluate')
+parser.add_argument('-b', '--batchsize', default='128', help='Batch size')
+parser.add_argument('-e', '--epochs', default='100', help='Epochs')
+parser.add_argument('-j', '--workers', default='1', help='Number of processes parsing the sim file in parallel')
+parser.add_argument('-c', '--graphcache', default='GraphCache', help='Directory of the on-disk cache of graph representations, empty to disable')
+parser.add_argument('-k', '--graphmode', default='dense', help='Graph input format: dense or sparse')
 
 
 args = parser.parse_args()
@@ -42,23 +55,217 @@ low = int(args.min)
 high = int(args.max)
 rate = int(args.rate)
 file = args.file
-split = 0.1
+Acceptances = [a for a in args.acceptances.split(",") if a != ""]
+BatchSize = int(args.batchsize)
+epochs = int(args.epochs)
+Workers = max(1, int(args.workers))
+GraphCacheDirectory = args.graphcache
+GraphMode = args.graphmode
 
-print("\n=================== \nGNN Evaluation Script\n===================")
+
+def testing_training_split(events):
+    split = 0.1
+    if events >= 10000000:
+        split = 0.01
+    elif events >= 1000000:
+        split = 0.05
+    return split
 
 
+# All numbers of events, up to and including the first one exceeding the maximum
+Sizes = []
 while True:
-    if low >= 1000000:
-        split = 0.05
-    elif low >= 10000000:
-        split = 0.01
-    print("\nEvaluating gamma tracks on {} events.".format(low))
-    os.system("python3 -u ComptonTrackIdentificationGNN.py -f {} -a g -m {} -s {}".format(file, low, split))
-    print("\nEvaluating electron tracks on {} events.".format(low))
-    os.system("python3 -u ComptonTrackIdentificationGNN.py -f {} -a e -m {} -s {}".format(file, low, split))
+    Sizes.append(low)
     if low > high:
         break
     low *= rate
 
-exit()
+MaxEvents = Sizes[-1]
+
+OutputDirectory = "Results" + os.path.sep + "EvalGNN_" + datetime.now().strftime("%Y_%m_%d_%H.%M.%S")
+os.makedirs(OutputDirectory)
+
+print("\n=================== \nGNN Evaluation Script\n===================")
+
+
+import tensorflow as tf
+tf.compat.v1.disable_eager_execution()
+import numpy as np
+
+from GraphRepresentation import GraphRepresentation, radius_default
+from GraphCache import GraphCache
+from GNNTraining import GNNTraining
+from EventStore import EventStore
+
+# Everything ROOT related can only be loaded here otherwise it interferes with the argparse
+from EventData import EventData
+from SimFileParser import SimFileParser
+
+import ROOT as M
+M.gSystem.Load("$(MEGALIB)/lib/libMEGAlib.so")
+M.PyConfig.IgnoreCommandLineOptions = True
+
+
+class SweepEvents:
+    """
+    Collects the parsed events without any acceptance applied. Its length is the number of events
+    accepted by the least accepting acceptance, thus parsing stops once all acceptances have enough events.
+    """
+
+    def __init__(self, Acceptances):
+        self.store = EventStore()
+        self.accepted = {Acceptance: 0 for Acceptance in Acceptances}
+
+    def append(self, Data):
+        self.store.append(Data)
+        for Acceptance in self.accepted:
+            if EventData.accept(Data.Type, Acceptance) is not None:
+                self.accepted[Acceptance] += 1
+
+    def __len__(self):
+        return min(self.accepted.values())
+
+
+def ParseEvent(Event):
+    Data = EventData()
+    Data.setAcceptance(None)
+    if Data.parse(Event) == True:
+        return Data
+    return None
+
+
+###################################################################################################
+# Parse the sim file once, for the largest number of events
+###################################################################################################
+
+start = t.time()
+
+Events = SweepEvents(Acceptances)
+NumberOfEvents = 0
+
+if Workers > 1:
+    Events, _, NumberOfEvents = SimFileParser(file, args.geometry, Workers).parse(ParseEvent, MaxEvents, DataSets=Events, Interrupted=lambda: Interrupted)
+else:
+    Geometry = M.MDGeometryQuest()
+    if Geometry.ScanSetupFile(M.MString(args.geometry)) == False:
+        print("Unable to load geometry " + args.geometry + " - Aborting!")
+        quit()
+
+    Reader = M.MFileEventsSim(Geometry)
+    if Reader.Open(M.MString(file)) == False:
+        print("Unable to open file " + file + ". Aborting!")
+        quit()
+
+    while len(Events) < MaxEvents and Interrupted == False:
+        Event = Reader.GetNextEvent()
+        if not Event:
+            break
+        M.SetOwnership(Event, True)
+        NumberOfEvents += 1
+
+        if Event.GetNIAs() > 0:
+            Data = ParseEvent(Event)
+            if Data is not None:
+                Events.append(Data)
 
+        if NumberOfEvents % 10000 == 0:
+            print("Events read: {}, accepted: {}".format(NumberOfEvents, Events.accepted))
+
+Events.store.shrink()
+parse_time = t.time() - start
+
+print("Info: Parsed {} events (out of {} read events), accepted: {}".format(len(Events.store), NumberOfEvents, Events.accepted))
+
+
+###################################################################################################
+# Train and evaluate on nested prefixes of the accepted events
+###################################################################################################
+
+Results = []
+
+for Acceptance in Acceptances:
+
+    start = t.time()
+    DataSets = Events.store.filter(lambda event: EventData.accept(event.Type, Acceptance), MaxEvents)
+    filter_time = t.time() - start
+
+    # Graphs of the same EventID differ between acceptances (e.g. "e" removes pure gamma hits)
+    GraphRepresentation.allGraphs.clear()
+    GraphRepresentation.cache = None
+    if GraphCacheDirectory != "":
+        GraphRepresentation.cache = GraphCache(GraphCacheDirectory, file, {"acceptance": Acceptance, "radius": radius_default})
+
+    for Size in Sizes:
+        if Interrupted == True:
+            break
+
+        print("\nEvaluating acceptance {} on {} events.".format(Acceptance, Size))
+
+        split = testing_training_split(Size)
+        Prefix = DataSets[0:Size]
+
+        NBatches = int(len(Prefix) / BatchSize)
+        if NBatches < 2:
+            print("Not enough data!")
+            continue
+
+        NTestingBatches = int(NBatches*split)
+        if NTestingBatches == 0:
+            NTestingBatches = 1
+        NTrainingBatches = NBatches - NTestingBatches
+
+        TrainingDataSets = Prefix[0:NTrainingBatches * BatchSize]
+        TestingDataSets = Prefix[NTrainingBatches * BatchSize:(NTrainingBatches + NTestingBatches) * BatchSize]
+
+        tf.keras.backend.clear_session()
+
+        Training = GNNTraining(TrainingDataSets, TestingDataSets, BatchSize, epochs, GraphMode)
+        Training.train()
+        Training.evaluate()
+
+        RunDirectory = OutputDirectory + os.path.sep + "{}_{}".format(Acceptance, Size)
+        os.makedirs(RunDirectory)
+        with open(RunDirectory + os.path.sep + "metrics.txt", "w") as f:
+            f.write("Num Events: {}\nAcceptance: {}\n\nEval Metrics\n{}\n\n".format(len(Prefix), Acceptance, Training.evals))
+            f.write("Edge Metrics (threshold {})\n{}\n".format(Training.evaluator.threshold, Training.evaluator.report()))
+
+        precisions, recalls, thresholds = Training.evaluator.precision_recall_curve()
+        np.save(RunDirectory + os.path.sep + 'Precision_Recall_Curve', {'Precision' : precisions, 'Recall' : recalls, 'Thresholds' : thresholds})
+
+        Result = {"Acceptance": Acceptance, "Events": len(Prefix), "Split": split,
+                  "Training Events": len(TrainingDataSets), "Testing Events": len(TestingDataSets),
+                  "Eval Loss": Training.evals[0], "Eval Accuracy": Training.evals[1]}
+        # The evaluator counts the testing events only, keep the number of events of the sweep point
+        Result.update({Name: Value for Name, Value in Training.evaluator.metrics().items() if Name != "Events"})
+        Result.update({"Time Parsing (shared)": parse_time, "Time Acceptance Filter (shared)": filter_time})
+        Result.update({"Time " + Stage: Time for Stage, Time in Training.times().items()})
+        Results.append(Result)
+
+        print(GraphRepresentation.allGraphs.stats())
+
+    if GraphRepresentation.cache is not None:
+        GraphRepresentation.cache.flush()
+
+
+###################################################################################################
+# Results table
+###################################################################################################
+
+Results.sort(key=lambda Result: (Result["Events"], Result["Acceptance"]))
+
+Columns = []
+for Result in Results:
+    Columns += [Column for Column in Result if Column not in Columns]
+
+with open(OutputDirectory + os.path.sep + "EvalGNN.csv", "w", newline="") as f:
+    writer = csv.DictWriter(f, fieldnames=Columns)
+    writer.writeheader()
+    writer.writerows(Results)
+
+print("\nAcceptance    Events     Accuracy   Precision  Recall     Training time [s]")
+for Result in Results:
+    print("{:<13} {:<10} {:<10.4f} {:<10.4f} {:<10.4f} {:.1f}".format(Result["Acceptance"], Result["Events"], Result["Accuracy"],
+                                                                    Result["Precision"], Result["Recall"], Result["Time Training"]))
+print("\nAll results: " + OutputDirectory + os.path.sep + "EvalGNN.csv")
+
+exit()
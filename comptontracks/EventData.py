@@ -18,6 +18,7 @@
 import random
 random.seed(0) # added this line for debugging
 import math
+import bisect
 import numpy as np
 import ROOT as M
 M.gSystem.Load("$(MEGALIB)/lib/libMEGAlib.so")
@@ -65,7 +66,7 @@ class EventData:
 
   def setAcceptance(self, Acceptance):
     """
-    Set which track types to accept:
+    Set which track types to accept (None: accept everything, the acceptance is applied later with accept):
     e: electron
     g: gamma
     p: positron
@@ -74,6 +75,43 @@ class EventData:
     self.Acceptance = Acceptance
 
 
+###################################################################################################
+
+
+  @staticmethod
+  def accept(Type, Acceptance):
+    """
+    Apply the acceptance to the hit types of an event
+    Return None if the event is rejected, otherwise a mask of the hits to keep
+    """
+
+    # If we have no electron track, reject the event
+    if "e" in Acceptance:
+      if not np.any(Type == "e"):
+        return None
+
+    # If we dont't have a "p" in acceptance reject all events with a positron hit
+    if not "p" in Acceptance:
+      if np.any(np.char.find(Type, "p") >= 0):
+        return None
+
+    # If we dont't have a "b" in acceptance reject all events with a bremsstrhlung hit
+    if not "b" in Acceptance:
+      if np.any(np.char.find(Type, "b") >= 0):
+        return None
+
+    # If we don't have "e" in acceptance reject all events with a track
+    if not "e" in Acceptance:
+      if np.any(Type == "e"):
+        return None
+
+    # If we don't have "g" in acceptance remove all hits with just a gamma interaction
+    if not "g" in Acceptance:
+      return Type != "g"
+
+    return np.ones(len(Type), dtype=bool)
+
+
 ###################################################################################################
 
 
@@ -484,9 +522,11 @@ class EventData:
     ZMin = 1000
     ZMax = -1000
 
+    Tables = self.originTables(SimEvent)
+
     Counter = 0
     for i in range(0, SimEvent.GetNHTs()):
-      Previous, TrackType = self.previousHTandType(SimEvent, i)
+      Previous, TrackType = self.previousHTandType(Tables, i)
       self.Origin[Counter] = Previous+1
       self.ID[Counter] = i+1
       self.X[Counter] = SimEvent.GetHTAt(i).GetPosition().X()
@@ -521,51 +561,20 @@ class EventData:
           self.Type[i] = "g"
 
 
-    # If we have no electron track, reject the event
-    if "e" in self.Acceptance:
-      FoundTrack = False
-      for i in range(0, Counter):
-        if self.Type[i] == "e":
-          FoundTrack = True
-          break
-      if FoundTrack == False:
-        if Debug == True: print("Event {} rejected: No electron track".format(self.ID))
+    # Apply the acceptance (not done if it is None, e.g. when several acceptances are applied later on)
+    if self.Acceptance is not None:
+      Keep = EventData.accept(self.Type, self.Acceptance)
+      if Keep is None:
+        if Debug == True: print("Event {} rejected by acceptance {}".format(self.ID, self.Acceptance))
         return False
-
-    # If we dont't have a "b" in acceptance reject all events with a bremsstrahlung hit
-    if not "p" in self.Acceptance:
-      for i in range(0, Counter):
-        if "p" in self.Type[i]:
-          if Debug == True: print("Event {} rejected: Not accepting events with positrons".format(self.ID))
-          return False
-
-    # If we dont't have a "b" in acceptance reject all events with a bremsstrhlung hit
-    if not "b" in self.Acceptance:
-      for i in range(0, Counter):
-        if "b" in self.Type[i]:
-          if Debug == True: print("Event {} rejected: Not accepting hits with bremstrahlung".format(self.ID))
-          return False
-
-    # If we don't have "e" in acceptance reject all events with a track
-    if not "e" in self.Acceptance:
-      for i in range(0, Counter):
-        if self.Type[i] == "e":
-          if Debug == True: print("Event {} rejected: Not accepting hits with electron tracks".format(self.ID))
-          return False
-
-    # If we don't have "g" in acceptance remove all hits with just a gamma interaction
-    if not "g" in self.Acceptance:
-      ToRemove = []
-      for i in range(0, Counter):
-        if self.Type[i] == "g":
-          ToRemove.append(i)
-      self.Origin = np.delete(self.Origin, ToRemove)
-      self.ID = np.delete(self.ID, ToRemove)
-      self.X = np.delete(self.X, ToRemove)
-      self.Y = np.delete(self.Y, ToRemove)
-      self.Z = np.delete(self.Z, ToRemove)
-      self.E = np.delete(self.E, ToRemove)
-      self.Type = np.delete(self.Type, ToRemove)
+      if not np.all(Keep):
+        self.Origin = self.Origin[Keep]
+        self.ID = self.ID[Keep]
+        self.X = self.X[Keep]
+        self.Y = self.Y[Keep]
+        self.Z = self.Z[Keep]
+        self.E = self.E[Keep]
+        self.Type = self.Type[Keep]
 
     self.unique = len(np.unique(self.Z))
     length_filter = 2
@@ -590,71 +599,91 @@ class EventData:
 ###################################################################################################
 
 
-  def previousHTandType(self, SimEvent, ID):
+  def originTables(self, SimEvent):
     """
-    Return the previous HT ID given the HT ID in the SimEvent, -1 if there is none
+    Extract the origin information of all HTs and IAs once, so that previousHTandType does not have to
+    go back to the MSimEvent for every hit:
+    HTSmallestOrigin: smallest origin IA ID of each HT
+    HTsWithOrigin: origin IA ID -> sorted list of the HTs which have it as one of their origins
+    FirstHTWithSmallestOrigin: IA ID -> first HT whose smallest origin it is
+    IAOriginID, IAId, IAType: origin IA ID, ID and track type of each IA (by position)
+    IAPosition: IA ID -> position of the IA
     """
 
-    # If there is a hit with the same Origin, but earlier up in the list, this one is the earlier
+    HTSmallestOrigin = np.zeros(shape=(SimEvent.GetNHTs()), dtype=int)
+    HTsWithOrigin = {}
+    FirstHTWithSmallestOrigin = {}
+    for h in range(0, SimEvent.GetNHTs()):
+      HT = SimEvent.GetHTAt(h)
+      HTSmallestOrigin[h] = HT.GetSmallestOrigin()
+      FirstHTWithSmallestOrigin.setdefault(HTSmallestOrigin[h], h)
+      for o in range(0, HT.GetNOrigins()):
+        HTs = HTsWithOrigin.setdefault(HT.GetOriginAt(o), [])
+        if len(HTs) == 0 or HTs[-1] != h:
+          HTs.append(h)
+
+    IAOriginID = np.zeros(shape=(SimEvent.GetNIAs()), dtype=int)
+    IAId = np.zeros(shape=(SimEvent.GetNIAs()), dtype=int)
+    IAType = np.zeros(shape=(SimEvent.GetNIAs()), dtype=np.dtype('U2'))
+    IAPosition = {}
+    for i in range(0, SimEvent.GetNIAs()):
+      IA = SimEvent.GetIAAt(i)
+      IAOriginID[i] = IA.GetOriginID()
+      IAId[i] = IA.GetId()
+      IAType[i] = self.getType(IA.GetProcess().Data(), IA.GetSecondaryParticleID())
+      IAPosition.setdefault(IAId[i], i)
 
-    Type = "eg"
-    PreviousHitID = -1
+    return {"HTSmallestOrigin": HTSmallestOrigin, "HTsWithOrigin": HTsWithOrigin, "FirstHTWithSmallestOrigin": FirstHTWithSmallestOrigin,
+            "IAOriginID": IAOriginID, "IAId": IAId, "IAType": IAType, "IAPosition": IAPosition}
 
-    SmallestOriginID = SimEvent.GetHTAt(ID).GetSmallestOrigin()
-    #print("SmallestOriginID: {}".format(SmallestOriginID))
-    if ID > 0:
-      #print("Before range {}".format(range(ID-1, 0, -1)))
-      for h in range(ID-1, -1, -1):
-        #print(h)
-        if SimEvent.GetHTAt(h).IsOrigin(SmallestOriginID) == True:
-          PreviousHitID = h
-          Type = "e"
-          break
 
-    if PreviousHitID >= 0:
-      #print("Previous hit for {} in same track {}".format(ID, PreviousHitID))
-      return PreviousHitID, Type
+###################################################################################################
 
-    # Now check the origin one up, if they have the same origin ID. If this is the case the one up is the previous IA and check for its HTs
-    if SmallestOriginID > 1:
-      OriginID = SmallestOriginID
-      while OriginID > 1:
-        IAOriginID = SimEvent.GetIAAt(OriginID-1).GetOriginID()
-        IAOriginIDUp = SimEvent.GetIAAt(OriginID-2).GetOriginID()
 
-        #print("Origins here and up: {} {}".format(IAOriginID, IAOriginIDUp))
-        if IAOriginID == IAOriginIDUp:
-          for h in range(0, SimEvent.GetNHTs()):
-            if SimEvent.GetHTAt(h).GetSmallestOrigin() == SimEvent.GetIAAt(OriginID-2).GetId():
-              PreviousHitID = h
-              Type = self.getType(SimEvent.GetIAAt(OriginID-2).GetProcess().Data(), SimEvent.GetIAAt(OriginID-2).GetSecondaryParticleID())
-              break
+  def previousHTandType(self, Tables, ID):
+    """
+    Return the previous HT ID given the HT ID in the SimEvent, -1 if there is none
+    Tables are the origin tables of the SimEvent created by originTables
+    """
+
+    # If there is a hit with the same Origin, but earlier up in the list, this one is the earlier
 
-          if PreviousHitID >= 0:
-            #print("Previous hit for {} in main IA sequence {}".format(ID, PreviousHitID))
-            return PreviousHitID, Type
+    SmallestOriginID = Tables["HTSmallestOrigin"][ID]
+    FirstHTWithSmallestOrigin = Tables["FirstHTWithSmallestOrigin"]
+    IAOriginID = Tables["IAOriginID"]
 
-        OriginID -= 1
+    HTs = Tables["HTsWithOrigin"].get(SmallestOriginID, [])
+    Index = bisect.bisect_left(HTs, ID)
+    if Index > 0:
+      #print("Previous hit for {} in same track {}".format(ID, HTs[Index-1]))
+      return HTs[Index-1], "e"
+
+    # Now check the origin one up, if they have the same origin ID. If this is the case the one up is the previous IA and check for its HTs
+    OriginID = SmallestOriginID
+    while OriginID > 1:
+      #print("Origins here and up: {} {}".format(IAOriginID[OriginID-1], IAOriginID[OriginID-2]))
+      if IAOriginID[OriginID-1] == IAOriginID[OriginID-2]:
+        PreviousHitID = FirstHTWithSmallestOrigin.get(Tables["IAId"][OriginID-2], -1)
+        if PreviousHitID >= 0:
+          #print("Previous hit for {} in main IA sequence {}".format(ID, PreviousHitID))
+          return PreviousHitID, str(Tables["IAType"][OriginID-2])
+
+      OriginID -= 1
 
 
     # Now go through IA's this one originated from, if they have hits, if yes it is the Hit with the SMALLEST ID
     OriginID = SmallestOriginID
     while True:
-      OriginID = SimEvent.GetIAById(OriginID).GetOriginID()
+      OriginID = IAOriginID[Tables["IAPosition"][OriginID]]
       #print("Origin: {}".format(OriginID))
       if OriginID > 1:
-        for h in range(0, SimEvent.GetNHTs()):
-          if SimEvent.GetHTAt(h).GetSmallestOrigin() == OriginID:
-            PreviousHitID = h
-            Type = self.getType(SimEvent.GetIAById(OriginID).GetProcess().Data(), SimEvent.GetIAById(OriginID).GetSecondaryParticleID())
-            break
+        PreviousHitID = FirstHTWithSmallestOrigin.get(OriginID, -1)
+        if PreviousHitID >= 0:
+          #print("Previous hit for {} in main IA sequence {}".format(ID, PreviousHitID))
+          return PreviousHitID, str(Tables["IAType"][Tables["IAPosition"][OriginID]])
       else:
         break
 
-      if PreviousHitID >= 0:
-        #print("Previous hit for {} in main IA sequence {}".format(ID, PreviousHitID))
-        return PreviousHitID, Type
-
     # Nothing found
     #print("No previous hit found")
     return -1, "eg"
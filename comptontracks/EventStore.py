@@ -0,0 +1,212 @@
+###################################################################################################
+#
+# EventStore.py
+#
+# Copyright (C) by Andreas Zoglauer & Pranav Nagarajan
+# All rights reserved.
+#
+# Please see the file LICENSE in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+import numpy as np
+
+
+# Hit types as stored in the event store, the uint8 code of a type is its position in this list
+type_names = ["", "eg", "e", "g", "p", "b", "?"]
+type_codes = {name: code for code, name in enumerate(type_names)}
+type_lookup = np.array(type_names, dtype=np.dtype('U2'))
+
+
+def encode_types(Type):
+    """
+    Converts an array of hit type strings into uint8 codes
+    """
+    names, inverse = np.unique(np.asarray(Type), return_inverse=True)
+    return np.array([type_codes[str(name)] for name in names], dtype=np.uint8)[inverse.reshape(-1)]
+
+
+class EventView:
+    """
+    One event of an EventStore with the same attributes as EventData.
+    The hit arrays are views into the store; Type is decoded into strings on access.
+    """
+
+    def __init__(self, store, e):
+        self.store = store
+        self.start = store.Offsets[e]
+        self.stop = store.Offsets[e + 1]
+        self.EventID = int(store.EventID[e])
+        self.OriginPositionX, self.OriginPositionY, self.OriginPositionZ = store.OriginPosition[e]
+
+    @property
+    def X(self):
+        return self.store.X[self.start:self.stop]
+
+    @property
+    def Y(self):
+        return self.store.Y[self.start:self.stop]
+
+    @property
+    def Z(self):
+        return self.store.Z[self.start:self.stop]
+
+    @property
+    def E(self):
+        return self.store.E[self.start:self.stop]
+
+    @property
+    def ID(self):
+        return self.store.ID[self.start:self.stop]
+
+    @property
+    def Origin(self):
+        return self.store.Origin[self.start:self.stop]
+
+    @property
+    def Type(self):
+        return type_lookup[self.store.Type[self.start:self.stop]]
+
+    @property
+    def unique(self):
+        return len(np.unique(self.Z))
+
+    def print(self):
+        print("Event ID: {}".format(self.EventID))
+        print("  Origin Z: {}".format(self.OriginPositionZ))
+        Type = self.Type
+        for h in range(0, self.stop - self.start):
+            print("  Hit {} (origin: {}): type={}, pos=({}, {}, {})cm, E={}keV".format(self.ID[h], self.Origin[h], Type[h], self.X[h], self.Y[h], self.Z[h], self.E[h]))
+
+
+class EventStore:
+    """
+    Struct-of-arrays container of many events, replacing lists of EventData objects.
+
+    The hits of all events are stored in flat columns (float32 X, Y, Z, E; int32 ID, Origin; uint8 coded Type),
+    the hits of event e are the entries Offsets[e]:Offsets[e + 1]. EventID and OriginPosition are per event.
+    Slicing a store with store[a:b] is O(1) and shares the columns, e.g. for training/testing splits;
+    store[e] returns an EventData-compatible EventView. Slices are read-only.
+
+    Events are added with append(); the columns grow by doubling and are trimmed with shrink().
+    """
+
+    def __init__(self, capacity=1024, hit_capacity=16384):
+        self.EventID = np.zeros(capacity, dtype=np.int64)
+        self.OriginPosition = np.zeros((capacity, 3), dtype=np.float64)
+        self.Offsets = np.zeros(capacity + 1, dtype=np.int64)
+        self.X = np.zeros(hit_capacity, dtype=np.float32)
+        self.Y = np.zeros(hit_capacity, dtype=np.float32)
+        self.Z = np.zeros(hit_capacity, dtype=np.float32)
+        self.E = np.zeros(hit_capacity, dtype=np.float32)
+        self.ID = np.zeros(hit_capacity, dtype=np.int32)
+        self.Origin = np.zeros(hit_capacity, dtype=np.int32)
+        self.Type = np.zeros(hit_capacity, dtype=np.uint8)
+        self.size = 0
+
+    @classmethod
+    def fromColumns(cls, EventID, OriginPosition, Offsets, ID, Origin, X, Y, Z, E, Type):
+        """
+        Creates a store from complete columns, Type can be strings or uint8 codes
+        """
+        store = cls.__new__(cls)
+        store.EventID = np.asarray(EventID, dtype=np.int64)
+        store.OriginPosition = np.asarray(OriginPosition, dtype=np.float64)
+        store.Offsets = np.asarray(Offsets, dtype=np.int64)
+        store.X = np.asarray(X, dtype=np.float32)
+        store.Y = np.asarray(Y, dtype=np.float32)
+        store.Z = np.asarray(Z, dtype=np.float32)
+        store.E = np.asarray(E, dtype=np.float32)
+        store.ID = np.asarray(ID, dtype=np.int32)
+        store.Origin = np.asarray(Origin, dtype=np.int32)
+        Type = np.asarray(Type)
+        store.Type = Type if Type.dtype == np.uint8 else encode_types(Type)
+        store.size = len(store.EventID)
+        return store
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, e):
+        if isinstance(e, slice):
+            start, stop, step = e.indices(self.size)
+            if step != 1:
+                raise IndexError("EventStore slices must be contiguous")
+            stop = max(start, stop)
+            store = EventStore.fromColumns(self.EventID[start:stop], self.OriginPosition[start:stop], self.Offsets[start:stop + 1],
+                                           self.ID, self.Origin, self.X, self.Y, self.Z, self.E, self.Type)
+            return store
+        if e < 0:
+            e += self.size
+        if e < 0 or e >= self.size:
+            raise IndexError("Event index {} out of range".format(e))
+        return EventView(self, e)
+
+    def __iter__(self):
+        return (EventView(self, e) for e in range(self.size))
+
+    def hits(self):
+        """
+        Number of hits of each event
+        """
+        return np.diff(self.Offsets[:self.size + 1])
+
+    def nbytes(self):
+        return sum(a.nbytes for a in [self.EventID, self.OriginPosition, self.Offsets, self.X, self.Y, self.Z, self.E, self.ID, self.Origin, self.Type])
+
+    def append(self, Data, Keep=None):
+        """
+        Adds a copy of the hits of an EventData (or anything with the same attributes) as a new event
+        Keep: optional mask of the hits to copy
+        """
+        if Keep is None:
+            Keep = slice(None)
+        start = self.Offsets[self.size]
+        stop = start + len(np.asarray(Data.X)[Keep])
+        if self.size + 1 >= len(self.EventID):
+            self.EventID = np.resize(self.EventID, 2 * len(self.EventID))
+            self.OriginPosition = np.resize(self.OriginPosition, (2 * len(self.OriginPosition), 3))
+            self.Offsets = np.resize(self.Offsets, 2 * len(self.Offsets) - 1)
+        if stop > len(self.X):
+            capacity = max(stop, 2 * len(self.X))
+            for name in ["X", "Y", "Z", "E", "ID", "Origin", "Type"]:
+                setattr(self, name, np.resize(getattr(self, name), capacity))
+
+        self.EventID[self.size] = Data.EventID
+        self.OriginPosition[self.size] = (Data.OriginPositionX, Data.OriginPositionY, Data.OriginPositionZ)
+        self.X[start:stop] = np.asarray(Data.X)[Keep]
+        self.Y[start:stop] = np.asarray(Data.Y)[Keep]
+        self.Z[start:stop] = np.asarray(Data.Z)[Keep]
+        self.E[start:stop] = np.asarray(Data.E)[Keep]
+        self.ID[start:stop] = np.asarray(Data.ID)[Keep]
+        self.Origin[start:stop] = np.asarray(Data.Origin)[Keep]
+        self.Type[start:stop] = encode_types(np.asarray(Data.Type)[Keep])
+        self.size += 1
+        self.Offsets[self.size] = stop
+
+    def filter(self, function, MaxEvents=None):
+        """
+        Returns a new store with the events for which function(event) returns a mask of the hits to keep,
+        events for which it returns None are dropped. Stops after MaxEvents events, if given.
+        """
+        store = EventStore()
+        for e in range(self.size):
+            if MaxEvents is not None and len(store) >= MaxEvents:
+                break
+            event = EventView(self, e)
+            Keep = function(event)
+            if Keep is not None:
+                store.append(event, Keep)
+        store.shrink()
+        return store
+
+    def shrink(self):
+        """
+        Releases the unused capacity of all columns
+        """
+        hits = self.Offsets[self.size]
+        self.EventID = self.EventID[:self.size].copy()
+        self.OriginPosition = self.OriginPosition[:self.size].copy()
+        self.Offsets = self.Offsets[:self.size + 1].copy()
+        for name in ["X", "Y", "Z", "E", "ID", "Origin", "Type"]:
+            setattr(self, name, getattr(self, name)[:hits].copy())
@@ -0,0 +1,409 @@
+###################################################################################################
+#
+# GNNTraining.py
+#
+# Copyright (C) by Andreas Zoglauer & Pranav Nagarajan
+# All rights reserved.
+#
+# Please see the file LICENSE in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+'''
+Training (Step 5) and evaluation (Step 6) of the segment classifier on given training and testing events.
+Used by ComptonTrackIdentificationGNN.py for a single run and by EvalGNN.py for a sweep of runs in one process.
+'''
+
+import json
+import os
+import time as t
+
+import numpy as np
+import tensorflow as tf
+from tqdm import tqdm
+
+from GraphRepresentation import GraphRepresentation
+from BucketSampler import BucketSampler
+from StreamingEvaluator import StreamingEvaluator
+from SegmentClassifier import SegmentClassifier
+
+
+class PrecisionRecallCallback(tf.keras.callbacks.Callback):
+    best_train_recall = 0
+    best_train_precision = 0
+    best_train_accuracy = 0
+
+    def __init__(self, training):
+        super().__init__()
+        self.training = training
+
+    def on_epoch_end(self, epoch, logs=None):
+        keys = list(logs.keys())
+        best_train_accuracy = max(self.best_train_accuracy, logs[keys[1]])
+        best_train_precision = max(self.best_train_precision, logs[keys[2]])
+        best_train_recall = max(self.best_train_recall, logs[keys[3]])
+
+        # Batches are prepared ahead of training, so this is approximate at the epoch boundaries
+        # (not counted with the tf.data input pipeline, padded_batch pads outside of Python)
+        training = self.training
+        if training.GraphMode == "dense" and training.padded_entries > 0:
+            print("Padding ratio (padded / real incidence matrix entries) in epoch {}: {:.2f}".format(epoch + 1, training.padded_entries / max(training.real_entries, 1)))
+        training.padded_entries = 0
+        training.real_entries = 0
+
+
+class StepTimeCallback(tf.keras.callbacks.Callback):
+    """
+    Records the wall time of each training step, from the end of the previous step (or the start of the epoch)
+    to the end of this one, thus including the time the model waits for its input batch
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.step_times = []
+        self.last = None
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.last = t.time()
+
+    def on_train_batch_end(self, batch, logs=None):
+        now = t.time()
+        self.step_times.append(now - self.last)
+        self.last = now
+
+
+class GNNTraining:
+    """
+    Trains a new segment classifier on TrainingDataSets and evaluates it on TestingDataSets.
+    Both are sequences of events (e.g. EventStore slices) whose lengths are multiples of BatchSize.
+    The graph representations are taken from GraphRepresentation.allGraphs, thus they are shared between
+    several trainings on (overlapping) event sets in the same process.
+
+    InputPipeline selects how training and evaluation batches are fed to the model:
+      generator: graphs are built and padded in a Python generator on the main thread
+      tfdata:    a tf.data pipeline builds the graphs in parallel map stages, pads them with padded_batch
+                 (dense mode) and prefetches the batches while the model trains
+    The median step time (see StepTimeCallback) allows to compare both.
+    """
+
+    def __init__(self, TrainingDataSets, TestingDataSets, BatchSize, epochs, GraphMode="dense", viz_threshold=0.5,
+                 HitBuckets=[], EdgeBuckets=[], InputPipeline="generator"):
+        self.TrainingDataSets = TrainingDataSets
+        self.TestingDataSets = TestingDataSets
+        self.BatchSize = BatchSize
+        self.epochs = epochs
+        self.GraphMode = GraphMode
+        self.viz_threshold = viz_threshold
+        self.InputPipeline = InputPipeline
+        self.UseBuckets = len(HitBuckets) > 0 or len(EdgeBuckets) > 0
+
+        self.NTrainingBatches = len(TrainingDataSets) // BatchSize
+        self.NTestingBatches = len(TestingDataSets) // BatchSize
+
+        self.datagen_time = 0
+        self.pad_time = 0
+        self.train_time = 0
+        self.test_datagen_time = 0
+        self.test_pad_time = 0
+        self.pred_time = 0
+        self.eval_time = 0
+
+        # Padded and real number of incidence matrix entries of the training batches in the current epoch
+        self.padded_entries = 0
+        self.real_entries = 0
+        # ... and of all epochs
+        self.total_padded_entries = 0
+        self.total_real_entries = 0
+
+        self.pred_graph_ids = []
+
+        self.step_time_callback = StepTimeCallback()
+
+        # Size-bucketed batching: group events of similar hit and edge counts into the same batch
+        self.TrainingSampler = None
+        self.TestingSampler = None
+        self.PredictionSampler = None
+        if self.UseBuckets:
+            start = t.time()
+
+            hits, edges = self.graph_sizes(TrainingDataSets)
+            self.TrainingSampler = BucketSampler(hits, edges, BatchSize, HitBuckets, EdgeBuckets)
+            hits, edges = self.graph_sizes(TestingDataSets)
+            self.TestingSampler = BucketSampler(hits, edges, BatchSize, HitBuckets, EdgeBuckets)
+            self.PredictionSampler = BucketSampler(hits, edges, BatchSize, HitBuckets, EdgeBuckets, shuffle = False)
+
+            self.datagen_time += (t.time() - start)
+
+        self.model = SegmentClassifier(graph_mode = GraphMode)
+
+    def graph_sizes(self, data_sets):
+        graphs = [GraphRepresentation.newGraphRepresentation(event, threshold=self.viz_threshold) for event in data_sets]
+        return [len(graph.graphData[3]) for graph in graphs], [len(graph.graphData[4]) for graph in graphs]
+
+    # Yields the event indices of the next training or testing batch, forever
+    def random_batches(self, sampler, num_batches):
+        while True:
+            if sampler is None:
+                random_batch = np.random.randint(0, num_batches - 1)
+                yield range(random_batch * self.BatchSize, (random_batch + 1) * self.BatchSize)
+            else:
+                for batch in sampler.epoch():
+                    yield batch
+
+    # Dense graph mode: pad every event's X, Ri, Ro and y to the largest event of the batch
+    @staticmethod
+    def pad_batch(graphs):
+        max_hits = max(len(graph.graphData[3]) for graph in graphs)
+        max_edges = max(len(graph.graphData[4]) for graph in graphs)
+
+        batch_X = []
+        batch_Ri = []
+        batch_Ro = []
+        batch_y = []
+        for graph in graphs:
+            A, Ro, Ri, X, y = graph.graphData
+            batch_X.append(np.pad(X, [(0, max_hits - len(X)), (0, 0)], mode = 'constant'))
+            batch_Ri.append(np.pad(Ri, [(0, max_hits - len(Ri)), (0, max_edges - len(Ri[0]))], mode = 'constant'))
+            batch_Ro.append(np.pad(Ro, [(0, max_hits - len(Ro)), (0, max_edges - len(Ro[0]))], mode = 'constant'))
+            batch_y.append(np.pad(y, [(0, max_edges - len(y))], mode = 'constant'))
+
+        return ([np.array(batch_X), np.array(batch_Ri), np.array(batch_Ro)], np.array(batch_y))
+
+    # Sparse graph mode: concatenate all events into one graph, shifting each event's edge list by its hit offset
+    @staticmethod
+    def concatenate_batch(graphs):
+        hit_offsets = np.cumsum([0] + [len(graph.graphData[3]) for graph in graphs[:-1]])
+
+        batch_X = np.concatenate([graph.graphData[3] for graph in graphs])
+        batch_edges = np.concatenate([graph.edgeIndex + offset for graph, offset in zip(graphs, hit_offsets)], axis = 1)
+        batch_y = np.concatenate([graph.graphData[4] for graph in graphs])
+
+        return ([batch_X[None], batch_edges[1][None], batch_edges[0][None]], batch_y[None])
+
+    def make_batch(self, graphs):
+        if self.GraphMode == "sparse":
+            return self.concatenate_batch(graphs)
+        return self.pad_batch(graphs)
+
+    # Splits per-edge batch arrays (labels or model output) into one array per event, unpadded in sparse mode
+    def split_batch(self, graphs, batch_array):
+        if self.GraphMode == "sparse":
+            edge_offsets = np.cumsum([len(graph.graphData[4]) for graph in graphs[:-1]])
+            return np.split(batch_array[0], edge_offsets)
+        return list(batch_array)
+
+    def data_generator(self):
+        batches = self.random_batches(self.TrainingSampler, self.NTrainingBatches)
+        while True:
+            start = t.time()
+
+            graphs = []
+            for e in next(batches):
+
+                # Prepare graph for a set of simulated events (training)
+                event = self.TrainingDataSets[e]
+                graphs.append(GraphRepresentation.newGraphRepresentation(event, threshold=self.viz_threshold))
+
+            sizes = np.array([(len(graph.graphData[3]), len(graph.graphData[4])) for graph in graphs])
+            self.padded_entries += len(graphs) * sizes[:, 0].max() * sizes[:, 1].max()
+            self.real_entries += np.sum(sizes[:, 0] * sizes[:, 1])
+            self.total_padded_entries += len(graphs) * sizes[:, 0].max() * sizes[:, 1].max()
+            self.total_real_entries += np.sum(sizes[:, 0] * sizes[:, 1])
+
+            self.datagen_time += (t.time() - start)
+            #
+            start = t.time()
+
+            # Padding to maximum dimension (or concatenation in sparse mode)
+            batch = self.make_batch(graphs)
+
+            self.pad_time += (t.time() - start)
+
+            yield batch
+
+    def predict_generator(self):
+        self.pred_graph_ids = []
+        if self.UseBuckets:
+            batches = self.PredictionSampler.epoch()
+        else:
+            batches = [range(batch_num * self.BatchSize, (batch_num + 1) * self.BatchSize) for batch_num in range(self.NTestingBatches)]
+        for batch in batches:
+            start = t.time()
+
+            graphs = []
+            for e in batch:
+
+                # Prepare graph for a set of simulated events (testing)
+                event = self.TestingDataSets[e]
+                graphRepresentation = GraphRepresentation.newGraphRepresentation(event, threshold=self.viz_threshold)
+                self.pred_graph_ids.append(graphRepresentation.EventID)
+                graphs.append(graphRepresentation)
+
+            self.test_datagen_time += (t.time() - start)
+
+            start = t.time()
+
+            # Padding to maximum dimension (or concatenation in sparse mode)
+            batch = self.make_batch(graphs)
+
+            self.test_pad_time += (t.time() - start)
+
+            yield graphs, batch
+
+    # tf.data version of data_generator and evaluate_generator: the graphs of single events (dense) or of whole
+    # batches (sparse) are built in parallel by tf.numpy_function map stages, which release the GIL while NumPy works.
+    # The event order is the same as in the generators, since the indices come from the same samplers.
+    def dataset(self, data_sets, sampler, num_batches, training):
+
+        def indices():
+            for batch in self.random_batches(sampler, num_batches):
+                for e in batch:
+                    yield e
+
+        def event_graph(e):
+            start = t.time()
+            graph = GraphRepresentation.newGraphRepresentation(data_sets[int(e)], threshold=self.viz_threshold)
+            if training:
+                # Summed over all parallel map calls, thus CPU time instead of wall time
+                self.datagen_time += (t.time() - start)
+            return graph
+
+        def event_tensors(e):
+            A, Ro, Ri, X, y = event_graph(e).graphData
+            return X, Ri, Ro, y
+
+        def batch_tensors(batch):
+            ([X, Ri, Ro], y) = self.concatenate_batch([event_graph(e) for e in batch])
+            return X, Ri.astype(np.int32), Ro.astype(np.int32), y
+
+        dataset = tf.data.Dataset.from_generator(indices, output_signature = tf.TensorSpec(shape = (), dtype = tf.int64))
+
+        if self.GraphMode == "sparse":
+            # One concatenated graph per batch, nothing to pad
+            dataset = dataset.batch(self.BatchSize)
+            dataset = dataset.map(lambda batch: tf.numpy_function(batch_tensors, [batch], [tf.float32, tf.int32, tf.int32, tf.float32]),
+                                  num_parallel_calls = tf.data.AUTOTUNE)
+            shapes = [(1, None, 4), (1, None), (1, None), (1, None)]
+        else:
+            dataset = dataset.map(lambda e: tf.numpy_function(event_tensors, [e], [tf.float32, tf.float32, tf.float32, tf.float32]),
+                                  num_parallel_calls = tf.data.AUTOTUNE)
+            shapes = [(None, 4), (None, None), (None, None), (None,)]
+
+        def set_shapes(X, Ri, Ro, y):
+            for tensor, shape in zip([X, Ri, Ro, y], shapes):
+                tensor.set_shape(shape)
+            return (X, Ri, Ro), y
+
+        dataset = dataset.map(set_shapes)
+
+        if self.GraphMode == "dense":
+            # Pads every event's X, Ri, Ro and y with zeros to the largest event of the batch, like pad_batch
+            dataset = dataset.padded_batch(self.BatchSize)
+
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+    def evaluate_generator(self):
+        batches = self.random_batches(self.TestingSampler, self.NTestingBatches)
+        while True:
+
+            graphs = []
+            for e in next(batches):
+
+                # Prepare graph for a set of simulated events (testing)
+                event = self.TestingDataSets[e]
+                graphs.append(GraphRepresentation.newGraphRepresentation(event, threshold=self.viz_threshold))
+
+            # Padding to maximum dimension (or concatenation in sparse mode)
+            yield self.make_batch(graphs)
+
+    def train(self):
+        """
+        Step 5: Training the graph neural network
+        """
+        self.callback = PrecisionRecallCallback(self)
+        # try different monitor values?
+        self.stopping = tf.keras.callbacks.EarlyStopping(monitor='precision', min_delta=0, patience=3, verbose=0, mode='auto',
+                                                         baseline=None, restore_best_weights=True)
+
+        if self.InputPipeline == "tfdata":
+            training_data = self.dataset(self.TrainingDataSets, self.TrainingSampler, self.NTrainingBatches, training=True)
+        else:
+            training_data = self.data_generator()
+
+        train_start = t.time()
+        # Note: Not using stopping right now, to generate larger GIF.
+        self.hist = self.model.fit(training_data, steps_per_epoch = self.NTrainingBatches, epochs = self.epochs, callbacks=[self.callback, self.step_time_callback])
+        self.train_time = t.time() - train_start
+
+    def evaluate(self, OutputDirectory=None):
+        """
+        Step 6: Evaluating the graph neural network
+        OutputDirectory: if given, the per-edge outputs of the test set are written there
+        """
+        # Generate predictions for a graph
+        start = t.time()
+
+        # Metrics are accumulated in fixed-size score histograms, only the padding-free per-edge outputs are written if requested
+        self.evaluator = StreamingEvaluator(output_directory = OutputDirectory)
+
+        for graphs, (input, output) in tqdm(self.predict_generator()):
+            batch_pred = self.model.predict_on_batch(input)
+            batch_predictions = self.split_batch(graphs, batch_pred)
+
+            # Attach the predictions right away, the graphs might be evicted from memory later on
+            for graph, prediction in zip(graphs, batch_predictions):
+                self.evaluator.add(graph, prediction)
+            GraphRepresentation.add_predictions(graphs, batch_predictions)
+
+        self.evaluator.close()
+
+        assert len(self.pred_graph_ids) == self.evaluator.events
+
+        # All training and testing graphs exist by now
+        if GraphRepresentation.cache is not None:
+            GraphRepresentation.cache.flush()
+
+        self.pred_time = t.time() - start
+
+        start = t.time()
+
+        if self.InputPipeline == "tfdata":
+            testing_data = self.dataset(self.TestingDataSets, self.TestingSampler, self.NTestingBatches, training=False)
+        else:
+            testing_data = self.evaluate_generator()
+
+        self.evals = self.model.evaluate(testing_data, steps = self.NTestingBatches)
+
+        print(self.evals)
+
+        self.eval_time = t.time() - start
+
+    def save(self, OutputDirectory, parameters={}):
+        """
+        Saves the trained weights (SegmentClassifier.h5) and everything needed to rebuild the model and its input graphs
+        (SegmentClassifier.json: the graph mode and the given parameters, e.g. acceptance), as used by ComptonTrackInferenceGNN.py
+        """
+        self.model.save_weights(os.path.join(OutputDirectory, "SegmentClassifier.h5"))
+        with open(os.path.join(OutputDirectory, "SegmentClassifier.json"), "w") as f:
+            json.dump(dict(parameters, graph_mode = self.GraphMode), f, indent=2)
+
+    def times(self):
+        """
+        Time spent in each stage in seconds
+        """
+        return {"Training Data Setup (Graph Representations)": self.datagen_time,
+                "Training Data Setup (Padding)": self.pad_time,
+                "Training": self.train_time,
+                "Test Data Setup (Graph Representations)": self.test_datagen_time,
+                "Test Data Setup (Padding)": self.test_pad_time,
+                "Prediction": self.pred_time,
+                "Evaluation": self.eval_time,
+                "Training Step (median)": self.step_time()}
+
+    def step_time(self):
+        """
+        Median wall time of a training step in seconds
+        """
+        if len(self.step_time_callback.step_times) == 0:
+            return 0
+        return float(np.median(self.step_time_callback.step_times))
@@ -0,0 +1,168 @@
+###################################################################################################
+#
+# GraphCache.py
+#
+# Copyright (C) by Andreas Zoglauer & Pranav Nagarajan
+# All rights reserved.
+#
+# Please see the file LICENSE in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+
+# Increase whenever the graph construction or the stored layout changes, this invalidates all existing caches
+graph_cache_version = 1
+
+# Number of graphs collected in memory before they are written as a new shard
+shard_size_default = 50000
+
+
+class CachedEvent:
+    """
+    The hit data of one event as stored in the graph cache, usable wherever GraphRepresentation expects an EventData
+    """
+
+    def __init__(self, EventID, Hits, Type, Origin):
+        self.EventID = EventID
+        self.X = Hits[:, 0]
+        self.Y = Hits[:, 1]
+        self.Z = Hits[:, 2]
+        self.E = Hits[:, 3]
+        self.Type = Type
+        self.Origin = Origin
+
+
+class GraphCache:
+    """
+    Persistent on-disk cache of graph representations, indexed by EventID.
+
+    One cache directory exists per set of parameters (e.g. acceptance and radius) for a given source file.
+    It is cleared if the source file (path, size, modification time) or the cache version no longer matches.
+    Graphs are stored in shards of flat arrays plus offsets, which are memory-mapped when loaded:
+
+      shard_NNNNN/EventID.npy      (events,)       EventID of each graph
+      shard_NNNNN/HitOffsets.npy   (events + 1,)   start of each event's hits
+      shard_NNNNN/EdgeOffsets.npy  (events + 1,)   start of each event's edges
+      shard_NNNNN/Hits.npy         (hits, 4)       X, Y, Z, E
+      shard_NNNNN/Type.npy         (hits,)
+      shard_NNNNN/Origin.npy       (hits,)
+      shard_NNNNN/EdgeIndex.npy    (2, edges)      sending and receiving hit of each edge, relative to the event
+    """
+
+    def __init__(self, directory, source_file, parameters, shard_size=shard_size_default):
+        """
+        directory: root directory of all graph caches
+        source_file: the file the events were read from
+        parameters: dictionary of everything else the graphs depend on, e.g. {"acceptance": "egpb", "radius": 25}
+        """
+        source_file = os.path.abspath(source_file)
+        stat = os.stat(source_file)
+        self.manifest = {"version": graph_cache_version, "source": source_file,
+                         "size": stat.st_size, "mtime": stat.st_mtime_ns, "parameters": parameters}
+
+        key = json.dumps({"source": source_file, "parameters": parameters}, sort_keys=True)
+        self.directory = os.path.join(directory, os.path.basename(source_file) + "." + hashlib.sha1(key.encode()).hexdigest()[:16])
+        self.shard_size = shard_size
+
+        self.shards = []
+        self.index = {}
+        self.pending = {}
+
+        manifest_file = os.path.join(self.directory, "manifest.json")
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as f:
+                if json.load(f) != json.loads(json.dumps(self.manifest)):
+                    print("Graph cache {} is outdated - clearing it".format(self.directory))
+                    shutil.rmtree(self.directory)
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+            with open(manifest_file, "w") as f:
+                json.dump(self.manifest, f, indent=2)
+
+        for name in sorted(os.listdir(self.directory)):
+            if name.startswith("shard_") and not name.endswith(".tmp"):
+                self.load_shard(os.path.join(self.directory, name))
+
+        print("Graph cache {}: {} graphs in {} shards".format(self.directory, len(self.index), len(self.shards)))
+
+    def load_shard(self, path):
+        shard = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+                 for name in ["EventID", "HitOffsets", "EdgeOffsets", "Hits", "Type", "Origin", "EdgeIndex"]}
+        number = len(self.shards)
+        self.shards.append(shard)
+        for position, EventID in enumerate(shard["EventID"].tolist()):
+            self.index[EventID] = (number, position)
+
+    def __contains__(self, EventID):
+        return EventID in self.index or EventID in self.pending
+
+    def __len__(self):
+        return len(self.index) + len(self.pending)
+
+    def get(self, EventID):
+        """
+        Returns (event, edgeIndex) of the given EventID, None if it is not in the cache
+        """
+        if EventID in self.pending:
+            Hits, Type, Origin, edgeIndex = self.pending[EventID]
+            return CachedEvent(EventID, Hits, Type, Origin), edgeIndex
+        if EventID not in self.index:
+            return None
+        number, position = self.index[EventID]
+        shard = self.shards[number]
+        h0, h1 = shard["HitOffsets"][position], shard["HitOffsets"][position + 1]
+        e0, e1 = shard["EdgeOffsets"][position], shard["EdgeOffsets"][position + 1]
+        event = CachedEvent(EventID, np.array(shard["Hits"][h0:h1]), np.array(shard["Type"][h0:h1]), np.array(shard["Origin"][h0:h1]))
+        return event, np.array(shard["EdgeIndex"][:, e0:e1])
+
+    def add(self, event, edgeIndex):
+        """
+        Queues a graph for the next shard, which is written once shard_size graphs are collected
+        """
+        if event.EventID in self:
+            return
+        self.pending[event.EventID] = (np.stack([event.X, event.Y, event.Z, event.E], axis=1),
+                                       np.asarray(event.Type), np.asarray(event.Origin), edgeIndex)
+        if len(self.pending) >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes all queued graphs as a new shard
+        """
+        if len(self.pending) == 0:
+            return
+
+        EventIDs = list(self.pending.keys())
+        Hits, Types, Origins, EdgeIndices = zip(*self.pending.values())
+        arrays = {"EventID": np.array(EventIDs, dtype=np.int64),
+                  "HitOffsets": np.cumsum([0] + [len(h) for h in Hits], dtype=np.int64),
+                  "EdgeOffsets": np.cumsum([0] + [e.shape[1] for e in EdgeIndices], dtype=np.int64),
+                  "Hits": np.concatenate(Hits).astype(np.float64),
+                  "Type": np.concatenate(Types),
+                  "Origin": np.concatenate(Origins).astype(np.int64),
+                  "EdgeIndex": np.concatenate(EdgeIndices, axis=1).astype(np.int32)}
+
+        # Write into a temporary directory first, so that an interrupted run never leaves a partial shard behind
+        number = len([name for name in os.listdir(self.directory) if name.startswith("shard_")])
+        while True:
+            path = os.path.join(self.directory, "shard_{:05d}".format(number))
+            if not os.path.exists(path) and not os.path.exists(path + ".tmp"):
+                break
+            number += 1
+        os.makedirs(path + ".tmp")
+        for name, array in arrays.items():
+            np.save(os.path.join(path + ".tmp", name + ".npy"), array)
+        os.rename(path + ".tmp", path)
+
+        self.pending = {}
+        self.load_shard(path)
+        print("Graph cache: wrote {} graphs to {}".format(len(EventIDs), path))
@@ -0,0 +1,153 @@
+###################################################################################################
+#
+# GraphLRU.py
+#
+# Copyright (C) by Andreas Zoglauer & Pranav Nagarajan
+# All rights reserved.
+#
+# Please see the file LICENSE in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PredictionSpill:
+    """
+    Append-only on-disk store for the prediction history of evicted graphs.
+    Each prediction is stored as it is kept in memory, as float16 scores of the graph's edges.
+    """
+
+    def __init__(self, directory):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.file_name = os.path.join(directory, "predictions.f16")
+        self.file = open(self.file_name, "w+b")
+        self.size = 0
+        # EventID -> list of (offset, number of values) of each spilled prediction, in order
+        self.index = {}
+
+    def __contains__(self, EventID):
+        return EventID in self.index
+
+    def keys(self):
+        return self.index.keys()
+
+    def store(self, graph):
+        """
+        Appends the graph's prediction history to the store
+        """
+        entries = self.index.setdefault(graph.EventID, [])
+        self.file.seek(self.size)
+        for values in graph.predictions:
+            self.file.write(values.tobytes())
+            entries.append((self.size, len(values)))
+            self.size += values.nbytes
+
+    def restore(self, graph):
+        """
+        Removes and returns the graph's spilled prediction history
+        """
+        history = []
+        for offset, count in self.index.pop(graph.EventID, []):
+            self.file.seek(offset)
+            history.append(np.frombuffer(self.file.read(2 * count), dtype=np.float16).copy())
+        return history
+
+
+class GraphLRU:
+    """
+    Map from EventID to graph representation, bounded in the number of graphs and/or their memory footprint.
+    When a bound is exceeded, the least recently used graphs are evicted; if a spill directory is given,
+    their prediction history is moved to disk and restored when the graph is added again.
+    A bound of 0 means unbounded.
+    """
+
+    def __init__(self, max_graphs=0, max_bytes=0, spill_directory=""):
+        self.max_graphs = max_graphs
+        self.max_bytes = max_bytes
+        self.spill = PredictionSpill(spill_directory) if spill_directory != "" else None
+
+        self.graphs = OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, EventID):
+        return EventID in self.graphs
+
+    def __len__(self):
+        return len(self.graphs)
+
+    def __iter__(self):
+        return iter(self.graphs)
+
+    def keys(self):
+        return self.graphs.keys()
+
+    def __getitem__(self, EventID):
+        graph = self.graphs[EventID]
+        self.graphs.move_to_end(EventID)
+        self.hits += 1
+        return graph
+
+    def get(self, EventID):
+        """
+        Returns the graph and marks it as most recently used, None if it is not in memory
+        """
+        if EventID not in self.graphs:
+            self.misses += 1
+            return None
+        return self[EventID]
+
+    def __setitem__(self, EventID, graph):
+        if self.spill is not None and EventID in self.spill:
+            graph.predictions = self.spill.restore(graph) + graph.predictions
+        self.graphs[EventID] = graph
+        self.graphs.move_to_end(EventID)
+        self.resize(EventID)
+
+    def __delitem__(self, EventID):
+        del self.graphs[EventID]
+        self.bytes -= self.sizes.pop(EventID)
+
+    def clear(self):
+        self.graphs.clear()
+        self.sizes.clear()
+        self.bytes = 0
+
+    def resize(self, EventID):
+        """
+        Updates the memory footprint of a graph (e.g. after a new prediction) and evicts graphs if necessary
+        """
+        self.bytes -= self.sizes.get(EventID, 0)
+        self.sizes[EventID] = self.graphs[EventID].nbytes()
+        self.bytes += self.sizes[EventID]
+        self.evict()
+
+    def evict(self):
+        # Never evict the most recently used graph
+        while len(self.graphs) > 1 and \
+              ((self.max_graphs > 0 and len(self.graphs) > self.max_graphs) or (self.max_bytes > 0 and self.bytes > self.max_bytes)):
+            EventID, graph = self.graphs.popitem(last=False)
+            self.bytes -= self.sizes.pop(EventID)
+            if self.spill is not None and len(graph.predictions) > 0:
+                self.spill.store(graph)
+            graph.predictions = []
+            self.evictions += 1
+
+    def spilledIDs(self):
+        """
+        EventIDs of graphs whose prediction history is currently on disk only
+        """
+        return list(self.spill.keys()) if self.spill is not None else []
+
+    def stats(self):
+        return "Graph map: {} graphs ({:.1f} MB), {} hits, {} misses, {} evictions".format(
+            len(self.graphs), self.bytes / 1e6, self.hits, self.misses, self.evictions)
@@ -14,8 +14,12 @@ import networkx as nx
 import numpy as np
 import os
 import random
+import threading
 
 from PIL import Image
+from scipy.spatial import cKDTree
+
+from GraphLRU import GraphLRU
 
 
 # Class for the graph representation for the detector
@@ -24,10 +28,30 @@ from PIL import Image
 radius_default = 25
 visualization_threshold = 0.5
 
+# Events with more hits than this find their radius neighbours with a KD-tree instead of a full distance matrix
+kdtree_min_hits = 64
+# Relative enlargement of the KD-tree search radius, so that float64 rounding in the tree
+# cannot lose any pair which passes the exact float32 distance check
+kdtree_radius_margin = 1e-4
+
 class GraphRepresentation:
 
     # Map of all graph representations, indexed by EventID
-    allGraphs = {}
+    # Unbounded by default, replace with a bounded GraphLRU to limit the memory use
+    allGraphs = GraphLRU()
+
+    # Optional on-disk GraphCache, consulted before building a new graph representation
+    cache = None
+
+    # Optional EdgeFilter, removes implausible candidate edges when a new graph representation is built
+    edgeFilter = None
+
+    # Number of graph representations built so far and their total number of edges
+    graphsBuilt = 0
+    edgesBuilt = 0
+
+    # Guards allGraphs and cache, graph representations may be built in several threads (e.g. tf.data map stages)
+    lock = threading.RLock()
 
     # Parameters:
     # Radius: Criterion for choosing to connect two nodes
@@ -38,70 +62,67 @@ class GraphRepresentation:
     # NOTE #
     ########
     # Do not use this to initialize graph, use GraphRepresentation.newGraphRepresentation
-    def __init__(self, event, radius=radius_default, threshold=visualization_threshold):
-
-        # Checking if distance is within criterion
-        def DistanceCheck(h1, h2):
-            dist = np.sqrt(np.sum((h1 - h2) ** 2))
-            return dist <= radius
-
-        A = np.zeros((len(event.X), len(event.X)))
+    # edgeIndex: precomputed (senders, receivers) of the event's edges, e.g. from the graph cache
+    def __init__(self, event, radius=radius_default, threshold=visualization_threshold, edgeIndex=None):
 
         # Parse the event data
         assert len(event.X) == len(event.Y) \
                == len(event.Z) == len(event.E) \
                == len(event.Type) == len(event.Origin), "Event Data size mismatch."
-        data = np.array(list(zip(event.X, event.Y, event.Z, event.E, event.Type, event.Origin)))
-        hits = data[:, :3].astype(np.float32)
-        energies = data[:, 3].astype(np.float32)
-        types = data[:, 4]
-        origins = data[:, 5].astype(np.int)
+        # Casting directly gives the same float32 values as the former round trip through a zipped string array,
+        # since numpy parses strings to float64 before narrowing them
+        data = np.stack([event.X, event.Y, event.Z, event.E], axis=1).astype(np.float32)
+        hits = data[:, :3]
+        energies = data[:, 3]
+        types = np.asarray(event.Type)
+        origins = np.asarray(event.Origin).astype(int)
 
         # Note: how can gamma_bool or compton_bool be calculated beforehand
         # when evaluating on test data?
 
         # Fill in the adjacency matrix
-        for i in range(len(hits)):
-            for j in range(i + 1, len(hits)):
-                gamma_bool = (types[i] == 'g' and types[j] == 'g')
-                compton_bool = (types[i] == 'eg' or types[j] == 'eg')
-                if compton_bool or gamma_bool or DistanceCheck(hits[i], hits[j]):
-                    A[i][j] = A[j][i] = 1
+        if edgeIndex is None:
+            A = GraphRepresentation.buildAdjacencyMatrix(hits, types, radius)
+            if GraphRepresentation.edgeFilter is not None:
+                A = GraphRepresentation.edgeFilter.apply(A, hits, energies, origins)
+        else:
+            A = np.zeros((len(hits), len(hits)))
+            A[edgeIndex[0], edgeIndex[1]] = 1
 
         # Note: Ro and Ri are technically twice as large as necessary,
         # since the number of edges already indicates half a number of edges that can never be incoming.
 
+        # Edges are numbered in row-major order of the adjacency matrix, which is the order np.nonzero returns
+        senders, receivers = np.nonzero(A)
+        num_edges = len(senders)
+        edges = np.arange(num_edges)
+
         # Create the incoming matrix, outgoing matrix, and matrix of labels
-        num_edges = int(np.sum(A))
         Ro = np.zeros((len(hits), num_edges), dtype = np.float32)
         Ri = np.zeros((len(hits), num_edges), dtype = np.float32)
         y = np.zeros(num_edges, dtype = np.float32)
         y_adj = np.zeros((len(hits), len(hits)))
         compton_arr = np.zeros(num_edges)
-        type_arr = np.empty(num_edges, dtype = "S4")
+        type_arr = np.zeros(num_edges, dtype = "S4")
 
         # Fill in the incoming matrix, outgoing matrix, and matrix of labels
-        counter = 0
-        for i in range(len(A)):
-            for j in range(len(A[0])):
-                if A[i][j]:
-                    Ro[i, counter] = 1
-                    Ri[j, counter] = 1
-                    if i + 1 == origins[j]:
-                        y_adj[i][j] = 1
-                        y[counter] = 1
-                        if types[i] == 'eg':
-                            compton_arr[counter] = 1
-                        type_arr[counter] = types[i] + types[j]
-                    counter += 1
+        Ro[senders, edges] = 1
+        Ri[receivers, edges] = 1
+        true_edges = senders + 1 == origins[receivers]
+        y[true_edges] = 1
+        y_adj[senders[true_edges], receivers[true_edges]] = 1
+        compton_arr[true_edges & (types[senders] == 'eg')] = 1
+        type_arr[true_edges] = np.char.add(types[senders[true_edges]], types[receivers[true_edges]])
 
         # Generate feature matrix of nodes
-        X = data[:, :4].astype(np.float32)
+        X = data
 
         # Visualize true edges of graph
         # VisualizeGraph(y_adj)
 
         self.graphData = [A, Ro, Ri, X, y]
+        # Edge list (sending hit, receiving hit) in the same edge order as the columns of Ro and Ri
+        self.edgeIndex = np.stack([senders, receivers]).astype(np.int32)
         self.trueAdjMatrix = y_adj
         self.XYZ = hits
         self.EventID = event.EventID
@@ -111,12 +132,13 @@ class GraphRepresentation:
         self.Compton = compton_arr
         self.Tracks = type_arr
 
-        # Stores all predicted adjacency matrices
+        # Stores all predictions, each as float16 scores of the edges in the order of edgeIndex.
+        # The dense adjacency matrix of a prediction is only built when it is drawn (toAdjacency)
         ########
         # NOTE #
         ########
         # Might create unnecessary data to be stored, but allows for post-training analysis
-        self.predictedAdjMatrices = []
+        self.predictions = []
         ########
         # NOTE #
         ########
@@ -124,15 +146,62 @@ class GraphRepresentation:
         self.threshold = threshold
 
         # Add this graph to the map of all graph representations
-        GraphRepresentation.allGraphs[self.EventID] = self
+        with GraphRepresentation.lock:
+            GraphRepresentation.allGraphs[self.EventID] = self
+            GraphRepresentation.graphsBuilt += 1
+            GraphRepresentation.edgesBuilt += num_edges
+
+    @staticmethod
+    def buildAdjacencyMatrix(hits, types, radius=radius_default):
+        # Returns the symmetric adjacency matrix of an event: two hits are connected if both are 'g' hits,
+        # if either one is an 'eg' hit, or if they are at most radius apart.
+        # Small events use a fully broadcast distance matrix, larger ones look up the radius neighbours in a KD-tree.
+        num_hits = len(hits)
+        is_gamma = types == 'g'
+        is_compton = types == 'eg'
+        A = (is_gamma[:, None] & is_gamma[None, :]) | is_compton[:, None] | is_compton[None, :]
+
+        if num_hits <= kdtree_min_hits:
+            indices = np.arange(num_hits)
+            A |= GraphRepresentation.withinRadius(hits, indices[:, None], indices[None, :], radius)
+        else:
+            # The tree works in float64, so query a slightly larger radius and
+            # repeat the float32 distance check on the candidate pairs only
+            pairs = cKDTree(hits).query_pairs(radius * (1 + kdtree_radius_margin), output_type='ndarray')
+            pairs = pairs[GraphRepresentation.withinRadius(hits, pairs[:, 0], pairs[:, 1], radius)]
+            A[pairs[:, 0], pairs[:, 1]] = A[pairs[:, 1], pairs[:, 0]] = True
+
+        np.fill_diagonal(A, False)
+        return A.astype(np.float64)
+
+    @staticmethod
+    def withinRadius(hits, first, second, radius=radius_default):
+        # Checking if distance is within criterion, for all index pairs (first, second) at once.
+        # Sums the components in the same order and precision as np.sum does for a single pair of float32 hits.
+        squared = (hits[first] - hits[second]) ** 2
+        dist = np.sqrt(squared[..., 0] + squared[..., 1] + squared[..., 2])
+        return dist <= radius
 
     @staticmethod
     def newGraphRepresentation(event, radius=radius_default, threshold=visualization_threshold):
         # Returns the graph representation of the current event if it already exists, otherwise creates a new one.
-        if event.EventID in GraphRepresentation.allGraphs:
-            return GraphRepresentation.allGraphs[event.EventID]
-        else:
-            return GraphRepresentation(event, radius=radius, threshold=threshold)
+        # With a graph cache, the edges are taken from the cache if present there, and new graphs are added to it.
+        # The graph itself is built outside of the lock, thus several threads can build graphs at the same time.
+        with GraphRepresentation.lock:
+            graph = GraphRepresentation.allGraphs.get(event.EventID)
+            if graph is not None:
+                return graph
+            cache = GraphRepresentation.cache
+            cached = cache.get(event.EventID) if cache is not None else None
+
+        if cached is not None:
+            return GraphRepresentation(event, radius=radius, threshold=threshold, edgeIndex=cached[1])
+
+        graph = GraphRepresentation(event, radius=radius, threshold=threshold)
+        if cache is not None:
+            with GraphRepresentation.lock:
+                cache.add(event, graph.edgeIndex)
+        return graph
 
     def save_graph(self, lastAdjMatrix, file):
         dimension = 'both'
@@ -151,12 +220,30 @@ class GraphRepresentation:
         plt.close()
         return
 
+    @staticmethod
+    def findGraph(EventID):
+        # Returns the graph representation with this EventID, rebuilding it from the graph cache if it was evicted.
+        # Returns None if it is neither in memory nor in the cache.
+        graph = GraphRepresentation.allGraphs.get(EventID)
+        if graph is None and GraphRepresentation.cache is not None:
+            cached = GraphRepresentation.cache.get(EventID)
+            if cached is not None:
+                graph = GraphRepresentation(cached[0], edgeIndex=cached[1])
+        return graph
+
+    # Approximate memory footprint of this graph representation in bytes
+    def nbytes(self):
+        arrays = self.graphData + [self.trueAdjMatrix, self.Compton, self.Tracks, self.edgeIndex] + self.predictions
+        return sum(array.nbytes for array in arrays)
+
     @staticmethod
     def saveAllGraphs(resultDir):
         # inefficient, runs through everything in 2N time instead of N time, but
         # its nice because we can print the id's that are going to be saved.
         ids = [id for id in list(GraphRepresentation.allGraphs.keys())
-               if len(GraphRepresentation.allGraphs[id].predictedAdjMatrices) > 0]
+               if len(GraphRepresentation.allGraphs.graphs[id].predictions) > 0]
+        # Evicted graphs with a prediction history on disk
+        ids += GraphRepresentation.allGraphs.spilledIDs()
         print("Initiate Visualizations: ID's {} to {}".format(ids[0], ids[-1]))
 
         # We don't save all graphs, only NUM_GRAPHS.
@@ -170,16 +257,19 @@ class GraphRepresentation:
             loop_iter = ids[:NUM_GRAPHS]
 
         for id in loop_iter:
+            graph = GraphRepresentation.findGraph(id)
+            if graph is None:
+                print("Unable to restore evicted graph {} - skipping it".format(id))
+                continue
             print("Saving graph {}".format(id), end="\r")
-            graph = GraphRepresentation.allGraphs[id]
-            numPred = len(graph.predictedAdjMatrices)
+            numPred = len(graph.predictions)
             graph.save_graph(graph.trueAdjMatrix, resultDir + os.path.sep + "Graph_{}_True".format(id))
             images = []
             # also feels very inefficient; saving images, then reading them, then deleting them
             # but simplest way to make GIF without finding way to load plt.savefig directly into PIL.Image.
             os.mkdir(resultDir + os.path.sep + "Graph_{}".format(id))
             for i in range(numPred):
-                adj = graph.predictedAdjMatrices[i]
+                adj = graph.toAdjacency(graph.predictions[i])
                 fname = resultDir + os.path.sep + "Graph_{}".format(id) + os.path.sep + "Pred_{}".format(i)
                 graph.save_graph(adj, fname)
                 images.append(Image.open(fname))
@@ -195,22 +285,44 @@ class GraphRepresentation:
             print("Saved!", end="\r")
 
 
-    # Given a vector of edge existence probabilities,
-    # converts to adjacency matrix and adds to the list predictedAdjMatrices
+    # Given a vector of edge existence probabilities (in the order of edgeIndex, any padding after the
+    # graph's edges is ignored), adds it as float16 vector to the list predictions
     def add_prediction(self, pred):
-        #print(pred)
-        #print(self.graphData[1][0])
-        def ConvertToAdjacency(A, output):
-            result = np.zeros((len(A), len(A[0])))
-            assert result.shape == A.shape; "Bad shape in adj conversion."
-            counter = 0
-            for i in range(len(A)):
-                for j in range(len(A[0])):
-                    if A[i][j]:
-                        result[i][j] = output[counter]
-                        counter += 1
-            return result
-        self.predictedAdjMatrices.append(ConvertToAdjacency(self.graphData[0], pred))
+        GraphRepresentation.add_predictions([self], [pred])
+
+    # Adds the predictions of a whole batch of graphs: either one vector per graph, a padded array
+    # with one row per graph (e.g. of a dense batch), or the concatenated edge scores of all graphs
+    # (1-D or a single row, e.g. of a sparse batch)
+    @staticmethod
+    def add_predictions(graphs, preds):
+        if not isinstance(preds, (list, tuple)):
+            preds = np.asarray(preds)
+            edges = [graph.edgeIndex.shape[1] for graph in graphs]
+            if preds.ndim == 2 and len(preds) == len(graphs):
+                preds = [preds[i, :edges[i]] for i in range(len(graphs))]
+            else:
+                assert preds.ndim == 1 or (preds.ndim == 2 and len(preds) == 1), "Predictions must be one row per graph or concatenated."
+                assert preds.size == sum(edges), "Concatenated predictions must have exactly one value per edge of the graphs."
+                preds = np.split(np.ravel(preds), np.cumsum(edges[:-1]))
+
+        for graph, pred in zip(graphs, preds):
+            pred = np.ravel(pred)
+            assert len(pred) >= graph.edgeIndex.shape[1], "Prediction has fewer values than the graph has edges."
+            graph.predictions.append(pred[:graph.edgeIndex.shape[1]].astype(np.float16))
+
+        # The graphs grew: update their size in the bounded map, or bring them back if they had been evicted
+        with GraphRepresentation.lock:
+            for graph in graphs:
+                if graph.EventID in GraphRepresentation.allGraphs:
+                    GraphRepresentation.allGraphs.resize(graph.EventID)
+                else:
+                    GraphRepresentation.allGraphs[graph.EventID] = graph
+
+    # Returns the dense adjacency matrix (senders in rows, receivers in columns) of a vector of edge scores
+    def toAdjacency(self, pred):
+        adj = np.zeros((len(self.XYZ), len(self.XYZ)))
+        adj[self.edgeIndex[0], self.edgeIndex[1]] = pred
+        return adj
 
 
     # Shows correct graph representation (from simulation)
@@ -219,7 +331,7 @@ class GraphRepresentation:
     # dimension: 'XZ', 'YZ', or 'both', to denote which two dimensions to project on
     # close_time: any int/float, or 'DO NOT CLOSE' to denote time before closing the visualization window
     def visualize_last_prediction(self, dimension='both', close_time="DO NOT CLOSE"):
-        lastAdjMatrix = self.predictedAdjMatrices[-1]
+        lastAdjMatrix = self.toAdjacency(self.predictions[-1])
         if dimension == 'both' or dimension == 'XZ':
             plt.figure(1)
             self.draw_hits(self.trueAdjMatrix, 'XZ')
@@ -277,6 +389,6 @@ rep = GraphRepresentation(data)
 mat = np.zeros((len(rep.graphData[1][0]))) + 0.75
 
 rep.add_prediction(mat)
-print(rep.predictedAdjMatrices[0])
+print(rep.toAdjacency(rep.predictions[0]))
 rep.visualize_last_prediction()
 '''
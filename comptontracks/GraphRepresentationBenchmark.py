@@ -0,0 +1,143 @@
+###################################################################################################
+#
+# GraphRepresentationBenchmark.py
+#
+# Copyright (C) by Andreas Zoglauer & Pranav Nagarajan
+# All rights reserved.
+#
+# Please see the file LICENSE in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+'''
+Compares the vectorized graph construction in GraphRepresentation.py against the original
+per-pair loop implementation: checks that both produce identical graphs and measures the speedup.
+Runs on random toy-like events, thus neither ROOT nor MEGAlib are needed.
+'''
+
+import argparse
+import time as t
+
+import numpy as np
+
+from GraphRepresentation import GraphRepresentation, radius_default
+
+
+class BenchmarkEvent:
+    """
+    Minimal stand-in for EventData: an electron track starting with an 'eg' hit plus a few gamma hits
+    """
+
+    def __init__(self, EventID, NumberOfHits, Rng):
+        self.EventID = EventID
+        NumberOfGammas = max(1, NumberOfHits // 5)
+        NumberOfElectrons = NumberOfHits - NumberOfGammas
+
+        Steps = Rng.normal(0, 3.0, size=(NumberOfHits, 3))
+        Steps[NumberOfElectrons:] *= 10
+        Positions = np.cumsum(Steps, axis=0)
+
+        self.ID = np.arange(1, NumberOfHits + 1)
+        self.Origin = np.arange(NumberOfHits)
+        self.Origin[NumberOfElectrons:] = Rng.integers(1, NumberOfHits, size=NumberOfGammas)
+        self.X = Positions[:, 0]
+        self.Y = Positions[:, 1]
+        self.Z = np.round(Positions[:, 2])
+        self.E = Rng.uniform(10, 500, size=NumberOfHits)
+        self.Type = np.zeros(shape=(NumberOfHits), dtype=np.dtype('U2'))
+        self.Type[:NumberOfElectrons] = "e"
+        self.Type[0] = "eg"
+        self.Type[NumberOfElectrons:] = "g"
+
+
+# The original implementation with the Python double loops, kept as reference
+def legacyGraphData(event, radius=radius_default):
+
+    def DistanceCheck(h1, h2):
+        dist = np.sqrt(np.sum((h1 - h2) ** 2))
+        return dist <= radius
+
+    A = np.zeros((len(event.X), len(event.X)))
+
+    data = np.array(list(zip(event.X, event.Y, event.Z, event.E, event.Type, event.Origin)))
+    hits = data[:, :3].astype(np.float32)
+    types = data[:, 4]
+    origins = data[:, 5].astype(int)
+
+    for i in range(len(hits)):
+        for j in range(i + 1, len(hits)):
+            gamma_bool = (types[i] == 'g' and types[j] == 'g')
+            compton_bool = (types[i] == 'eg' or types[j] == 'eg')
+            if compton_bool or gamma_bool or DistanceCheck(hits[i], hits[j]):
+                A[i][j] = A[j][i] = 1
+
+    num_edges = int(np.sum(A))
+    Ro = np.zeros((len(hits), num_edges), dtype = np.float32)
+    Ri = np.zeros((len(hits), num_edges), dtype = np.float32)
+    y = np.zeros(num_edges, dtype = np.float32)
+    y_adj = np.zeros((len(hits), len(hits)))
+    compton_arr = np.zeros(num_edges)
+    type_arr = np.zeros(num_edges, dtype = "S4")
+
+    counter = 0
+    for i in range(len(A)):
+        for j in range(len(A[0])):
+            if A[i][j]:
+                Ro[i, counter] = 1
+                Ri[j, counter] = 1
+                if i + 1 == origins[j]:
+                    y_adj[i][j] = 1
+                    y[counter] = 1
+                    if types[i] == 'eg':
+                        compton_arr[counter] = 1
+                    type_arr[counter] = types[i] + types[j]
+                counter += 1
+
+    X = data[:, :4].astype(np.float32)
+
+    return [A, Ro, Ri, X, y], y_adj, compton_arr, type_arr
+
+
+def identical(a, b):
+    return a.dtype == b.dtype and a.shape == b.shape and a.tobytes() == b.tobytes()
+
+
+parser = argparse.ArgumentParser(description='Compare the vectorized against the loop-based graph construction.')
+parser.add_argument('-n', '--events', default='2000', help='Number of random events')
+parser.add_argument('-l', '--minhits', default='2', help='Minimum number of hits per event')
+parser.add_argument('-m', '--maxhits', default='100', help='Maximum number of hits per event')
+parser.add_argument('-r', '--radius', default=str(radius_default), help='Connection radius')
+parser.add_argument('-s', '--seed', default='0', help='Random seed')
+
+args = parser.parse_args()
+
+Rng = np.random.default_rng(int(args.seed))
+Radius = float(args.radius)
+Events = [BenchmarkEvent(e, int(Rng.integers(int(args.minhits), int(args.maxhits) + 1)), Rng) for e in range(int(args.events))]
+
+# Graphs are compared and dropped right away, since keeping all dense incidence matrices
+# alive would make the timing depend on memory pressure rather than on the construction itself
+legacy_time = 0
+vectorized_time = 0
+Mismatches = 0
+for event in Events:
+    start = t.time()
+    graphData, y_adj, compton_arr, type_arr = legacyGraphData(event, Radius)
+    legacy_time += t.time() - start
+
+    start = t.time()
+    graph = GraphRepresentation(event, radius=Radius)
+    vectorized_time += t.time() - start
+    del GraphRepresentation.allGraphs[event.EventID]
+
+    Same = all(identical(a, b) for a, b in zip(graphData, graph.graphData))
+    Same = Same and identical(y_adj, graph.trueAdjMatrix) and identical(compton_arr, graph.Compton)
+    Same = Same and identical(type_arr, graph.Tracks)
+    if not Same:
+        Mismatches += 1
+        print("Mismatch in event {}".format(graph.EventID))
+
+print("Events: {}, mismatches: {}".format(len(Events), Mismatches))
+print("Loop-based construction: {:.3f} s".format(legacy_time))
+print("Vectorized construction: {:.3f} s".format(vectorized_time))
+print("Speedup: {:.1f}x".format(legacy_time / vectorized_time))
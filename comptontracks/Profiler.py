@@ -0,0 +1,174 @@
+###################################################################################################
+#
+# Profiler.py
+#
+# Copyright (C) by Andreas Zoglauer & Pranav Nagarajan
+# All rights reserved.
+#
+# Please see the file LICENSE in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+import csv
+import json
+import os
+import re
+import time as t
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def current_rss():
+    """
+    Current resident set size in bytes, None if unknown
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss():
+    """
+    Peak resident set size in bytes since the last reset_peak_rss() (or the process start), None if unknown
+    """
+    try:
+        with open("/proc/self/status") as f:
+            return int(re.search(r"VmHWM:\s+(\d+) kB", f.read()).group(1)) * 1024
+    except (OSError, AttributeError):
+        return None
+
+
+def reset_peak_rss():
+    """
+    Resets the peak resident set size to the current one, returns False if that is not possible
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class Profiler:
+    """
+    Nested wall-clock timers, counters and memory use of the stages of a run.
+
+    Stages are started and stopped explicitly (start/stop, e.g. around the steps of a script) or with the stage()
+    context manager; a stage started while another one runs is nested in it, e.g. "Training/Padding".
+    Times measured elsewhere (e.g. accumulated in a generator) are added with record(), counters with count().
+    For each timed stage the resident set size at its start and end, and its peak RSS while it ran are kept.
+    The peak is the kernel's high-water mark, which is reset whenever a stage starts or stops and folded into
+    all stages running at that moment; where it cannot be reset (e.g. not on Linux) no peak is given.
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+        # [name, start time, RSS at the start, peak RSS so far] of each running stage, outermost first
+        self.running = []
+
+    def path(self, name):
+        return "/".join([stage[0] for stage in self.running] + [name])
+
+    def update_peaks(self):
+        # The high-water mark since the last reset belongs to all running stages
+        peak = peak_rss()
+        if reset_peak_rss() == False or peak is None:
+            for stage in self.running:
+                stage[3] = None
+            return
+        for stage in self.running:
+            if stage[3] is not None:
+                stage[3] = max(stage[3], peak)
+
+    def entry(self, path):
+        if path not in self.stages:
+            self.stages[path] = {"calls": 0, "seconds": 0.0, "rss_start_mb": None, "rss_end_mb": None, "peak_rss_mb": None}
+        return self.stages[path]
+
+    def start(self, name):
+        # Create the entry now, so that it is listed before the stages nested in it
+        self.entry(self.path(name))
+        self.update_peaks()
+        rss = current_rss()
+        self.running.append([name, t.time(), rss, rss if rss is not None else 0])
+
+    def stop(self, name=None):
+        """
+        Stops the innermost running stage (which must be name, if given) and returns its duration in seconds
+        """
+        path = "/".join(stage[0] for stage in self.running)
+        self.update_peaks()
+        stage, start, rss, peak = self.running.pop()
+        if name is not None and name != stage:
+            raise ValueError("Stopping stage {} while {} is running".format(name, stage))
+
+        seconds = t.time() - start
+        entry = self.entry(path)
+        entry["calls"] += 1
+        entry["seconds"] += seconds
+        end_rss = current_rss()
+        if entry["rss_start_mb"] is None and rss is not None:
+            entry["rss_start_mb"] = rss / 1e6
+        if end_rss is not None:
+            entry["rss_end_mb"] = end_rss / 1e6
+        if peak is not None:
+            entry["peak_rss_mb"] = max(entry["peak_rss_mb"] or 0, peak / 1e6)
+        return seconds
+
+    @contextmanager
+    def stage(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def record(self, name, seconds, calls=1):
+        """
+        Adds a duration measured elsewhere as a stage nested in the currently running stage
+        """
+        entry = self.entry(self.path(name))
+        entry["calls"] += calls
+        entry["seconds"] += seconds
+
+    def count(self, name, value=1):
+        """
+        Adds to a counter, e.g. of parsed events
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        """
+        Sets a counter to a value, e.g. a ratio
+        """
+        self.counters[name] = value
+
+    def report(self):
+        lines = ["{:<60} {:>6} {:>12} {:>10} {:>10}".format("Stage", "Calls", "Time [s]", "RSS [MB]", "Peak [MB]")]
+        for path, entry in self.stages.items():
+            name = "  " * path.count("/") + path.split("/")[-1]
+            rss = "{:.1f}".format(entry["rss_end_mb"]) if entry["rss_end_mb"] is not None else "-"
+            peak = "{:.1f}".format(entry["peak_rss_mb"]) if entry["peak_rss_mb"] is not None else "-"
+            lines.append("{:<60} {:>6} {:>12.3f} {:>10} {:>10}".format(name, entry["calls"], entry["seconds"], rss, peak))
+        for name, value in self.counters.items():
+            lines.append("{}: {}".format(name, value))
+        return "\n".join(lines)
+
+    def write(self, OutputDirectory, name="Profile"):
+        """
+        Writes the stages and counters into <name>.json and <name>.csv in OutputDirectory
+        """
+        with open(os.path.join(OutputDirectory, name + ".json"), "w") as f:
+            json.dump({"stages": self.stages, "counters": self.counters}, f, indent=2, default=lambda value: value.item())
+
+        with open(os.path.join(OutputDirectory, name + ".csv"), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["kind", "name", "calls", "seconds", "rss_start_mb", "rss_end_mb", "peak_rss_mb", "value"])
+            for path, entry in self.stages.items():
+                writer.writerow(["stage", path, entry["calls"], entry["seconds"], entry["rss_start_mb"], entry["rss_end_mb"], entry["peak_rss_mb"], ""])
+            for counter, value in self.counters.items():
+                writer.writerow(["counter", counter, "", "", "", "", "", value])
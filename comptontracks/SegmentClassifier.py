@@ -0,0 +1,149 @@
+###################################################################################################
+#
+# SegmentClassifier.py
+#
+# Copyright (C) by Andreas Zoglauer & Pranav Nagarajan
+# All rights reserved.
+#
+# Please see the file LICENSE in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+'''
+The graph neural network which classifies the edges of a graph representation as true or false track segments.
+'''
+
+import tensorflow as tf
+
+
+# Definition of edge network (calculates edge weights)
+def EdgeNetwork(H, Ri, Ro, input_dim, hidden_dim):
+
+    def create_B(H):
+        # Note: In numpy transposes are memory-efficient constant time operations as they simply return
+        # a new view of the same data with adjusted strides. TensorFlow does not support strides,
+        # so transpose returns a new tensor with the items permuted.
+        # (The incidence matrices are cast to the compute precision of the layers, e.g. bfloat16)
+        bo = tf.transpose(a=tf.cast(Ro, H.dtype), perm = [0, 2, 1]) @ H
+        bi = tf.transpose(a=tf.cast(Ri, H.dtype), perm = [0, 2, 1]) @ H
+        B = tf.keras.layers.concatenate([bo, bi])
+        return B
+
+    B = tf.keras.layers.Lambda(create_B)(H)
+    layer_2 = tf.keras.layers.Dense(hidden_dim, activation = "tanh")(B)
+    layer_3 = tf.keras.layers.Dense(1, activation = "sigmoid")(layer_2)
+
+    return tf.squeeze(layer_3, axis = -1)
+
+
+# Definition of node network (computes states of nodes)
+def NodeNetwork(H, Ri, Ro, edge_weights, input_dim, output_dim):
+
+    def create_M(e):
+        bo = tf.transpose(a=tf.cast(Ro, H.dtype), perm = [0, 2, 1]) @ H
+        bi = tf.transpose(a=tf.cast(Ri, H.dtype), perm = [0, 2, 1]) @ H
+        Rwo = tf.cast(Ro, H.dtype) * e[:, None]
+        Rwi = tf.cast(Ri, H.dtype) * e[:, None]
+        mi = Rwi @ bo
+        mo = Rwo @ bi
+        M = tf.keras.layers.concatenate([mi, mo, H])
+        return M
+
+    M = tf.keras.layers.Lambda(lambda e: create_M(e))(edge_weights)
+    layer_4 = tf.keras.layers.Dense(output_dim, activation = "tanh")(M)
+    layer_5 = tf.keras.layers.Dense(output_dim, activation = "tanh")(layer_4)
+
+    return layer_5
+
+
+# Sparse variants of the edge and node network:
+# Instead of the incidence matrices Ri/Ro they take the receiving and sending hit index of each edge.
+# A batch is one large graph of all its events (batch dimension of 1), thus nothing needs to be padded.
+
+# Definition of edge network (calculates edge weights from the gathered hit features)
+def EdgeNetworkSparse(H, receivers, senders, input_dim, hidden_dim):
+
+    def create_B(H):
+        bo = tf.gather(H, senders, axis = 1, batch_dims = 1)
+        bi = tf.gather(H, receivers, axis = 1, batch_dims = 1)
+        B = tf.keras.layers.concatenate([bo, bi])
+        return B
+
+    B = tf.keras.layers.Lambda(create_B)(H)
+    layer_2 = tf.keras.layers.Dense(hidden_dim, activation = "tanh")(B)
+    layer_3 = tf.keras.layers.Dense(1, activation = "sigmoid")(layer_2)
+
+    return tf.squeeze(layer_3, axis = -1)
+
+
+# Definition of node network (sums the weighted messages per hit instead of Ri @ (Ro^T @ H))
+def NodeNetworkSparse(H, receivers, senders, edge_weights, input_dim, output_dim):
+
+    def create_M(e):
+        bo = tf.gather(H[0], senders[0])
+        bi = tf.gather(H[0], receivers[0])
+        num_hits = tf.shape(H)[1]
+        mi = tf.math.unsorted_segment_sum(e[0, :, None] * bo, receivers[0], num_hits)
+        mo = tf.math.unsorted_segment_sum(e[0, :, None] * bi, senders[0], num_hits)
+        M = tf.keras.layers.concatenate([mi[None], mo[None], H])
+        return M
+
+    M = tf.keras.layers.Lambda(lambda e: create_M(e))(edge_weights)
+    layer_4 = tf.keras.layers.Dense(output_dim, activation = "tanh")(M)
+    layer_5 = tf.keras.layers.Dense(output_dim, activation = "tanh")(layer_4)
+
+    return layer_5
+
+
+# Definition of overall network (iterates to find most probable edges)
+# precision: float32, or bfloat16 for faster inference on CPUs with bfloat16 support (the weights stay float32,
+#            thus the weights of a float32 model can be loaded; see ComparePrecision.py for the accuracy change)
+def SegmentClassifier(input_dim = 4, hidden_dim = 64, num_iters = 5, graph_mode = "dense", precision = "float32"):
+
+    if precision == "bfloat16":
+        tf.keras.mixed_precision.set_global_policy("mixed_bfloat16")
+    elif precision != "float32":
+        raise ValueError("Unsupported precision " + precision)
+    try:
+        model = SegmentClassifierModel(input_dim, hidden_dim, num_iters, graph_mode)
+    finally:
+        tf.keras.mixed_precision.set_global_policy("float32")
+
+    model.compile(optimizer = 'adam', loss = 'binary_crossentropy',
+                  metrics = ['accuracy', tf.keras.metrics.Precision(thresholds = 0.4),
+                             tf.keras.metrics.Recall(thresholds = 0.4)])
+    print(model.summary())
+
+    return model
+
+
+def SegmentClassifierModel(input_dim, hidden_dim, num_iters, graph_mode):
+
+    # PLaceholders for association matrices (or edge lists) and data matrix
+    X = tf.keras.Input(shape = (None, input_dim))
+    if graph_mode == "sparse":
+        Ri = tf.keras.Input(shape = (None,), dtype = "int32")
+        Ro = tf.keras.Input(shape = (None,), dtype = "int32")
+        edge_network, node_network = EdgeNetworkSparse, NodeNetworkSparse
+    else:
+        Ri = tf.keras.Input(shape = (None, None))
+        Ro = tf.keras.Input(shape = (None, None))
+        edge_network, node_network = EdgeNetwork, NodeNetwork
+
+    # Application of input network (creates latent representation of graph)
+    H = tf.keras.layers.Dense(hidden_dim, activation = "tanh")(X)
+    H = tf.keras.layers.concatenate([H, X])
+
+    # Application of graph neural network (generates probabilities for each edge)
+    for i in range(num_iters):
+        edge_weights = edge_network(H, Ri, Ro, input_dim + hidden_dim, hidden_dim)
+        H = node_network(H, Ri, Ro, edge_weights, input_dim + hidden_dim, hidden_dim)
+        H = tf.keras.layers.concatenate([H, X])
+
+    output_layer = edge_network(H, Ri, Ro, input_dim + hidden_dim, hidden_dim)
+
+    # The edge scores are always float32
+    output_layer = tf.cast(output_layer, tf.float32)
+
+    # Creation of model
+    return tf.keras.models.Model(inputs = [X, Ri, Ro], outputs = output_layer)
@@ -0,0 +1,204 @@
+###################################################################################################
+#
+# SimFileParser.py
+#
+# Copyright (C) by Andreas Zoglauer & Pranav Nagarajan
+# All rights reserved.
+#
+# Please see the file LICENSE in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+import collections
+import gzip
+import multiprocessing
+import os
+import tempfile
+
+import ROOT as M
+M.gSystem.Load("$(MEGALIB)/lib/libMEGAlib.so")
+
+
+# Number of events handed to a worker at once
+chunk_size_default = 2000
+
+# The geometry and the event parser of the current run, set before the workers are forked so that they inherit them
+_Geometry = None
+_ParseEvent = None
+
+
+def _parse_chunk(Header, Chunk, KeepSimStrings):
+    """
+    Worker: parses one chunk of raw sim file text
+    Returns the list of (event index in the chunk, parsed event, sim string or None) of all accepted events
+    and the number of events in the chunk
+    """
+    Handle, ChunkFileName = tempfile.mkstemp(suffix=".sim")
+    try:
+        with os.fdopen(Handle, "wb") as f:
+            f.write(Header)
+            f.write(Chunk)
+            f.write(b"EN\n")
+
+        Reader = M.MFileEventsSim(_Geometry)
+        if Reader.Open(M.MString(ChunkFileName)) == False:
+            raise IOError("Unable to open the temporary chunk file " + ChunkFileName)
+
+        Accepted = []
+        NumberOfEvents = 0
+        while True:
+            Event = Reader.GetNextEvent()
+            if not Event:
+                break
+            M.SetOwnership(Event, True)
+
+            if Event.GetNIAs() > 0:
+                Data = _ParseEvent(Event)
+                if Data is not None:
+                    Accepted.append((NumberOfEvents, Data, Event.ToSimString().Data() if KeepSimStrings else None))
+            NumberOfEvents += 1
+
+        Reader.Close()
+    finally:
+        os.remove(ChunkFileName)
+
+    return Accepted, NumberOfEvents
+
+
+class SimFileParser:
+    """
+    Parses a sim file with a pool of worker processes.
+
+    The main process only splits the (optionally gzipped) file text at the "SE" lines into chunks of events.
+    Each worker writes its chunk, prefixed with the file header, into a temporary sim file, reads it with
+    MEGAlib and runs the Python event parsing on it. The chunks are merged in file order, thus the result is
+    identical to a serial read, independent of the number of workers.
+    """
+
+    def __init__(self, FileName, GeometryName, Workers, ChunkSize=chunk_size_default):
+        self.FileName = FileName
+        self.GeometryName = GeometryName
+        self.Workers = Workers
+        self.ChunkSize = ChunkSize
+
+    def chunks(self):
+        """
+        Yields the file header, followed by the raw text of consecutive chunks of ChunkSize events
+        """
+        opener = gzip.open if self.FileName.endswith(".gz") else open
+        with opener(self.FileName, "rb") as f:
+            Header = []
+            Chunk = []
+            NumberOfEvents = 0
+            InFooter = False
+            for Line in f:
+                if Line.startswith(b"SE"):
+                    if Header is not None:
+                        yield b"".join(Header)
+                        Header = None
+                    if NumberOfEvents == self.ChunkSize:
+                        yield b"".join(Chunk)
+                        Chunk = []
+                        NumberOfEvents = 0
+                    NumberOfEvents += 1
+                    InFooter = False
+                elif Line.startswith(b"EN"):
+                    # Everything from here to the next event (if any) is the file footer, the workers add their own
+                    InFooter = True
+
+                if Header is not None:
+                    Header.append(Line)
+                elif InFooter == False:
+                    Chunk.append(Line)
+
+            if Header is not None:
+                yield b"".join(Header)
+            if NumberOfEvents > 0:
+                yield b"".join(Chunk)
+
+    def results(self, Pool, KeepSimStrings):
+        """
+        Distributes the chunks to the workers and yields their results in file order
+        """
+        Chunks = self.chunks()
+        Header = next(Chunks, b"")
+
+        # Keep a bounded number of chunks in flight, so that the file is never read much further than needed
+        Pending = collections.deque()
+        for Chunk in Chunks:
+            Pending.append(Pool.apply_async(_parse_chunk, (Header, Chunk, KeepSimStrings)))
+            if len(Pending) >= 2 * self.Workers:
+                yield Pending.popleft().get()
+        while len(Pending) > 0:
+            yield Pending.popleft().get()
+
+    def pool(self, ParseEvent):
+        """
+        Loads the geometry and forks the worker processes, which inherit it and ParseEvent (see stream)
+        """
+        global _Geometry, _ParseEvent
+
+        _Geometry = M.MDGeometryQuest()
+        if _Geometry.ScanSetupFile(M.MString(self.GeometryName)) == False:
+            raise IOError("Unable to load geometry " + self.GeometryName)
+        _ParseEvent = ParseEvent
+
+        # Fork (rather than spawn) the workers: the calling scripts cannot be re-imported, and the workers inherit the geometry
+        return multiprocessing.get_context("fork").Pool(self.Workers)
+
+    def stream(self, ParseEvent, KeepSimStrings=False, Pool=None):
+        """
+        ParseEvent: function that turns an MSimEvent (with at least one interaction) into an EventData (or anything
+                    else which can be pickled), or returns None if the event is rejected. Is called in the workers.
+        KeepSimStrings: also return the sim file text of each accepted event, e.g. to extract them
+        Pool: the workers created by pool(ParseEvent) beforehand, e.g. before a library is loaded whose threads
+              must not be forked (TensorFlow). By default they are created when the generator starts.
+
+        Yields chunk by chunk, in file order, the list of (event index in the chunk, parsed event, sim string or None)
+        of the accepted events and the number of events in the chunk. The workers stop when the generator is closed.
+        """
+        if Pool is None:
+            Pool = self.pool(ParseEvent)
+        try:
+            for Result in self.results(Pool, KeepSimStrings):
+                yield Result
+        finally:
+            Pool.terminate()
+            Pool.join()
+
+    def parse(self, ParseEvent, MaxEvents, KeepSimStrings=False, Interrupted=lambda: False, DataSets=None):
+        """
+        ParseEvent: function that turns an MSimEvent (with at least one interaction) into an EventData,
+                    or returns None if the event is rejected, e.g. by the acceptance. Is called in the workers.
+        MaxEvents: stop once that many events have been accepted
+        KeepSimStrings: also return the sim file text of each accepted event, e.g. to extract them
+        Interrupted: function polled after each chunk, stops the parsing if it returns True
+        DataSets: container with append() and len() the accepted events are added to, a new list by default
+
+        Returns the accepted events, the list of their sim strings (None if not kept), and the number of read events
+        """
+        if DataSets is None:
+            DataSets = []
+        SimStrings = []
+        NumberOfEvents = 0
+
+        Results = self.stream(ParseEvent, KeepSimStrings)
+        try:
+            for Accepted, NumberOfChunkEvents in Results:
+                Enough = False
+                for Index, Data, SimString in Accepted:
+                    DataSets.append(Data)
+                    SimStrings.append(SimString)
+                    if len(DataSets) >= MaxEvents:
+                        NumberOfChunkEvents = Index + 1
+                        Enough = True
+                        break
+                NumberOfEvents += NumberOfChunkEvents
+                print("Data sets processed: {} (out of {} read events)".format(len(DataSets), NumberOfEvents))
+
+                if Enough == True or Interrupted() == True:
+                    break
+        finally:
+            Results.close()
+
+        return DataSets, SimStrings, NumberOfEvents
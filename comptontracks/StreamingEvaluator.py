@@ -0,0 +1,150 @@
+###################################################################################################
+#
+# StreamingEvaluator.py
+#
+# Copyright (C) by Andreas Zoglauer & Pranav Nagarajan
+# All rights reserved.
+#
+# Please see the file LICENSE in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+import os
+
+import numpy as np
+
+
+# Number of equal-width score bins in [0, 1]
+score_bins_default = 1000
+
+
+class EdgeOutputWriter:
+    """
+    Appends the unpadded per-edge outputs of all events to raw files and converts them into .npy files at the end:
+
+      EdgePredictions.npy  (edges,)       predicted score, float16
+      EdgeLabels.npy       (edges,)       true edge or not, uint8
+      EdgeCompton.npy      (edges,)       true edge starting at the Compton scattering, uint8
+      EdgeTypes.npy        (edges,)       track type of true edges, e.g. b"ege", S4
+      EdgeOffsets.npy      (events + 1,)  start of each event's edges
+      EventIDs.npy         (events,)
+    """
+
+    columns = {"EdgePredictions": np.float16, "EdgeLabels": np.uint8, "EdgeCompton": np.uint8, "EdgeTypes": "S4"}
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {name: open(os.path.join(directory, name + ".raw"), "wb") for name in self.columns}
+        self.offsets = [0]
+        self.event_ids = []
+
+    def add(self, EventID, prediction, label, compton, tracks):
+        for name, values in zip(self.columns, [prediction, label, compton, tracks]):
+            self.files[name].write(np.asarray(values).astype(self.columns[name]).tobytes())
+        self.offsets.append(self.offsets[-1] + len(label))
+        self.event_ids.append(EventID)
+
+    def close(self):
+        edges = self.offsets[-1]
+        for name, f in self.files.items():
+            f.close()
+            raw = os.path.join(self.directory, name + ".raw")
+            np.save(os.path.join(self.directory, name + ".npy"), np.fromfile(raw, dtype=self.columns[name], count=edges))
+            os.remove(raw)
+        np.save(os.path.join(self.directory, "EdgeOffsets.npy"), np.array(self.offsets, dtype=np.int64))
+        np.save(os.path.join(self.directory, "EventIDs.npy"), np.array(self.event_ids, dtype=np.int64))
+
+
+class StreamingEvaluator:
+    """
+    Accumulates the edge classification results event by event in fixed-size score histograms,
+    thus the memory needed does not depend on the number of events.
+
+    Histograms are kept for true and false edges and, for true edges, per category:
+    Compton (edges starting at the Compton scattering) and each track type (GraphRepresentation.Tracks).
+    The precision-recall curve has one point per bin edge.
+    """
+
+    def __init__(self, bins=score_bins_default, threshold=0.5, output_directory=None):
+        """
+        threshold: score above which an edge counts as predicted true, for accuracy, precision and recall
+        output_directory: if given, the unpadded per-edge outputs are written there (see EdgeOutputWriter)
+        """
+        self.bins = bins
+        self.threshold = threshold
+        self.true_edges = np.zeros(bins, dtype=np.int64)
+        self.false_edges = np.zeros(bins, dtype=np.int64)
+        self.categories = {}
+        self.events = 0
+        self.writer = EdgeOutputWriter(output_directory) if output_directory is not None else None
+
+    def histogram(self, scores):
+        return np.bincount(np.clip((scores * self.bins).astype(np.int64), 0, self.bins - 1), minlength=self.bins)
+
+    def add(self, graph, prediction):
+        """
+        Adds the prediction for one graph, prediction may be padded to more edges than the graph has
+        """
+        label = graph.graphData[4]
+        scores = np.asarray(prediction, dtype=np.float64).reshape(-1)[:len(label)]
+        true = label > 0.5
+
+        self.true_edges += self.histogram(scores[true])
+        self.false_edges += self.histogram(scores[~true])
+
+        compton = graph.Compton > 0.5
+        categories = {"Compton": scores[true & compton], "Non-Compton": scores[true & ~compton]}
+        for track in np.unique(graph.Tracks[true]):
+            categories["Tracks " + track.decode()] = scores[true & (graph.Tracks == track)]
+        for name, values in categories.items():
+            if name not in self.categories:
+                self.categories[name] = np.zeros(self.bins, dtype=np.int64)
+            self.categories[name] += self.histogram(values)
+
+        if self.writer is not None:
+            self.writer.add(graph.EventID, scores, label, graph.Compton, graph.Tracks)
+        self.events += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def precision_recall_curve(self):
+        """
+        Same layout as sklearn.metrics.precision_recall_curve: precisions and recalls for increasing thresholds
+        with a final (1, 0) point, and the thresholds (the lower bin edges)
+        """
+        # Number of true and false edges with a score at or above each lower bin edge
+        tp = np.cumsum(self.true_edges[::-1])[::-1]
+        fp = np.cumsum(self.false_edges[::-1])[::-1]
+        thresholds = np.arange(self.bins) / self.bins
+
+        used = tp + fp > 0
+        precisions = np.append(tp[used] / (tp[used] + fp[used]), 1.0)
+        recalls = np.append(tp[used] / max(tp[0], 1), 0.0)
+        return precisions, recalls, thresholds[used]
+
+    def above(self, histogram):
+        # Number of entries at or above the threshold (with bin precision)
+        return histogram[int(round(self.threshold * self.bins)):].sum()
+
+    def metrics(self):
+        """
+        Accuracy, precision and recall at the threshold, and the recall of each category
+        """
+        tp = self.above(self.true_edges)
+        fp = self.above(self.false_edges)
+        positives = self.true_edges.sum()
+        negatives = self.false_edges.sum()
+        results = {"Events": self.events,
+                   "Edges": int(positives + negatives),
+                   "Accuracy": (tp + negatives - fp) / max(positives + negatives, 1),
+                   "Precision": tp / max(tp + fp, 1),
+                   "Recall": tp / max(positives, 1)}
+        for name in sorted(self.categories):
+            results["Recall " + name] = self.above(self.categories[name]) / max(self.categories[name].sum(), 1)
+        return results
+
+    def report(self):
+        return "\n".join("{}: {}".format(name, value) for name, value in self.metrics().items())
@@ -0,0 +1,214 @@
+###################################################################################################
+#
+# ToyModel.py
+#
+# Copyright (C) by Andreas Zoglauer & Pranav Nagarajan
+# All rights reserved.
+#
+# Please see the file LICENSE in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+'''
+Batched NumPy version of the toy models in EventData.createFromToyModel (V1) and createFromToyModel_V2 (V2).
+All events of a batch are simulated together, one interaction or electron step at a time.
+Needs neither ROOT nor MEGAlib, thus it can also be used in worker processes.
+'''
+
+import numpy as np
+
+from EventStore import EventStore
+
+
+# Electron rest mass in keV
+E0 = 510.998910
+
+# Initial gamma-ray energy in keV
+initial_energy = 2000.0
+
+# Same as EventData.MaxHits: the electron track of toy model V1 ends after MaxHits - 3 hits
+max_hits = 100
+
+
+def directions(theta, phi):
+    """
+    Unit vectors (n, 3) from polar and azimuthal angles, like MVector.SetMagThetaPhi(1.0, theta, phi)
+    """
+    return np.stack([np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi), np.cos(theta)], axis=1)
+
+
+def rotate_reference_frame(v, axis):
+    """
+    Vectorized MVector.RotateReferenceFrame: rotates the vectors v (n, 3), given in a frame whose z-axis is axis (n, 3),
+    into the frame in which axis is given
+    """
+    u = axis / np.linalg.norm(axis, axis=1, keepdims=True)
+    up = np.sqrt(u[:, 0] ** 2 + u[:, 1] ** 2)
+    safe = np.where(up > 0, up, 1.0)
+
+    R = np.zeros((len(v), 3, 3))
+    R[:, 0, 0] = u[:, 0] * u[:, 2] / safe
+    R[:, 0, 1] = -u[:, 1] / safe
+    R[:, 0, 2] = u[:, 0]
+    R[:, 1, 0] = u[:, 1] * u[:, 2] / safe
+    R[:, 1, 1] = u[:, 0] / safe
+    R[:, 1, 2] = u[:, 1]
+    R[:, 2, 0] = -up
+    R[:, 2, 2] = u[:, 2]
+
+    # Axis along +z or -z: unchanged or mirrored
+    flip = np.where(u[:, 2] < 0, -1.0, 1.0)
+    R[up == 0] = 0
+    R[up == 0, 0, 0] = flip[up == 0]
+    R[up == 0, 1, 1] = 1
+    R[up == 0, 2, 2] = flip[up == 0]
+
+    return np.einsum("nij,nj->ni", R, v)
+
+
+def klein_nishina(rng, Ei):
+    """
+    Samples Compton scatterings of gamma rays with energies Ei (n,) according to Butcher & Messel: Nuc Phys 20(1960), 15
+    Returns the energy fraction Epsilon of the scattered gamma ray and 1 - cos(theta) and sin(theta)^2 of its scatter angle
+    """
+    Ei_m = Ei / E0
+    Epsilon0 = 1.0 / (1.0 + 2.0 * Ei_m)
+    Epsilon0Square = Epsilon0 * Epsilon0
+    Alpha1 = -np.log(Epsilon0)
+    Alpha2 = 0.5 * (1.0 - Epsilon0Square)
+
+    Epsilon = np.zeros(len(Ei))
+    OneMinusCosTheta = np.zeros(len(Ei))
+    SinThetaSquared = np.zeros(len(Ei))
+
+    # Rejection sampling, only the so far rejected events are redrawn
+    pending = np.arange(len(Ei))
+    while len(pending) > 0:
+        a1, a2, e0s, m = Alpha1[pending], Alpha2[pending], Epsilon0Square[pending], Ei_m[pending]
+        u = rng.random((3, len(pending)))
+
+        first = a1 / (a1 + a2) > u[0]
+        eps = np.where(first, np.exp(-a1 * u[1]), np.sqrt(e0s + (1.0 - e0s) * u[1]))
+
+        omc = (1.0 - eps) / (eps * m)
+        sts = omc * (2.0 - omc)
+        reject = 1.0 - eps * sts / (1.0 + eps * eps)
+        accepted = reject < u[2]
+
+        Epsilon[pending[accepted]] = eps[accepted]
+        OneMinusCosTheta[pending[accepted]] = omc[accepted]
+        SinThetaSquared[pending[accepted]] = sts[accepted]
+        pending = pending[~accepted]
+
+    return Epsilon, OneMinusCosTheta, SinThetaSquared
+
+
+def compton(rng, Ei, Di):
+    """
+    Compton scatters gamma rays with energies Ei (n,) and directions Di (n, 3)
+    Returns energy and direction of the scattered gamma rays and the recoil electrons
+    """
+    Epsilon, OneMinusCosTheta, SinThetaSquared = klein_nishina(rng, Ei)
+    Phi = 2 * np.pi * rng.random(len(Ei))
+    SinTheta = np.sqrt(SinThetaSquared)
+
+    Eg = Epsilon * Ei
+    Ee = Ei - Eg
+
+    Dg = np.stack([SinTheta * np.cos(Phi), SinTheta * np.sin(Phi), 1.0 - OneMinusCosTheta], axis=1)
+    Dg = rotate_reference_frame(Dg, Di)
+
+    Me = np.sqrt(Ee * (Ee + 2.0 * E0))
+    De = (Ei[:, None] * Di - Eg[:, None] * Dg) / Me[:, None]
+
+    return Eg, Dg, Ee, De
+
+
+def generate(NumberOfEvents, Seed=None, Model="V2", FirstEventID=0):
+    """
+    Simulates NumberOfEvents toy events, the same seed always gives the same events
+    Model V1: Compton scattering with a random-walk electron track and the absorbed scattered gamma ray
+    Model V2: Compton scattering followed by two more Compton scatterings of the gamma ray
+    Returns an EventStore
+    """
+    rng = np.random.default_rng(Seed)
+    n = NumberOfEvents
+
+    # Random initial direction and start position (randomly within a certain volume)
+    Ei = np.full(n, initial_energy)
+    Di = directions(np.arccos(1 - 2 * rng.random(n)), 2.0 * np.pi * rng.random(n))
+    Start = 40.0 * (rng.random((n, 3)) - 0.5)
+    Start[:, 2] = np.trunc(Start[:, 2])
+
+    Eg, Dg, Ee, De = compton(rng, Ei, Di)
+
+    # Each hit is collected as (event, position in event, origin, x, y, z, energy, type)
+    Hits = []
+
+    if Model == "V1":
+        # Track the electron: all events take one step at a time until their electron has deposited all its energy
+        Active = np.arange(n)
+        Position = Start.copy()
+        Step = 0
+        while len(Active) > 0 and Step < max_hits - 3:
+            Ee_a = Ee[Active]
+
+            dE = np.zeros(len(Active))
+            redraw = np.arange(len(Active))
+            while len(redraw) > 0:
+                dE[redraw] = rng.normal(10 * np.sqrt(initial_energy - Ee_a[redraw]), 0.1 * np.sqrt(Ee_a[redraw]))
+                redraw = redraw[dE[redraw] <= 0]
+            if Step == 0:
+                dE *= rng.random(len(Active))
+            dE = np.minimum(dE, Ee_a)
+
+            Hits.append((Active, np.full(len(Active), Step), np.full(len(Active), Step), Position[Active], dE, "eg" if Step == 0 else "e"))
+
+            Ee[Active] -= dE
+
+            dAngle = (initial_energy - Ee[Active]) * 0.4 * np.pi / initial_energy
+            dEe = directions(dAngle, 2.0 * np.pi * rng.random(len(Active)))
+            De[Active] = rotate_reference_frame(De[Active], dEe)
+
+            Distance = 2.0 + 3.0 * rng.random(len(Active))
+            Position[Active] += Distance[:, None] * De[Active]
+
+            Active = Active[Ee[Active] > 0]
+            Step += 1
+
+        # Track the gamma ray: absorbed after the last electron hit
+        Events = np.arange(n)
+        Steps = np.bincount(np.concatenate([h[0] for h in Hits]), minlength=n)
+        Distance = 10.0 + 10.0 * rng.random(n)
+        Hits.append((Events, Steps, np.ones(n, dtype=int), Start + Distance[:, None] * Dg, Eg, "g"))
+
+    elif Model == "V2":
+        Events = np.arange(n)
+        Hits.append((Events, np.zeros(n, dtype=int), np.zeros(n, dtype=int), Start, Ee, "eg"))
+
+        # Track the gamma ray, all its hits are along the scatter directions from the start position
+        for Step in range(1, 3):
+            Distance = 10.0 + 10.0 * rng.random(n)
+            Hits.append((Events, np.full(n, Step), np.full(n, Step), Start + Distance[:, None] * Dg, Eg, "g"))
+            Eg, Dg, Ee, De = compton(rng, Eg, Dg)
+
+    else:
+        raise ValueError("Unknown toy model " + Model)
+
+    Event = np.concatenate([h[0] for h in Hits])
+    Position = np.concatenate([h[1] for h in Hits])
+    Order = np.lexsort((Position, Event))
+
+    Offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(Event, minlength=n), out=Offsets[1:])
+
+    return EventStore.fromColumns(EventID=np.arange(FirstEventID, FirstEventID + n),
+                                  OriginPosition=Start,
+                                  Offsets=Offsets,
+                                  ID=Position[Order] + 1,
+                                  Origin=np.concatenate([h[2] for h in Hits])[Order],
+                                  X=np.concatenate([h[3][:, 0] for h in Hits])[Order],
+                                  Y=np.concatenate([h[3][:, 1] for h in Hits])[Order],
+                                  Z=np.concatenate([h[3][:, 2] for h in Hits])[Order],
+                                  E=np.concatenate([h[4] for h in Hits])[Order],
+                                  Type=np.concatenate([np.full(len(h[0]), h[5], dtype=np.dtype('U2')) for h in Hits])[Order])
@@ -16,13 +16,140 @@
 
 import ROOT
 import array
+import hashlib
+import multiprocessing
+import multiprocessing.connection
 import os
 import sys 
+import time
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
   
   
 ###################################################################################################
 
 
+class MLPRegression:
+  """
+  The regression network of a TMVA MLP weights file, evaluated in NumPy on a whole matrix of events at once.
+  Supports the input/target normalization (VarTransform=Norm) and tanh, sigmoid, or linear hidden neurons.
+  
+  A typical usage would look like this:
+  
+  MLP = MLPRegression("Results/weights/TMVARegression_MLP.weights.xml")
+  Results = MLP.evaluate(Inputs)
+  
+  """
+
+  
+###################################################################################################
+
+
+  def __init__(self, FileName):
+    """
+    Read the network from the TMVA weights file - raises a ValueError for anything not supported
+    
+    Attributes
+    ----------
+    FileName : string
+      The TMVA weights file of the MLP (xml format)
+    
+    """
+    
+    Root = ElementTree.parse(FileName).getroot()
+    
+    Options = { O.get("name"): O.text for O in Root.iter("Option") }
+    
+    self.Variables = [ V.get("Expression") for V in Root.find("Variables") ]
+    self.Targets = [ T.get("Expression") for T in Root.find("Targets") ]
+
+    # The activation of the hidden neurons - the tanh is TMVA's fast approximation
+    Activations = { "tanh": MLPRegression.tanh, "sigmoid": lambda X: 1.0 / (1.0 + np.exp(-X)), "linear": lambda X: X }
+    if Options.get("NeuronType", "sigmoid") not in Activations:
+      raise ValueError("Unsupported neuron type: " + Options.get("NeuronType"))
+    self.Activation = Activations[Options.get("NeuronType", "sigmoid")]
+    
+    # The output neuron is linear, except with the cross entropy estimator
+    self.OutputActivation = Activations["sigmoid"] if Options.get("EstimatorType", "MSE") == "CE" else Activations["linear"]
+
+    # The normalization to [-1, 1] of the variables and targets
+    self.Minimum = None
+    self.Maximum = None
+    Transformations = list(Root.find("Transformations"))
+    if len(Transformations) > 1 or any(T.get("Name") != "Normalize" for T in Transformations):
+      raise ValueError("Only the normalization is supported as variable transformation")
+    if len(Transformations) == 1:
+      Ranges = Transformations[0].find("Class").find("Ranges")
+      Ranges = sorted(Ranges, key=lambda R: int(R.get("Index")))
+      self.Minimum = np.array([ float(R.get("Min")) for R in Ranges ])
+      self.Maximum = np.array([ float(R.get("Max")) for R in Ranges ])
+      if len(self.Minimum) != len(self.Variables) + len(self.Targets):
+        raise ValueError("The normalization does not cover all variables and targets")
+
+    # The synapse weights between the layers: each neuron lists the weights to the neurons of the next layer,
+    # the last neuron of all but the output layer is the bias neuron
+    self.Weights = []
+    Layers = sorted(Root.find("Weights").find("Layout"), key=lambda L: int(L.get("Index")))
+    for L in Layers[:-1]:
+      self.Weights.append(np.array([ [ float(W) for W in N.text.split() ] for N in L ]))
+    if self.Weights[0].shape[0] != len(self.Variables) + 1 or self.Weights[-1].shape[1] != len(self.Targets):
+      raise ValueError("The network layout does not match the variables and targets")
+
+  
+###################################################################################################
+
+
+  @staticmethod
+  def tanh(X):
+    """
+    The rational approximation of tanh used by TMVA's TActivationTanh
+    """
+    
+    X2 = X*X
+    A = X*(135135.0 + X2*(17325.0 + X2*(378.0 + X2)))
+    B = 135135.0 + X2*(62370.0 + X2*(3150.0 + X2*28.0))
+    return np.where(X > 4.97, 1.0, np.where(X < -4.97, -1.0, A/B))
+
+  
+###################################################################################################
+
+
+  def evaluate(self, Inputs):
+    """
+    Evaluate the regression of all events at once
+    
+    Attributes
+    ----------
+    Inputs : numpy array (events, variables)
+      The input variables in the order of self.Variables
+    
+    Returns
+    -------
+    numpy array (events, targets)
+      The regression results in the order of self.Targets
+      
+    """
+    
+    NVariables = len(self.Variables)
+    
+    Values = np.asarray(Inputs, dtype=np.float64)
+    if self.Minimum is not None:
+      Values = 2.0*(Values - self.Minimum[:NVariables]) / (self.Maximum[:NVariables] - self.Minimum[:NVariables]) - 1.0
+
+    for L, W in enumerate(self.Weights):
+      Values = np.concatenate([Values, np.ones((len(Values), 1))], axis=1) @ W
+      Values = self.OutputActivation(Values) if L == len(self.Weights) - 1 else self.Activation(Values)
+
+    if self.Minimum is not None:
+      Values = 0.5*(Values + 1.0) * (self.Maximum[NVariables:] - self.Minimum[NVariables:]) + self.Minimum[NVariables:]
+
+    return Values
+
+  
+###################################################################################################
+
+
 class EventClustering:
   """
   This class performs event clustering training. A typical usage would look like this:
@@ -37,7 +164,7 @@ class EventClustering:
 ###################################################################################################
 
 
-  def __init__(self, FileName, OutputPrefix, Algorithms, NetworkLayout, EnergyBins, MaxEvents):
+  def __init__(self, FileName, OutputPrefix, Algorithms, NetworkLayout, EnergyBins, MaxEvents, Batched = True, Threads = 0):
     """
     The default constructor for class EventClustering
     
@@ -53,6 +180,10 @@ class EventClustering:
       The layout of the neural network (e.g. "3*N,N")
     MaxEvents: integer
       The maximum amount of events to use
+    Batched: bool
+      Test all events at once with the network evaluated in NumPy (True), or event by event with the TMVA reader (False)
+    Threads: integer
+      The number of threads of ROOT's implicit multi-threading, e.g. of the event selection (0: all cores, 1: disabled)
     
     """ 
     
@@ -62,6 +193,8 @@ class EventClustering:
     self.NetworkLayout = NetworkLayout
     self.EnergyBins = [int(E) for E in EnergyBins.split(",")]
     self.MaxEvents = MaxEvents
+    self.Batched = Batched
+    self.Threads = Threads
     
     if len(self.EnergyBins) < 2:
       print("ERROR: You need at least 2 energy bins. Using [0, 10000]")
@@ -71,11 +204,14 @@ class EventClustering:
       print("ERROR: The output prefix is just a name not file path, thus it cannot contain any file seperators. Using \"Results\" as the prefix.")
       self.OutputPrefix = "Results"
  
+    if self.Threads != 1:
+      ROOT.EnableImplicitMT(self.Threads)
+ 
   
 ###################################################################################################
 
 
-  def train(self, TrainAll):
+  def train(self, TrainAll, Workers = 1, Resume = False):
     """
     Main training function - splits between training just the file named in the constructor (TrainAll == False)
     or training all similar files it finds, e.g. 
@@ -83,12 +219,18 @@ class EventClustering:
     - X.maxhits3.eventclusterizer.root 
     - X.maxhits4.eventclusterizer.root 
     etc.
+    Each (file, energy bin) is an independent training job. With more than one worker, the jobs run 
+    concurrently in their own processes, the largest ones first, each with its own log file <prefix>.log
     
     Attributes
     ----------
     TrainAll : bool
       Indicates if all similar files hsould be trained (== True), or just the one given in the
       constructor (== False)
+    Workers : integer
+      The number of trainings running at the same time
+    Resume : bool
+      Skip the jobs whose weights file already exists, e.g. after an interrupted run
     
     Returns
     -------
@@ -107,16 +249,54 @@ class EventClustering:
       if len(FileNames) == 0:
         print("ERROR: No usable data files found!")
         return False
-
-      for Name in FileNames:
-        for e in range(1, len(self.EnergyBins)):
-          self.trainIndividual(Name, self.EnergyBins[e-1], self.EnergyBins[e])
       
     else:
-      for e in range(1, len(self.EnergyBins)):
-        self.trainIndividual(self.FileName, self.EnergyBins[e-1], self.EnergyBins[e])
+      FileNames = [ self.FileName ]
     
-    return True
+    Jobs = []
+    for Name in FileNames:
+      for e in range(1, len(self.EnergyBins)):
+        Jobs.append((Name, self.EnergyBins[e-1], self.EnergyBins[e]))
+    
+    if Resume == True:
+      Done = [ Job for Job in Jobs if os.path.isfile(self.getWeightsFileName(self.getNumberOfHitsAndGroups(Job[0])[0], Job[1], Job[2])) ]
+      for (Name, MinimumEnergy, MaximumEnergy) in Done:
+        print("Skipping " + Name + " with energies " + str(MinimumEnergy) + "-" + str(MaximumEnergy) + ": already trained")
+      Jobs = [ Job for Job in Jobs if Job not in Done ]
+    
+    if Workers <= 1:
+      for (Name, MinimumEnergy, MaximumEnergy) in Jobs:
+        self.trainIndividual(Name, MinimumEnergy, MaximumEnergy)
+      return True
+    
+    # Largest first: the last jobs to finish are then the small ones
+    Jobs.sort(key = lambda Job: self.estimateTrainingCost(*Job), reverse = True)
+    
+    # A new spawned process for each job, at most Workers of them at a time: spawned, since the threads of ROOT 
+    # in this process do not survive a fork; and new, since TMVA keeps global state.
+    # A job fails with its process' exit code, thus also if the process dies (e.g. ROOT crashes) instead of waiting forever
+    Context = multiprocessing.get_context("spawn")
+    Running = {}
+    AllGood = True
+    while len(Jobs) > 0 or len(Running) > 0:
+      while len(Jobs) > 0 and len(Running) < Workers:
+        (Name, MinimumEnergy, MaximumEnergy) = Jobs.pop(0)
+        LogFileName = self.getFullPrefix(self.getNumberOfHitsAndGroups(Name)[0], MinimumEnergy, MaximumEnergy) + ".log"
+        print("Starting " + Name + " with energies " + str(MinimumEnergy) + "-" + str(MaximumEnergy) + " - log: " + LogFileName)
+        Process = Context.Process(target = trainJob, args = (self, Name, MinimumEnergy, MaximumEnergy, LogFileName))
+        Process.start()
+        Running[Process.sentinel] = (Process, Name, MinimumEnergy, MaximumEnergy)
+      
+      for Sentinel in multiprocessing.connection.wait(list(Running)):
+        (Process, Name, MinimumEnergy, MaximumEnergy) = Running.pop(Sentinel)
+        Process.join()
+        if Process.exitcode < 0:
+          print("ERROR: The training process was terminated by signal " + str(-Process.exitcode) + ", see its log file")
+        Good = Process.exitcode == 0
+        print(("Finished " if Good == True else "FAILED ") + Name + " with energies " + str(MinimumEnergy) + "-" + str(MaximumEnergy))
+        AllGood = AllGood and Good
+    
+    return AllGood
   
   
 ###################################################################################################
@@ -147,38 +327,15 @@ class EventClustering:
       print("Error: You need at least 2 hits for training. The data set is one with only 1 hit per event")
       return False
       
-    # Read the data tree
-    DataFile = ROOT.TFile(FileName);
-    if DataFile.IsOpen() == False:
-      print("Error: Opening DataFile")
+    # The energy filtered events, from the cache if they have been selected before
+    Columns = self.loadEvents(FileName, MinimumEnergy, MaximumEnergy)
+    if Columns == None:
       return False
 
-    # Extract the data tree
-    FullDataTree = DataFile.Get("EventClusterizer");
-    if FullDataTree == 0:
-      print("Error: Reading data tree from root file")
+    (SelectionFile, DataTree) = self.makeTree(Columns, self.getFullPrefix(NumberOfHits, MinimumEnergy, MaximumEnergy) + ".selection.root")
+    if DataTree == None:
       return False
 
-    # Filter energy
-    ROOT.gROOT.cd()
-    EnergyString = "Energy_1"
-    for i in range(1, NumberOfHits):
-      EnergyString += " + Energy_" + str(i+1)
-    
-    DataTree = FullDataTree.CopyTree("(" + EnergyString + ") >= " + str(MinimumEnergy) + " && (" + EnergyString + ") <= " + str(MaximumEnergy), "")
-    
-    # Limit the number of events:
-    if DataTree.GetEntries() > self.MaxEvents:
-      print("Reducing source tree size from " + str(DataTree.GetEntries()) + " to " + str(self.MaxEvents) + " (i.e. the maximum set)")
-      NewTree = DataTree.CloneTree(0);
-      NewTree.SetDirectory(0);
-    
-      for i in range(0, self.MaxEvents):
-        DataTree.GetEntry(i)
-        NewTree.Fill()
-    
-      DataTree = NewTree;
-
 
     # Initialize TMVA
     ROOT.TMVA.Tools.Instance()
@@ -188,7 +345,7 @@ class EventClustering:
     if not os.path.exists(self.OutputPrefix):
       os.makedirs(self.OutputPrefix)
     
-    FullPrefix = self.OutputPrefix + os.sep + self.OutputPrefix + ".hits" + str(NumberOfHits) + ".emin" + str(MinimumEnergy) + ".emax" + str(MaximumEnergy)
+    FullPrefix = self.getFullPrefix(NumberOfHits, MinimumEnergy, MaximumEnergy)
     
     ResultsFile = ROOT.TFile(FullPrefix + ".root", "RECREATE")
 
@@ -200,22 +357,22 @@ class EventClustering:
     DataLoader = ROOT.TMVA.DataLoader(FullPrefix)
 
     IgnoredBranches = [ 'SimulationID' ]  
-    Branches = DataTree.GetListOfBranches()
+    Branches = list(Columns)
 
     # We need to add everything we do not use as spectators, otherwise we do not have access after the training! (I consider this a ROOT bug!)
     for Name in IgnoredBranches:
       DataLoader.AddSpectator(Name, "F")
 
     # Add the input variables
-    for B in list(Branches):
-      if not B.GetName() in IgnoredBranches:
-        if not B.GetName().startswith("Result"):
-          DataLoader.AddVariable(B.GetName(), "F")
+    for Name in Branches:
+      if not Name in IgnoredBranches:
+        if not Name.startswith("Result"):
+          DataLoader.AddVariable(Name, "F")
 
     # Add the target variables:
-    for B in list(Branches):
-      if B.GetName().startswith("Result"):
-        DataLoader.AddTarget(B.GetName(), "F")
+    for Name in Branches:
+      if Name.startswith("Result"):
+        DataLoader.AddTarget(Name, "F")
 
 
     # Add the regressions tree with weight = 1.0
@@ -327,37 +484,10 @@ class EventClustering:
       print("Error: You need at least 2 hits for training. The data set is one with only 1 hit per event")
       return False  
   
-    # Open the data set
-    DataFile = ROOT.TFile(FileName);
-    if DataFile.IsOpen() == False:
-      print("Error: Opening data file")
-      return False
-
-    # Extract the data tree
-    FullDataTree = DataFile.Get("EventClusterizer");
-    if FullDataTree == 0:
-      print("Error: Reading data tree from root file")
+    # The energy filtered events, from the cache if they have been selected before (e.g. by the training)
+    Columns = self.loadEvents(FileName, MinimumEnergy, MaximumEnergy)
+    if Columns == None:
       return False
-    
-    # Filter energy
-    ROOT.gROOT.cd()
-    EnergyString = "Energy_1"
-    for i in range(1, NumberOfHits):
-      EnergyString += " + Energy_" + str(i+1)
-    
-    DataTree = FullDataTree.CopyTree("(" + EnergyString + ") >= " + str(MinimumEnergy) + " && (" + EnergyString + ") <= " + str(MaximumEnergy), "")
-    
-    # Limit the number of events:
-    if DataTree.GetEntries() > self.MaxEvents:
-      print("Reducing source tree size from " + str(DataTree.GetEntries()) + " to " + str(self.MaxEvents) + " (i.e. the maximum set)")
-      NewTree = DataTree.CloneTree(0);
-      NewTree.SetDirectory(0);
-    
-      for i in range(0, self.MaxEvents):
-        DataTree.GetEntry(i)
-        NewTree.Fill()
-    
-      DataTree = NewTree
       
       
 
@@ -365,7 +495,7 @@ class EventClustering:
     ROOT.TMVA.Tools.Instance()
      
     IgnoredBranches = [ 'SimulationID' ]  
-    Branches = DataTree.GetListOfBranches()
+    Branches = list(Columns)
 
     # Setup the reader:
     Reader = ROOT.TMVA.Reader("!Color:Silent");    
@@ -375,26 +505,22 @@ class EventClustering:
     # We need to add everything we do not use as spectators, otherwise we do not have access after the training! (I consider this a ROOT bug!)
     for Name in IgnoredBranches:
       VariableMap[Name] = array.array('f', [0])
-      DataTree.SetBranchAddress(Name, VariableMap[Name])
       Reader.AddSpectator(Name, VariableMap[Name])
 
     # Add the input variables
-    for B in list(Branches):
-      if not B.GetName() in IgnoredBranches:
-        if not B.GetName().startswith("Result"):
-          VariableMap[B.GetName()] = array.array('f', [0])
-          Reader.AddVariable(B.GetName(), VariableMap[B.GetName()])
-          DataTree.SetBranchAddress(B.GetName(), VariableMap[B.GetName()])
+    for Name in Branches:
+      if not Name in IgnoredBranches:
+        if not Name.startswith("Result"):
+          VariableMap[Name] = array.array('f', [0])
+          Reader.AddVariable(Name, VariableMap[Name])
 
     # Add the target variables:
-    for B in list(Branches):
-      if B.GetName().startswith("Result"):
-        VariableMap[B.GetName()] = array.array('f', [0])
-        DataTree.SetBranchAddress(B.GetName(), VariableMap[B.GetName()])
+    for Name in Branches:
+      if Name.startswith("Result"):
+        VariableMap[Name] = array.array('f', [0])
         
         
-    FileName = ROOT.TString(self.OutputPrefix + os.sep + self.OutputPrefix + ".hits" + str(NumberOfHits) + ".emin" + str(MinimumEnergy) + ".emax" + str(MaximumEnergy)
- + "/weights/TMVARegression_MLP.weights.xml")
+    FileName = ROOT.TString(self.getWeightsFileName(NumberOfHits, MinimumEnergy, MaximumEnergy))
     Reader.BookMVA("MLP", FileName)
 
     # Intialize statistics
@@ -409,41 +535,46 @@ class EventClustering:
 
 
 
-    # Read simulated the events
-    for x in range(0, min(self.MaxEvents, DataTree.GetEntries())):
-      DataTree.GetEntry(x)
+    Start = time.time()
+
+    if self.Batched == True:
+      (NEvents, NGood, NBad) = self.testBatched(Columns, Reader, VariableMap, str(FileName))
+    else:
+      # Read simulated the events
+      for x in range(0, min(self.MaxEvents, len(Columns[Branches[0]]))):
+        for Name in VariableMap:
+          VariableMap[Name][0] = Columns[Name][x]
       
-      NEvents += 1
+        NEvents += 1
       
-      # First extract the input
-      TrainingResults = []
-      for B in list(Branches):
-        Name = B.GetName()
-        if Name.startswith("ResultHitGroups"):
-          TrainingResults.append(VariableMap[Name][0])
+        # First extract the input
+        TrainingResults = []
+        for Name in Branches:
+          if Name.startswith("ResultHitGroups"):
+            TrainingResults.append(VariableMap[Name][0])
       
-      # Do the evaluation
-      MLResults = Reader.EvaluateRegression("MLP")  
+        # Do the evaluation
+        MLResults = Reader.EvaluateRegression("MLP")  
       
-      # Compare Training and ML results
-      Agree = True
-      for t, m in zip(TrainingResults, MLResults):
-        rt = round(abs(t), 0)
-        rm = round(abs(m), 0)
-        if rt != rm:
-          Agree = False
+        # Compare Training and ML results
+        Agree = True
+        for t, m in zip(TrainingResults, MLResults):
+          rt = round(abs(t), 0)
+          rm = round(abs(m), 0)
+          if rt != rm:
+            Agree = False
               
-      #print("\nSimulation ID: " + str(int(VariableMap["SimulationID"][0])) + ":")
-      #print("Energies: " + str(VariableMap["Energy_1"][0]) + " " + str(VariableMap["Energy_2"][0]) + " " + str(VariableMap["Energy_3"][0]))
-      #for t, m in zip(TrainingResults, MLResults):
-      #  print("%.1f vs %.1f" % (round(abs(t), 1), round(abs(m), 1)))
+        #print("\nSimulation ID: " + str(int(VariableMap["SimulationID"][0])) + ":")
+        #print("Energies: " + str(VariableMap["Energy_1"][0]) + " " + str(VariableMap["Energy_2"][0]) + " " + str(VariableMap["Energy_3"][0]))
+        #for t, m in zip(TrainingResults, MLResults):
+        #  print("%.1f vs %.1f" % (round(abs(t), 1), round(abs(m), 1)))
       
-      if Agree == True:
-        NGood += 1
-        #print("---> Good")
-      else:
-        NBad += 1
-        #print("---> Bad")
+        if Agree == True:
+          NGood += 1
+          #print("---> Good")
+        else:
+          NBad += 1
+          #print("---> Bad")
         
     # Dump some statistics:
     print("\n\n")
@@ -451,12 +582,298 @@ class EventClustering:
     print("All events: " + str(NEvents))
     print("Good: " + str(100*NGood/NEvents) + "%") 
     print("Bad: " + str(100*NBad/NEvents) + "%")
+    print("Throughput: {:.1f} events/s ({})".format(NEvents / (time.time() - Start), "batched NumPy evaluation" if self.Batched == True else "TMVA reader per event"))
     print("\n")
     
   
     return True
   
   
+###################################################################################################
+
+
+  def testBatched(self, Columns, Reader, VariableMap, WeightsFileName):
+    """
+    Test all events at once: the network is evaluated in NumPy on the whole matrix of events. 
+    The first events are cross-checked with the TMVA reader, which is used for all events if 
+    the network cannot be evaluated in NumPy.
+    
+    Attributes
+    ----------
+    Columns : dict of numpy arrays
+      The energy filtered events, one array per branch
+    Reader : TMVA.Reader
+      The reader with the booked MLP
+    VariableMap : dict of arrays
+      The reader's variables and spectators
+    WeightsFileName : string
+      The TMVA weights file of the MLP
+    
+    Returns
+    -------
+    (int, int, int)
+      The number of tested, good, and bad events
+      
+    """
+    
+    Names = list(Columns)
+    NEvents = min(self.MaxEvents, len(Columns[Names[0]]))
+    Columns = { Name: Values[:NEvents] for Name, Values in Columns.items() }
+    
+    def EvaluateWithReader(Entries):
+      Results = []
+      for x in Entries:
+        for Name in VariableMap:
+          VariableMap[Name][0] = Columns[Name][x]
+        Results.append(list(Reader.EvaluateRegression("MLP")))
+      return np.array(Results)
+
+    try:
+      MLP = MLPRegression(WeightsFileName)
+      MLResults = MLP.evaluate(np.stack([ Columns[Name] for Name in MLP.Variables ], axis=1))
+      
+      Check = min(100, NEvents)
+      Deviation = np.max(np.abs(EvaluateWithReader(range(0, Check)) - MLResults[:Check])) if Check > 0 else 0
+      if Deviation > 1e-3:
+        print("Warning: The NumPy network deviates from the TMVA reader by up to {} - using the reader for all events".format(Deviation))
+        MLResults = EvaluateWithReader(range(0, NEvents))
+    except ValueError as Error:
+      print("Warning: Unable to evaluate the network in NumPy ({}) - using the reader for all events".format(Error))
+      MLResults = EvaluateWithReader(range(0, NEvents))
+
+    # Compare Training and ML results: all hit groups of an event have to agree
+    TrainingResults = np.stack([ Columns[Name] for Name in Names if Name.startswith("ResultHitGroups") ], axis=1).astype(np.float64)
+    N = min(TrainingResults.shape[1], MLResults.shape[1])
+    Agree = np.all(np.round(np.abs(TrainingResults[:, :N])) == np.round(np.abs(MLResults[:, :N])), axis=1)
+    
+    NGood = int(np.count_nonzero(Agree))
+    
+    return (NEvents, NGood, NEvents - NGood)
+  
+  
+###################################################################################################
+
+
+  def estimateTrainingCost(self, FileName, MinimumEnergy, MaximumEnergy):
+    """
+    The relative cost of a training job: the number of training events times the number of hits (i.e. input variables).
+    Without selected events in the cache, the number of events of the whole file (at most MaxEvents) is used, 
+    thus the data file does not need to be filtered for the estimate
+    
+    Attributes
+    ----------
+    FileName : string
+      The file name of the data set used for training
+    MinimumEnergy, MaximumEnergy : float
+      The energy range
+    
+    Returns
+    -------
+    integer
+      The estimated cost, 0 if the file cannot be read
+        
+    """
+    
+    (NumberOfHits, NumberOfGroups) = self.getNumberOfHitsAndGroups(FileName)
+    
+    CacheFileName = self.getCacheFileName(FileName, MinimumEnergy, MaximumEnergy)
+    if os.path.isfile(CacheFileName):
+      with np.load(CacheFileName) as Cache:
+        return len(Cache[Cache.files[0]]) * NumberOfHits
+    
+    DataFile = ROOT.TFile(FileName)
+    if DataFile.IsOpen() == False:
+      return 0
+    DataTree = DataFile.Get("EventClusterizer")
+    if not DataTree:
+      return 0
+    
+    return min(DataTree.GetEntries(), self.MaxEvents) * NumberOfHits
+  
+  
+###################################################################################################
+
+
+  def getFullPrefix(self, NumberOfHits, MinimumEnergy, MaximumEnergy):
+    """
+    Return the prefix of all output of the training of one hit multiplicity and energy bin
+    """
+    
+    return self.OutputPrefix + os.sep + self.OutputPrefix + ".hits" + str(NumberOfHits) + ".emin" + str(MinimumEnergy) + ".emax" + str(MaximumEnergy)
+  
+  
+###################################################################################################
+
+
+  def getWeightsFileName(self, NumberOfHits, MinimumEnergy, MaximumEnergy):
+    """
+    Return the TMVA weights file of the MLP of one hit multiplicity and energy bin
+    """
+    
+    return self.getFullPrefix(NumberOfHits, MinimumEnergy, MaximumEnergy) + "/weights/TMVARegression_MLP.weights.xml"
+  
+  
+###################################################################################################
+
+
+  def getCacheFileName(self, FileName, MinimumEnergy, MaximumEnergy):
+    """
+    Return the cache file of the selected events of a data file and energy bin - the name contains a key
+    of the data file's path and modification time, the energy bin, and the maximum number of events,
+    thus a changed data file or selection is never read from an old cache file
+    """
+    
+    # The last element is the version of the selection: caches of the unordered multi-threaded selection (1) are not used
+    Key = repr((os.path.abspath(FileName), os.stat(FileName).st_mtime_ns, MinimumEnergy, MaximumEnergy, self.MaxEvents, 2))
+    Hash = hashlib.sha1(Key.encode()).hexdigest()[:16]
+    
+    return self.OutputPrefix + os.sep + "cache" + os.sep + os.path.basename(FileName) + ".emin" + str(MinimumEnergy) + ".emax" + str(MaximumEnergy) + "." + Hash + ".npz"
+  
+  
+###################################################################################################
+
+
+  def loadEvents(self, FileName, MinimumEnergy, MaximumEnergy):
+    """
+    Return the events of the file in the energy range, at most MaxEvents of them. They are selected from
+    the ROOT tree only the first time and then kept in a cache file with one array per branch (NumPy .npz),
+    thus repeated trainings and tests do not read and filter the ROOT tree again
+    
+    Attributes
+    ----------
+    FileName : string
+      The file name of the data set
+    MinimumEnergy, MaximumEnergy : float
+      The energy range of the summed hit energies
+    
+    Returns
+    -------
+    dict of numpy arrays
+      The events, one array per branch in the order of the branches; None in case of an error
+        
+    """
+    
+    if not os.path.isfile(FileName):
+      print("Error: Data file " + FileName + " not found")
+      return None
+    
+    CacheFileName = self.getCacheFileName(FileName, MinimumEnergy, MaximumEnergy)
+    if os.path.isfile(CacheFileName):
+      print("Reading the selected events from the cache " + CacheFileName)
+      with np.load(CacheFileName) as Cache:
+        return { Name: Cache[Name] for Name in Cache.files }
+    
+    (NumberOfHits, NumberOfGroups) = self.getNumberOfHitsAndGroups(FileName)
+    
+    # Open the data set
+    DataFile = ROOT.TFile(FileName);
+    if DataFile.IsOpen() == False:
+      print("Error: Opening data file")
+      return None
+
+    # Extract the data tree
+    FullDataTree = DataFile.Get("EventClusterizer");
+    if FullDataTree == 0:
+      print("Error: Reading data tree from root file")
+      return None
+    
+    # Filter energy and limit the number of events in one (multi-threaded) pass, directly into memory
+    Columns = self.selectEvents(FullDataTree, NumberOfHits, MinimumEnergy, MaximumEnergy)
+    DataFile.Close()
+    
+    # Write to a temporary file first, parallel jobs or interrupted runs must never leave a partial cache file
+    if not os.path.exists(os.path.dirname(CacheFileName)):
+      os.makedirs(os.path.dirname(CacheFileName), exist_ok = True)
+    TemporaryFileName = CacheFileName + "." + str(os.getpid()) + ".npz"
+    np.savez(TemporaryFileName, **Columns)
+    os.replace(TemporaryFileName, CacheFileName)
+    
+    return Columns
+  
+  
+###################################################################################################
+
+
+  def makeTree(self, Columns, SelectionFileName):
+    """
+    Write the events into a ROOT tree for the TMVA data loader
+    
+    Attributes
+    ----------
+    Columns : dict of numpy arrays
+      The events, one array per branch
+    SelectionFileName : string
+      The ROOT file to write the tree to
+    
+    Returns
+    -------
+    (TFile, TTree)
+      The file, which needs to stay open, and its data tree; (None, None) in case of an error
+        
+    """
+    
+    # FromNumpy is the name since ROOT 6.28
+    MakeNumpyDataFrame = ROOT.RDF.FromNumpy if hasattr(ROOT.RDF, "FromNumpy") else ROOT.RDF.MakeNumpyDataFrame
+    
+    # Written single-threaded, thus in the order of the arrays: TMVA's random training/testing split depends on the order
+    Threads = ROOT.GetThreadPoolSize() if ROOT.IsImplicitMTEnabled() == True else 1
+    if Threads != 1:
+      ROOT.DisableImplicitMT()
+    try:
+      MakeNumpyDataFrame(Columns).Snapshot("EventClusterizer", SelectionFileName, ROOT.std.vector['string'](list(Columns)))
+    finally:
+      if Threads != 1:
+        ROOT.EnableImplicitMT(Threads)
+    
+    SelectionFile = ROOT.TFile(SelectionFileName)
+    if SelectionFile.IsOpen() == False:
+      print("Error: Opening the selected events in " + SelectionFileName)
+      return (None, None)
+    
+    return (SelectionFile, SelectionFile.Get("EventClusterizer"))
+  
+  
+###################################################################################################
+
+
+  def selectEvents(self, FullDataTree, NumberOfHits, MinimumEnergy, MaximumEnergy):
+    """
+    Select the first MaxEvents events in the energy range with RDataFrame and return them as NumPy arrays.
+    With multi-threading (where RDataFrame has no Range) all events in the energy range are read in parallel
+    in no particular order, and then sorted by their entry number in the data tree and cut to MaxEvents.
+    
+    Attributes
+    ----------
+    FullDataTree : TTree
+      The complete data tree
+    NumberOfHits : integer
+      The number of hits of the events in this tree
+    MinimumEnergy, MaximumEnergy : float
+      The energy range of the summed hit energies
+    
+    Returns
+    -------
+    dict of numpy arrays
+      The events, one array per branch in the order of the branches
+        
+    """
+    
+    EnergyString = " + ".join([ "Energy_" + str(i+1) for i in range(0, NumberOfHits) ])
+    Names = [ B.GetName() for B in list(FullDataTree.GetListOfBranches()) ]
+    
+    DataFrame = ROOT.RDataFrame(FullDataTree).Filter("(" + EnergyString + ") >= " + str(MinimumEnergy) + " && (" + EnergyString + ") <= " + str(MaximumEnergy))
+    DataFrame = DataFrame.Define("Entry", "rdfentry_")
+    if ROOT.IsImplicitMTEnabled() == False:
+      DataFrame = DataFrame.Range(self.MaxEvents)
+    Values = DataFrame.AsNumpy(Names + [ "Entry" ])
+    
+    if len(Values["Entry"]) > self.MaxEvents:
+      print("Reducing source tree size from " + str(len(Values["Entry"])) + " to " + str(self.MaxEvents) + " (i.e. the maximum set)")
+    Order = np.argsort(Values["Entry"], kind = "stable")[:self.MaxEvents]
+    
+    return { Name: np.ascontiguousarray(Values[Name][Order]) for Name in Names }
+  
+  
 ###################################################################################################
 
 
@@ -543,5 +960,31 @@ class EventClustering:
     return FileNames
 
 
+###################################################################################################
+
+
+def trainJob(Clustering, FileName, MinimumEnergy, MaximumEnergy, LogFileName):
+  """
+  Run one training job in its own process, with all its output (including ROOT's) written to the log file.
+  The process exits with 0 if the training went well, otherwise with 1
+  """
+  
+  if not os.path.exists(os.path.dirname(LogFileName)):
+    os.makedirs(os.path.dirname(LogFileName), exist_ok = True)
+  
+  # The constructor, which enables ROOT's multi-threading, does not run again in this process
+  if Clustering.Threads != 1:
+    ROOT.EnableImplicitMT(Clustering.Threads)
+  
+  with open(LogFileName, "w") as Log:
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(Log.fileno(), 1)
+    os.dup2(Log.fileno(), 2)
+    Good = Clustering.trainIndividual(FileName, MinimumEnergy, MaximumEnergy)
+  
+  sys.exit(0 if Good == True else 1)
+
+
 # END  
 ###################################################################################################
@@ -42,26 +42,33 @@ parser.add_argument('-l', '--layout', default='3*N,N', help='Layout of the hidde
 parser.add_argument('-a', '--algorithm', default='MLP', help='Machine learning algorithm. Allowed: MLP')
 parser.add_argument('-m', '--maxevents', default='10000', help='Maximum number of events to use')
 parser.add_argument('-e', '--onlyevaluate', action='store_true', help='Only test the approach')
+parser.add_argument('-t', '--threads', default='0', help='Number of threads of ROOT\'s implicit multi-threading (0: all cores, 1: single-threaded)')
+parser.add_argument('-j', '--workers', default='1', help='Number of trainings (hit multiplicity and energy bin) running in parallel')
+parser.add_argument('-r', '--resume', action='store_true', help='Skip the trainings whose weights file already exists')
+parser.add_argument('-p', '--perevent', action='store_true', help='Test event by event with the TMVA reader instead of all events at once')
 
-args = parser.parse_args()
+# The training jobs run in spawned processes, which import this file again
+if __name__ == "__main__":
 
-AI = EventClustering(args.file, args.output, args.algorithm, args.layout, args.energy, int(args.maxevents))
+  args = parser.parse_args()
 
-if args.onlyevaluate == False:
-  if AI.train(args.complete) == False:
-    sys.exit()
+  AI = EventClustering(args.file, args.output, args.algorithm, args.layout, args.energy, int(args.maxevents), not args.perevent, int(args.threads))
+
+  if args.onlyevaluate == False:
+    if AI.train(args.complete, int(args.workers), args.resume) == False:
+      sys.exit()
 
-if AI.test(args.complete) == False:
-  sys.exit()
+  if AI.test(args.complete) == False:
+    sys.exit()
 
 
-# prevent Canvases from closing
+  # prevent Canvases from closing
 
-List = ROOT.gROOT.GetListOfCanvases()
-if List.LastIndex() > 0:
-  print("ATTENTION: Please exit by clicking: File -> Close ROOT! Do not just close the window by clicking \"x\"")
-  print("           ... and if you didn't honor this warning, and are stuck, execute the following in a new terminal: kill " + str(os.getpid()))
-  ROOT.gApplication.Run()
+  List = ROOT.gROOT.GetListOfCanvases()
+  if List.LastIndex() > 0:
+    print("ATTENTION: Please exit by clicking: File -> Close ROOT! Do not just close the window by clicking \"x\"")
+    print("           ... and if you didn't honor this warning, and are stuck, execute the following in a new terminal: kill " + str(os.getpid()))
+    ROOT.gApplication.Run()
 
 
 # END
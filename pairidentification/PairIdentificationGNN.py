@@ -55,6 +55,16 @@ MaxEvents = 1000
 FileName = "PairIdentification.p1.sim.gz"
 GeometryName = "$(MEGALIB)/resource/examples/geomega/GRIPS/GRIPS.geo.setup"
 
+# Only events with all hits in this box are used
+XMin = -43
+XMax = 43
+
+YMin = -43
+YMax = 43
+
+ZMin = 13
+ZMax = 45
+
 
 # Set in stone later
 TestingTrainingSplit = 0.8
@@ -68,6 +78,7 @@ parser.add_argument('-f', '--filename', default='PairIdentification.p1.sim.gz',
 parser.add_argument('-m', '--maxevents', default='100', help='Maximum number of events to use')
 parser.add_argument('-s', '--testingtrainigsplit', default='0.1', help='Testing-training split')
 parser.add_argument('-b', '--batchsize', default='16', help='Batch size')
+parser.add_argument('-j', '--workers', default='1', help='Number of processes parsing the sim file in parallel')
 
 # Command line arguments for build model, to remove dependency on .yaml
 parser.add_argument('--model_type', default='gnn_segment_classifier', help='model_type')
@@ -80,6 +91,7 @@ parser.add_argument('--n_iters', default='5', help='n_iters')
 # parser.add_argument('--hidden_activation', default='nn.Tanh', help='hidden_activation')
 parser.add_argument('--save', default='', help='save model to directory')
 parser.add_argument('--restore', default='', help='restore model from file path')
+parser.add_argument('--precision', default='', help='compare int8 or bfloat16 CPU inference with float32 on the validation set')
 
 
 args = parser.parse_args()
@@ -98,6 +110,8 @@ if int(args.batchsize) >= 0:
 if float(args.testingtrainigsplit) >= 0.05:
   TestingTrainingSplit = float(args.testingtrainigsplit)
 
+Workers = max(1, int(args.workers))
+
 
 if os.path.exists(OutputDirectory):
   Now = datetime.now()
@@ -130,6 +144,10 @@ signal.signal(signal.SIGINT, signal_handler)
 # Everything ROOT related can only be loaded here otherwise it interferes with the argparse
 from EventData import EventData
 
+# The parallel sim file parser and the reduced precision inference (gnn.trainer) are shared with the Compton track identification
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "comptontracks"))
+from SimFileParser import SimFileParser
+
 # Load MEGAlib into ROOT so that it is usable
 import ROOT as M
 M.gSystem.Load("$(MEGALIB)/lib/libMEGAlib.so")
@@ -182,21 +200,32 @@ elif DataType == "f":
     quit()
 
 
+  # The same event selection for the serial and the parallel read
+  def ParseEvent(Event):
+    if Event.GetNIAs() > 0:
+      Data = EventData()
+      if Data.parse(Event) == True:
+        if Data.hasHitsOutside(XMin, XMax, YMin, YMax, ZMin, ZMax) == False:
+          return Data
+    return None
+
   print("\n\nStarted reading data sets")
   NumberOfDataSets = 0
-  while NumberOfDataSets < MaxEvents:
+  if Workers > 1:
+    DataSets, _, _ = SimFileParser(FileName, GeometryName, Workers).parse(ParseEvent, MaxEvents)
+    NumberOfDataSets = len(DataSets)
+
+  while Workers == 1 and NumberOfDataSets < MaxEvents:
     Event = Reader.GetNextEvent()
     if not Event:
       break
 
-    if Event.GetNIAs() > 0:
-      Data = EventData()
-      if Data.parse(Event) == True:
-        if Data.hasHitsOutside(XMin, XMax, YMin, YMax, ZMin, ZMax) == False:
-          DataSets.append(Data)
-          NumberOfDataSets += 1
-          if NumberOfDataSets % 500 == 0:
-            print("Data sets processed: {}".format(NumberOfDataSets))
+    Data = ParseEvent(Event)
+    if Data is not None:
+      DataSets.append(Data)
+      NumberOfDataSets += 1
+      if NumberOfDataSets % 500 == 0:
+        print("Data sets processed: {}".format(NumberOfDataSets))
 
 else:
   print("Unknown data type \"{}\" Must be one of tm1, tm2, f".format(DataType))
@@ -311,6 +340,11 @@ if save_model_path:
   print('Model Save Path:', save_model_path)
   trainer.save_model(model_path=save_model_path)
 
+# Compare reduced precision inference with float32
+if args.precision != '':
+  summary_precision = trainer.compare_precision(valid_data_loader, precision=args.precision)
+  print('Inference Precision Comparison:', summary_precision)
+
 ###################################################################################################
 # Step 7: Evaluating and Visualizing the network
 ###################################################################################################
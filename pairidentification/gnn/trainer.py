@@ -14,6 +14,8 @@ from torch import nn
 
 # Internals
 from gnn.model import GNNSegmentClassifier
+# Shared with the Compton track GNN, the entry script adds comptontracks to the path
+from CERN_GNN import reduced_precision
 
 class GNNTrainer(object):
     """
@@ -157,6 +159,40 @@ class GNNTrainer(object):
                          (summary['valid_loss'], summary['valid_acc']))
         return summary
 
+    @torch.no_grad()
+    def compare_precision(self, data_loader, precision='int8', threshold=0.5):
+        """Compare a reduced precision copy of the model with the float32 model on the CPU"""
+        models = {'float32': self.model.cpu().eval(),
+                  precision: reduced_precision(self.model, precision)}
+        summary = dict()
+        for name, model in models.items():
+            true_pos, pred_pos, real_pos, n_events = 0, 0, 0, 0
+            elapsed = 0
+            for batch_input, batch_target in data_loader:
+                start_time = time.time()
+                batch_output = model([a.cpu() for a in batch_input])
+                elapsed += time.time() - start_time
+                # Only the first edges of each event are real, the padded edges have no receiving hit
+                valid = batch_input[1].sum(dim=1) > 0
+                predicted = (batch_output > threshold) & valid
+                real = (batch_target > 0.5) & valid
+                true_pos += (predicted & real).sum().item()
+                pred_pos += predicted.sum().item()
+                real_pos += real.sum().item()
+                n_events += len(batch_target)
+            summary[name] = dict(precision=true_pos / max(pred_pos, 1),
+                                 recall=true_pos / max(real_pos, 1),
+                                 events_per_second=n_events / max(elapsed, 1e-10))
+            self.logger.info('  %s: precision %.5f recall %.5f, %.1f events/s' %
+                             (name, summary[name]['precision'], summary[name]['recall'],
+                              summary[name]['events_per_second']))
+        self.logger.info('  Change with %s: precision %+.5f recall %+.5f, %.2fx events/s' %
+                         (precision, summary[precision]['precision'] - summary['float32']['precision'],
+                          summary[precision]['recall'] - summary['float32']['recall'],
+                          summary[precision]['events_per_second'] / summary['float32']['events_per_second']))
+        self.model.to(self.device)
+        return summary
+
     def train(self, train_data_loader, n_epochs, valid_data_loader=None):
         """Run the model training"""
 
@@ -18,8 +18,11 @@
 
 
 
+import functools
 import itertools
 
+import numpy as np
+
 # A) Create the multiples
 def CreateMultiples(X, Y):
   MultiplesFirst = []
@@ -42,22 +45,37 @@ def CreateMultiples(X, Y):
 
 
 # B) Create the permutations
+def MultisetPermutations(M):
+  # Yields the distinct permutations of the multiset M in lexicographic order.
+  # Each one is created directly from the previous one (next permutation), thus the
+  # duplicates itertools.permutations would create never exist.
+  P = sorted(M)
+  N = len(P)
+  while True:
+    yield list(P)
+    # The last position which can still be increased
+    I = N - 2
+    while I >= 0 and P[I] >= P[I+1]:
+      I -= 1
+    if I < 0:
+      return
+    # Swap it with the smallest larger element after it, and restart the tail at its smallest order
+    J = N - 1
+    while P[J] <= P[I]:
+      J -= 1
+    P[I], P[J] = P[J], P[I]
+    P[I+1:] = reversed(P[I+1:])
+
+
 def CreatePermutations(X, Y):
-  # A create multiples
+  # Create multiples
   Multiples = CreateMultiples(X, Y)  
   
   Permutations = []
   for M in Multiples:
-    A = []
-    Perm = itertools.permutations(M)
-    for P in Perm:
-      A.append(list(P))
-    # Remove duplicates:
-    A.sort()
-    B = list(A for A,_ in itertools.groupby(A))
     # Add them to the final list
-    for b in B:
-      Permutations.append(b)
+    for P in MultisetPermutations(M):
+      Permutations.append(P)
   
   #print(Permutations)
   
@@ -91,18 +109,32 @@ def CreateSortedStripCombinations(X, Y):
 
 
 
+# D) The strip combinations of an event with NX x and NY y strips as integer array
+@functools.lru_cache(maxsize=None)
+def StripAssignments(NX, NY):
+  # Row c of the (combinations, max(NX, NY)) array pairs strip E of the side with more strips 
+  # (the y strips if NX == NY) with strip [c, E] of the other side.
+  # The array is computed once per (NX, NY) and shared, thus it is read-only.
+  if NX > NY:
+    Permutations = CreatePermutations(NX, NY)
+  else:
+    Permutations = CreatePermutations(NY, NX)
+  
+  Assignments = np.array(Permutations, dtype=np.int16).reshape(len(Permutations), max(NX, NY))
+  Assignments.setflags(write=False)
+  
+  return Assignments
+
+
+
 # C) Create the strip combinations:
 def CreateStripCombinations(X, Y):
+  # A list of combinations, each a list of [x strip, y strip] pairs
+  Larger = range(max(X, Y))
   if X > Y:
-    Combies = CreateSortedStripCombinations(X, Y)
+    Combies = [ [ [E, int(C[E])] for E in Larger ] for C in StripAssignments(X, Y) ]
   else:
-    Combies = CreateSortedStripCombinations(Y, X)
-    # Invert
-    for C in Combies:
-      for P in C:
-        Temp = P[1]
-        P[1] = P[0]
-        P[0] = Temp
+    Combies = [ [ [int(C[E]), E] for E in Larger ] for C in StripAssignments(X, Y) ]
 
   return Combies
 
@@ -113,6 +145,7 @@ NY = 3
 Result = CreateStripCombinations(NX, NY)
       
 print(Result)
+print(StripAssignments(NX, NY))
   
   
   
@@ -21,6 +21,8 @@ import sys
 import itertools
 import permutations
 
+import numpy as np
+
   
 ###################################################################################################
 
@@ -387,33 +389,26 @@ class StripPairing:
       NX = len(XStripList)
       NY = len(YStripList)
 
-      Result = permutations.CreateStripCombinations(NX, NY)
-            
-      #print(Result)
-
-      # Make the test statistic
-      Ts = []
-      for grouping in Result:
-        N = (len(grouping))
-        total = 0
-        for pair in grouping:
-          x = pair[0]
-          y = pair[1]
-          total = total + (XStripList[x]-YStripList[y])**2
-        Ts.append(total * (1/N))
+      # All combinations as (combinations, pairs) arrays of x and y strip indices - cached per (NX, NY)
+      Assignments = permutations.StripAssignments(NX, NY)
+      Larger = np.broadcast_to(np.arange(max(NX, NY)), Assignments.shape)
+      if NX > NY:
+        XIndices, YIndices = Larger, Assignments
+      else:
+        XIndices, YIndices = Assignments, Larger
+
+      # Make the test statistic of all combinations at once
+      XEnergies = np.array(XStripList)
+      YEnergies = np.array(YStripList)
+      Ts = np.mean((XEnergies[XIndices] - YEnergies[YIndices])**2, axis=1)
     
       # Find the minimum from the test statistic
-      import numpy as np
       index_min = np.argmin(Ts)
 
       RITest = np.zeros(len(ResultInteractions)) 
       
       # If it is correct, change it to a 1
-      for pair in Result[index_min]:
-        x = pair[0]
-        y = pair[1]
-        index = x + (y*NX)
-        RITest[index] = 1
+      RITest[XIndices[index_min] + YIndices[index_min]*NX] = 1
 
       #if IsCorrectlyPaired == False:
       print("From sim:")